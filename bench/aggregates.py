@@ -0,0 +1,301 @@
+import abc
+import bisect
+import math
+from typing import Callable
+
+import numpy as np
+
+from bench.system.accelerators.accelerator import NO_INDEX, PowerSamples, index_runs
+
+# running versions of the column computations, updated with one result at a time so
+# the live table costs the same for the thousandth result as for the first. they
+# are close to but not always exactly what Column.compute gives for the same
+# results (quantiles are estimates, window energy isn't clipped to the window),
+# the exact values are computed once the test is done
+
+class Aggregate(abc.ABC):
+
+    @abc.abstractmethod
+    def add(self, result):
+        pass
+
+    @abc.abstractmethod
+    def value(self) -> float:
+        pass
+
+class Count(Aggregate):
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, result):
+        self.count += 1
+
+    def value(self):
+        return self.count
+
+class Sum(Aggregate):
+
+    def __init__(self, selector: Callable):
+        self.selector = selector
+        self.total = 0
+
+    def add(self, result):
+        self.total += self.selector(result)
+
+    def value(self):
+        return self.total
+
+class Max(Aggregate):
+
+    def __init__(self, selector: Callable):
+        self.selector = selector
+        self.max = None
+
+    def add(self, result):
+        value = self.selector(result)
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def value(self):
+        return self.max
+
+# mean and variance with welford's update, which doesn't lose precision to
+# subtracting two large sums like sum(x²) - sum(x)² does
+class Mean(Aggregate):
+
+    def __init__(self, selector: Callable):
+        self.selector = selector
+        self.count = 0
+        self.mean = 0
+        self.m2 = 0
+
+    def add(self, result):
+        value = self.selector(result)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def value(self):
+        if self.count == 0:
+            raise ZeroDivisionError("mean of no results")
+        return self.mean
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0
+
+class Ratio(Aggregate):
+
+    def __init__(self, numerator: Aggregate, denominator: Aggregate):
+        self.numerator = numerator
+        self.denominator = denominator
+
+    def add(self, result):
+        self.numerator.add(result)
+        self.denominator.add(result)
+
+    def value(self):
+        return self.numerator.value() / self.denominator.value()
+
+# a percentile estimated with the P² algorithm (Jain & Chlamtac, 1985): five markers
+# track the minimum, the maximum, the percentile and the points halfway to it, and are
+# moved along a parabola fitted through their neighbours as values come in. selectors
+# returning lists (e.g. inter token latencies) add every value, like calculate_percentile
+class Quantile(Aggregate):
+
+    def __init__(self, percentile: float, selector: Callable):
+        self.selector = selector
+        self.p = percentile / 100
+        # the first five values are kept sorted until the markers can be placed
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * self.p, 1 + 4 * self.p, 3 + 2 * self.p, 5]
+        self.increments = [0, self.p / 2, self.p, (1 + self.p) / 2, 1]
+        self.count = 0
+
+    def add(self, result):
+        value = self.selector(result)
+        for v in value if isinstance(value, list) else [value]:
+            self.observe(v)
+
+    def observe(self, x):
+        self.count += 1
+        q, n = self.heights, self.positions
+        if self.count <= 5:
+            bisect.insort(q, x)
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = int(math.copysign(1, d))
+                height = self.parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        if self.count == 0:
+            return 0
+        if self.count <= 5:
+            return float(np.percentile(self.heights, self.p * 100))
+        return self.heights[2]
+
+# the wall clock span of the results, see calculate_wall_time. open loop runs measure
+# from the scheduled arrival instead of the start
+class WallTime(Aggregate):
+
+    def __init__(self, start: str = "start_time"):
+        self.start_attribute = start
+        self.start = math.inf
+        self.end = -math.inf
+
+    def add(self, result):
+        self.start = min(self.start, getattr(result, self.start_attribute))
+        self.end = max(self.end, result.end_time)
+
+    def value(self):
+        return self.end - self.start
+
+def trapezoids(times: np.ndarray, watts: np.ndarray) -> float:
+    return float(np.sum(np.abs(np.diff(times)) * (watts[1:] + watts[:-1]) / 2))
+
+# the window energy of the results, see calculate_window_energy. every ring record is
+# counted once however many results saw it, with a trapezoid to each neighbouring record
+# of its device once both have been seen. only the ranges of indices seen so far are
+# kept, with the time and watts at their ends for the trapezoids to their neighbours.
+# touching ranges are merged, so there are only as many as there are gaps between the windows
+class WindowEnergy(Aggregate):
+
+    def __init__(self):
+        # device -> sorted [start, end, (time, watts) at start, (time, watts) at end - 1]
+        self.ranges = {}
+        self.seen = False
+        self.integral = 0
+        self.energy = 0
+        self.sampled_energy = 0
+
+    def add(self, result):
+        self.energy += result.energy
+        self.sampled_energy += result.sampled_energy
+
+        samples = PowerSamples.of(result.power_samples)
+        if len(samples) == 0:
+            return
+        self.seen = True
+        # samples that didn't come from the ring can't be matched up, count them alone
+        unindexed = samples.index == NO_INDEX
+        if unindexed.any():
+            self.integral += result.sampled_energy * int(unindexed.sum()) / len(samples)
+            samples = samples[~unindexed]
+
+        for device, start, end, position in index_runs(samples.device, samples.index):
+            window = slice(position, position + end - start)
+            self._add_run(self.ranges.setdefault(device, []), start, samples.time[window], samples.watts[window])
+
+    def _add_run(self, ranges, start, times, watts):
+        end = start + len(times)
+        gaps = []
+        position = start
+        for first, last, _, _ in ranges:
+            if first >= end:
+                break
+            if last > position and first > position:
+                gaps.append((position, first))
+            position = max(position, last)
+        if position < end:
+            gaps.append((position, end))
+
+        for a, b in gaps:
+            # the new samples with the ones next to them in this window, which were seen before
+            low, high = max(a - 1, start), min(b + 1, end)
+            self.integral += trapezoids(times[low - start:high - start], watts[low - start:high - start])
+            # and the ones next to them outside of it
+            for first, last, head, tail in ranges:
+                if a == start and last == start:
+                    self.integral += trapezoids(np.array([tail[0], times[0]]), np.array([tail[1], watts[0]]))
+                if b == end and first == end:
+                    self.integral += trapezoids(np.array([times[-1], head[0]]), np.array([watts[-1], head[1]]))
+            ranges.append([a, b, (times[a - start], watts[a - start]), (times[b - 1 - start], watts[b - 1 - start])])
+
+        # merge the ranges that touch
+        ranges.sort(key=lambda r: r[0])
+        merged = []
+        for r in ranges:
+            if merged and merged[-1][1] == r[0]:
+                merged[-1][1], merged[-1][3] = r[1], r[3]
+            else:
+                merged.append(r)
+        ranges[:] = merged
+
+    def value(self):
+        if not self.seen:
+            return self.energy
+        # scaled to the energy counter like calculate_window_energy
+        if self.sampled_energy:
+            return self.integral * self.energy / self.sampled_energy
+        return self.integral
+
+# the share of the window energy that went to one phase, see calculate_phase_energy
+class PhaseEnergy(Aggregate):
+
+    def __init__(self, attribute: str):
+        self.window = WindowEnergy()
+        self.phase = Sum(lambda r: getattr(r, attribute))
+
+    def add(self, result):
+        self.window.add(result)
+        self.phase.add(result)
+
+    def value(self):
+        if self.window.energy == 0:
+            return 0
+        return self.window.value() * self.phase.value() / self.window.energy
+
+# feeds an aggregate each result passed through `transform`, e.g. with the idle draw taken off
+class Transformed(Aggregate):
+
+    def __init__(self, aggregate: Aggregate, transform: Callable):
+        self.aggregate = aggregate
+        self.transform = transform
+
+    def add(self, result):
+        self.aggregate.add(self.transform(result))
+
+    def value(self):
+        return self.aggregate.value()
+
+class Scaled(Aggregate):
+
+    def __init__(self, aggregate: Aggregate, factor: float):
+        self.aggregate = aggregate
+        self.factor = factor
+
+    def add(self, result):
+        self.aggregate.add(result)
+
+    def value(self):
+        return self.aggregate.value() * self.factor
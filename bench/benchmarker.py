@@ -8,9 +8,12 @@ from bench import config, s3
 from bench.benchmarks.creation import CreationBenchmark
 from bench.benchmarks.hearing import HearingBenchmark
 from bench.benchmarks.language import LanguageBenchmark
+from bench.benchmarks.planner import TimePlanner, parse_time_budget, save_timings
 from bench.benchmarks.vision import VisionBenchmark
 from bench.config import CONFIG_FILE
 from bench.downloader import get_downloader
+from bench.result_store import ResultLog
+from bench.runtimes.client import get_client
 from bench.runtimes.comfy import ComfyRuntime
 from bench.runtimes.docker import DockerRuntime
 from bench.runtimes.ggml import LlamafileRuntime, WhisperfileRuntime
@@ -39,6 +42,9 @@ class Benchmarker():
 
         # a name for this benchmark run
         self.name = round(time.time())
+        self.time_budget = parse_time_budget(kwargs["time_budget"]) if kwargs.get("time_budget") else None
+        self.devices = [int(d) for d in kwargs.get("devices").split(',')] if kwargs.get("devices") else None
+        self.shard = kwargs.get("shard", False)
         self.cfg = yaml.safe_load(cfg_file)
         self.runtimes = self._init_runtimes(self.cfg['runtimes'])
         self.benchmarks = self._init_benchmarks(self.cfg['benchmarks'], **kwargs)
@@ -94,7 +100,7 @@ class Benchmarker():
         
         return runtimes
 
-    def benchmark(self, benchmark: str):
+    async def benchmark(self, benchmark: str):
         print("Gathering System Info...")
         system.print_sys_info()
 
@@ -104,13 +110,29 @@ class Benchmarker():
 
         logger.info(f"Running benchmarks: {to_run}")
 
+        if self.time_budget:
+            workers = len(system.resolve_devices(self.devices)) if self.shard else 1
+            planner = TimePlanner(self.time_budget, self.run_results_dir, system.get_accelerator_info_string(), workers)
+            for b in to_run:
+                if b in self.benchmarks:
+                    bench = self.benchmarks[b]
+                    planner.add_tests(bench.name, bench.tests, bench.available_items)
+                    bench.planner = planner
+                    bench.bench_logger.eta = planner.eta
+
+        timings = {}
         for b in to_run:
             if b in self.benchmarks:
                 bench = self.benchmarks[b]
-                bench.benchmark()
+                bench.result_log = ResultLog(os.path.join(self.run_results_dir, bench.name.lower()))
+                await bench.benchmark()
 
                 logger.info(f"Finished {b} benchmark")
 
                 bench.log_results(self.run_results_dir)
+                timings.update(bench.timings)
+                save_timings(self.run_results_dir, timings)
             else:
-                logger.warning(f"Benchmark {b} not supported")
\ No newline at end of file
+                logger.warning(f"Benchmark {b} not supported")
+
+        await get_client().close()
\ No newline at end of file
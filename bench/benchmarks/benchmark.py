@@ -1,12 +1,15 @@
 import abc
+import asyncio
+import itertools
 from dataclasses import dataclass
 import os
 import re
 import threading
 import time
 import csv
+import datetime
 
-from typing import List
+from typing import Callable, List
 
 from rich.console import Console
 from rich.table import Table
@@ -17,18 +20,41 @@ from bench import s3
 from bench.benchmarks.model import Model
 from bench.config import RUN_STORE_DIR
 from bench.logger import logger
+from bench.metrics import compute_metrics, suite_metrics
+from bench.result_store import ResultLog, compact_result_log
 from bench.datasets.dataset import CreationDataset, FileDataset, PromptDataset
 from bench.runtimes.runtime import Runtime
 from bench.system.system import system
+from bench.utils import HARNESS_PHASES, STAT_SUFFIXES, calculate_wall_time, find_free_port, Column
 from .benchmark_test import BenchmarkResult, BenchmarkTest
+from .load import run_closed_loop, run_open_loop
+from .planner import PROBE_ITEMS, TimePlanner, measure_timing
+from .repetition import DEFAULT_CONFIDENCE, DEFAULT_MAX_REPETITIONS, interval_columns, run_repetitions
+from .sweep import DEFAULT_SWEEP_LEVELS, fit_sweep, parse_slos, run_sweep, sweep_size
+from .thermal import DEFAULT_WARMUP_REQUESTS, STATE_WINDOW, cool_down, measure_baseline, warm_up
+
+DEFAULT_SLO = "p99 ttft<500"
+# seconds of idle power measured before each test, --fast skips it unless it's asked for
+DEFAULT_IDLE_WINDOW = 5
+# reported by BenchmarkTest.load_info
+LOAD_COLUMNS = ["load time", "load MB/s", "cold load time", "cold load MB/s", "ready to first token"]
+# reported by BenchmarkTest.test_info, how the power was measured
+POWER_COLUMNS = ["device", "device energy", "idle watts", "energy source"]
+# reported by BenchmarkTest.test_info, how the device was brought to a steady state
+THERMAL_COLUMNS = ["warmup requests", "warmup cv", "cooldown time"]
+# reported by BenchmarkTest.test_info in repetition mode
+REPETITION_COLUMNS = ["repetitions", "ci half width", "converged"]
 
 class Benchmark(abc.ABC):
+    # whether the suite can be driven by an open loop arrival process
+    supports_open_loop = False
 
     def __init__(self, name, cfg, runtimes: List[Runtime], benchmarker_name, **kwargs):
         # TODO set up proper logging for each benchmark
         print(f"Preparing {name} benchmark...")
 
         self.name = name
+        self.metrics = suite_metrics(name)
         self.benchmarker_name = benchmarker_name
         self.runtimes = runtimes
         self.models = [] 
@@ -37,13 +63,54 @@ class Benchmark(abc.ABC):
         self.datasets = {}
 
         self.variants = set()
+        self.concurrency_levels = [int(c) for c in str(kwargs.get("concurrency") or 1).split(',')]
+        self.rates = [float(r) for r in kwargs.get("rate").split(',')] if kwargs.get("rate") else []
+        self.arrival = kwargs.get("arrival") or "poisson"
+        self.sweep = kwargs.get("sweep", False)
+        self.slos = parse_slos(kwargs.get("slo") or DEFAULT_SLO) if self.sweep else []
+        self.sweep_levels = self.concurrency_levels if len(self.concurrency_levels) > 1 else DEFAULT_SWEEP_LEVELS
+        self.cold_start = kwargs.get("cold_start", False)
+        idle_window = kwargs.get("idle_window")
+        if idle_window is None:
+            idle_window = 0 if kwargs.get("fast") else DEFAULT_IDLE_WINDOW
+        self.idle_window = idle_window
+        # off unless asked for, they can add minutes to every test. 0 skips them
+        self.warmup_cv = kwargs.get("warmup_cv") or 0
+        self.warmup_requests = kwargs.get("warmup_requests", DEFAULT_WARMUP_REQUESTS) or 0
+        self.cooldown_timeout = kwargs.get("cooldown_timeout") or 0
+        # idle watts and temperature of each device before any test ran, what a cooldown waits for
+        self.baseline = {}
+        # repetition mode: repeat the items until every displayed column's confidence
+        # interval is within this relative tolerance, None runs every item once
+        self.tolerance = kwargs.get("tolerance")
+        self.confidence = kwargs.get("confidence") or DEFAULT_CONFIDENCE
+        self.max_repetitions = kwargs.get("max_repetitions") or DEFAULT_MAX_REPETITIONS
+        # set by the benchmarker with --time-budget, decides how many items each test runs
+        self.planner: TimePlanner = None
+        # what each test cost
+        self.timings = {}
+        # accelerators to run on unless a model picks its own, None is all of them
+        self.devices = [int(d) for d in kwargs.get("devices").split(',')] if kwargs.get("devices") else None
+        # run tests on each of the devices at the same time
+        self.shard = kwargs.get("shard", False)
+        # tests whose model picked its own devices, these are never moved
+        self.pinned_tests = []
+        # set by the benchmarker, every result is written to it as it completes
+        self.result_log: ResultLog = None
 
         logger.info(f"Preparing models for {name}")
         self._setup_tests(cfg)
         # TODO this is jank af
-        self.columns = ["status", "model", "quant"] + list(self.variants) + self.get_display_columns()
-        self.data_columns = ["status", "model", "quant", "runtime"] + list(self.variants) + self.get_columns()
+        sweep_columns = ["knee concurrency", "goodput"] if self.sweep else []
+        device_columns = ["device"] if len(system.accelerators) > 1 else []
+        self.columns = ["status", "model", "quant"] + device_columns + list(self.variants) + sweep_columns + self.get_display_columns()
+        self.data_columns = ["status", "model", "quant", "runtime"] + list(self.variants) + sweep_columns + LOAD_COLUMNS + POWER_COLUMNS + THERMAL_COLUMNS + self.get_columns()
+        if self.tolerance:
+            self.data_columns += REPETITION_COLUMNS + [f"{col.name} {suffix}" for col in interval_columns(self._benchmark_columns()) for suffix in STAT_SUFFIXES]
         self.rows = {}
+        # running aggregates of the displayed columns of each running test, see update_live
+        self.live_columns = [col for col in self._benchmark_columns() if col.display]
+        self.live = {}
 
         # TODO redo this. it could just use the state from benchmark directly?
         self.bench_logger = BenchmarkLogger(self.columns, self.name.capitalize())
@@ -76,25 +143,63 @@ class Benchmark(abc.ABC):
                 logger.warning(f"Runtime: {model_cfg.get('runtime')} not supported")
                 continue
 
-            if model_cfg.get('variants'):
-                for variant in model_cfg['variants']:
+            variants = model_cfg.get('variants') or [None]
+            # a model split across devices (e.g. llamafile's tensor split) is measured on all of them
+            devices = model_cfg.get('devices', self.devices)
+
+            # a sweep ramps the concurrency itself, the server just needs enough slots
+            if model_runtime.supports_concurrency and self.sweep:
+                variants = [{**(variant or {}), "concurrency": max(self.sweep_levels)} for variant in variants]
+            # only runtimes that can serve requests in parallel get a test per concurrency level
+            elif model_runtime.supports_concurrency and self.concurrency_levels != [1]:
+                variants = [{**(variant or {}), "concurrency": level} for variant in variants for level in self.concurrency_levels]
+
+            if self.supports_open_loop and self.rates:
+                variants = [{**(variant or {}), "rate": rate} for variant in variants for rate in self.rates]
+
+            for variant in variants:
+                if variant:
                     self.variants.update(variant.keys())
-                    self.tests.append(BenchmarkTest(model, model_runtime, variant))
-            else:
-                self.tests.append(BenchmarkTest(model, model_runtime))
+                self.tests.append(BenchmarkTest(model, model_runtime, variant, devices))
+                if 'devices' in model_cfg:
+                    self.pinned_tests.append(self.tests[-1])
+
+
+    # the columns of the suite, see bench.metrics
+    def _benchmark_columns(self) -> List[Column]:
+        return [metric.column(self) for metric in self.metrics]
 
+    def get_columns(self):
+        return [metric.name for metric in self.metrics]
 
-    @abc.abstractmethod
-    def _compute_results(self):
-        pass
+    def get_display_columns(self):
+        return [col.name for col in self._benchmark_columns() if col.display]
 
-    @abc.abstractmethod
-    def _benchmark_columns(self):
-        pass
+    def _compute_results(self, results: List[BenchmarkResult]):
+        return compute_metrics(results, self.metrics)
 
-    @abc.abstractmethod
-    def _update_display(self, tag, data):
-        pass
+    def _update_display(self, tag: str, data: dict):
+        self.bench_logger.update_row(tag, {
+            col.name: col.format(data[col.name])
+            for col in self._benchmark_columns()
+            if col.display
+        })
+
+    def print_harness_summary(self):
+        table = Table(title=f"{self.name.capitalize()} harness overhead (avg per request)", box=None)
+        table.add_column("test")
+        for phase in HARNESS_PHASES:
+            table.add_column(phase)
+        table.add_column("% of elapsed")
+
+        for tag, row in self.rows.items():
+            if "harness overhead %" not in row:
+                continue
+            table.add_row(tag,
+                          *[f"{row[f'harness {phase} ms']:.3f}ms" for phase in HARNESS_PHASES],
+                          f"{row['harness overhead %']:.2f}%")
+
+        self.bench_logger.console.print(table)
 
     def update_row(self, tag: str, data: List[BenchmarkResult], test_info: dict):
         if len(data) == 0:
@@ -105,54 +210,234 @@ class Benchmark(abc.ABC):
         self.rows[tag] = {**test_info, **computed_results}
         self._update_display(tag, self.rows[tag])
 
-    def benchmark(self):
+    # the displayed columns of a running test with `result` added, from running aggregates
+    # so every result costs the same and none have to be kept. the exact row is computed
+    # by update_row once the test is done, a displayed column without an aggregate waits for it
+    def update_live(self, test: BenchmarkTest, result: BenchmarkResult):
+        if test.tag not in self.live:
+            self.live[test.tag] = {col.name: col.aggregate() for col in self.live_columns if col.aggregate}
+        aggregates = self.live[test.tag]
+        for aggregate in aggregates.values():
+            aggregate.add(result)
+
+        self.bench_logger.update_row(test.tag, {
+            col.name: col.format(aggregates[col.name].value())
+            for col in self.live_columns if col.name in aggregates
+        })
+
+    async def benchmark(self):
         update_thread = threading.Thread(target=self.bench_logger.start_live_updates)
         update_thread.start()
 
-        total_count = sum([len(dataset.data) for _, dataset in self.datasets.items()])
+        items = [item for _, dataset in self.datasets.items() for item in dataset.data]
+
+        if self.cooldown_timeout > 0:
+            logger.info(f"Measuring the baseline power and temperature for {self.name}")
+            self.baseline = await measure_baseline(system.resolve_devices(self.devices), max(self.idle_window, STATE_WINDOW))
+
+        if self.shard and len(system.resolve_devices(self.devices)) > 1:
+            await self._run_sharded(items)
+        else:
+            for test in self.tests:
+                await self._run_test(test, items)
+
+        time.sleep(1)
+        self.bench_logger.stop()
+        time.sleep(2)
+
+        self.print_harness_summary()
+
+    # runs the tests on every device at once, one test per device. each device has a
+    # worker with its own copy of the runtimes listening on their own ports. tests whose
+    # model picked its devices, or whose runtime can't be copied, run one after another
+    # once the workers are done
+    async def _run_sharded(self, items):
+        shardable = [test for test in self.tests if test not in self.pinned_tests and test.runtime.supports_sharding]
+        queue = asyncio.Queue()
+        for test in shardable:
+            queue.put_nowait(test)
+
+        async def worker(device):
+            runtimes = {}
+            while not queue.empty():
+                test = queue.get_nowait()
+                if test.runtime.name not in runtimes:
+                    runtimes[test.runtime.name] = await asyncio.to_thread(test.runtime.for_worker, find_free_port())
+                test.runtime = runtimes[test.runtime.name]
+                test.devices = [device]
+                test.host_key = device
+                await self._run_test(test, items)
+
+        await asyncio.gather(*[worker(device) for device in system.resolve_devices(self.devices)])
 
         for test in self.tests:
-            logger.info(f"Benchmarking {test.model.name} with {test.runtime.name} runtime...")
-            self.bench_logger.add_row(test.tag, {
-                "status": f"[blue]starting[/blue]",  
-                "model": test.model.name,
-                "quant": test.model.quant,
-                **(test.variant or {})
+            if test not in shardable:
+                await self._run_test(test, items)
+
+    async def _run_test(self, test: BenchmarkTest, items):
+        total_count = len(items)
+        test_start = time.perf_counter()
+        if self.planner:
+            self.planner.test_started(test)
+
+        logger.info(f"Benchmarking {test.model.name} with {test.runtime.name} runtime...")
+        self.bench_logger.add_row(test.tag, {
+            "status": f"[blue]starting[/blue]",  
+            "model": test.model.name,
+            "quant": test.model.quant,
+            "device": ",".join(str(device) for device in test.devices),
+            **(test.variant or {})
+        })
+        if self.idle_window > 0:
+            self.bench_logger.update_row(test.tag, {
+                "status": f"[blue]idle[/blue]"
+            })
+            await test.measure_idle(self.idle_window)
+            self.bench_logger.update_row(test.tag, {
+                "status": f"[blue]starting[/blue]"
+            })
+        started = await test.start(self.cold_start)
+
+        if not started:
+            self.bench_logger.update_row(test.tag, {
+                "status": f"[red]failed[/red]",  
             })
-            started = test.start()
+            self.update_row(test.tag, test.results, test.test_info(test.results))
+            logger.info(f"Failed to start runtime: {test.runtime.name}")
+            self._record_timing(test, test_start, test.results)
+            return
+        
+        await test.runtime.warm_connections(test.concurrency)
+
+        if self.warmup_cv > 0 and self.warmup_requests > 0 and items:
+            self.bench_logger.update_row(test.tag, {
+                "status": f"[blue]warmup[/blue]"
+            })
+            test.warmup = await warm_up(test, items[0], self.warmup_cv, self.warmup_requests)
+
+        # the log has every result, they are read back from it for the row. repetition mode
+        # reads them back for its checks too
+        test.keep_results = not self.result_log
+        history = (lambda: self.result_log.results(test.tag)) if self.result_log else None
 
-            if not started:
+        def on_result(result, test=test):
+            if self.result_log:
+                self.result_log.append(test.tag, result)
+            self.bench_logger.update_row(test.tag, {
+                "status": f"[{test.result_count}/{total_count}]"
+            })
+            self.update_live(test, result)
+
+        max_repetitions = self.max_repetitions
+        levels = self.sweep_levels
+        if self.planner:
+            items, max_repetitions, levels = await self._plan_items(test, items, on_result, test_start)
+            total_count = test.result_count + len(items)
+
+        self.bench_logger.update_row(test.tag, {
+            "status": f"[{test.result_count}/{total_count}]"
+        })
+
+        if self.sweep and test.runtime.supports_concurrency:
+            def on_level(level, count, test=test):
+                nonlocal total_count
+                total_count = test.result_count + count
+                # every level starts over with no results
+                self.live.pop(test.tag, None)
                 self.bench_logger.update_row(test.tag, {
-                    "status": f"[red]failed[/red]",  
+                    "status": f"[sweep {level}]"
                 })
-                self.update_row(test.tag, test.results, test.test_info())
-                logger.info(f"Failed to start runtime: {test.runtime.name}")
-                continue
-            
-            count = 0
 
-            for _, dataset in self.datasets.items():
-                for test_item in dataset.data:
-                    count += 1
-                    self.bench_logger.update_row(test.tag, {
-                        "status": f"[{count}/{total_count}]"
-                    })
-
-                    test.run(test_item)
-                    self.update_row(test.tag, test.results, test.test_info())
+            test.sweep = await run_sweep(test, items, levels, self.slos, on_result, on_level)
+            self.bench_logger.update_row(test.tag, {
+                "knee concurrency": test.sweep.knee_concurrency,
+                "goodput": f"{round(test.sweep.goodput, 2)} req/s",
+            })
+        elif test.rate:
+            await run_open_loop(test, items, test.rate, self.arrival, test.concurrency, on_result)
+        elif self.tolerance:
+            def on_check(repetition, test=test):
+                self.bench_logger.update_row(test.tag, {
+                    "status": f"[{repetition.results} ±{repetition.half_width:.1%}]"
+                })
 
+            columns = self._benchmark_columns()
+            test.repetition = await run_repetitions(test, items, [col for col in columns if col.display], columns,
+                                                    self.tolerance, self.confidence, max_repetitions,
+                                                    test.concurrency, on_result, on_check, history)
+        else:
+            await run_closed_loop(test, items, test.concurrency, on_result)
+
+        self.bench_logger.update_row(test.tag, {
+            "status": f"[green]success[/green]"
+        })
+
+        await asyncio.to_thread(test.stop)
+        self.live.pop(test.tag, None)
+        results = test.results
+        if self.result_log:
+            # a sweep's row is the knee level's
+            results = await asyncio.to_thread(self.result_log.results, test.tag, test.sweep.level if test.sweep else None)
+        self.update_row(test.tag, results, test.test_info(results))
+        throttled = self.rows.get(test.tag, {}).get("throttled %", 0)
+        if throttled > 0:
+            logger.warning(f"{test.tag} was throttled for {throttled:.1f}% of the run, results may be limited by power or cooling")
+
+        if self.cooldown_timeout > 0:
+            self.bench_logger.update_row(test.tag, {
+                "status": f"[blue]cooldown[/blue]"
+            })
+            test.cooldown_time = await cool_down(test.devices, self.baseline, self.cooldown_timeout)
             self.bench_logger.update_row(test.tag, {
                 "status": f"[green]success[/green]"
             })
+            self.update_row(test.tag, results, test.test_info(results))
 
-            test.stop()
-            self.update_row(test.tag, test.results, test.test_info())
-            time.sleep(1)
-
+        self._record_timing(test, test_start, results)
 
-        time.sleep(1)
-        self.bench_logger.stop()
-        time.sleep(2)
+    # how many items the time budget has for the test. one that has never run before is
+    # probed first to see what its items and everything before them cost. returns the
+    # items left to run, the passes over them repetition mode can make and the sweep levels
+    async def _plan_items(self, test: BenchmarkTest, items, on_result, test_start):
+        if not self.planner.known(test):
+            self.bench_logger.update_row(test.tag, {
+                "status": f"[blue]probe[/blue]"
+            })
+            overhead = time.perf_counter() - test_start
+            probe = []
+            def on_probe_result(result):
+                probe.append(result)
+                on_result(result)
+            await run_closed_loop(test, items[:PROBE_ITEMS], test.concurrency, on_probe_result)
+            self.planner.observe_probe(test, probe, overhead)
+
+        count = self.planner.items_for(test)
+        if self.sweep and test.runtime.supports_concurrency:
+            # a sweep starts over at every level, the probe only told the planner what an item costs
+            items, levels = fit_sweep(items, self.sweep_levels, count)
+            return items, self.max_repetitions, levels
+        if self.tolerance:
+            # repetition mode repeats items itself, the plan caps how many it runs in total
+            planned = list(itertools.islice(itertools.cycle(items), count))
+            return planned[test.result_count:], 1, self.sweep_levels
+        return items[test.result_count:count], self.max_repetitions, self.sweep_levels
+
+    # what the test cost, written to timings.json for planning later runs
+    def _record_timing(self, test: BenchmarkTest, test_start, results):
+        timing = None
+        if results:
+            overhead = time.perf_counter() - test_start - calculate_wall_time(results)
+            timing = measure_timing(self.name, results, max(overhead, 0))
+            self.timings[test.tag] = timing
+        if self.planner:
+            self.planner.test_finished(test, timing)
+
+    # items the suite can run for a test, a sweep runs the items at every level
+    def available_items(self, test: BenchmarkTest):
+        count = sum(len(dataset.data) for dataset in self.datasets.values())
+        if self.sweep and test.runtime.supports_concurrency:
+            return sweep_size(count, self.sweep_levels)
+        return count * self.max_repetitions if self.tolerance else count
 
     def log_results(self, run_dir):
         run_results_name = run_dir.split("/")[-1]
@@ -168,6 +453,11 @@ class Benchmark(abc.ABC):
         # upload to s3 if configured
         s3.upload_file(run_path, f"to_process/{run_results_name}/{self.name.lower()}.csv")
 
+        # every request with its raw telemetry, to recompute the columns from without the hardware
+        if self.result_log:
+            self.result_log.close()
+            compact_result_log(self.result_log.path, self.rows)
+
 
 def get_benchmark_color(name):
     if name == "language":
@@ -185,6 +475,8 @@ class BenchmarkLogger():
     def __init__(self, columns, title: str):
         self.columns = columns
         self.title = title
+        # seconds left in the run, shown under the table when set
+        self.eta: Callable[[], float] = None
         self.rows = {}
         self.console = Console()
         self.lock = threading.Lock()
@@ -198,7 +490,8 @@ class BenchmarkLogger():
             table.add_column(column)
         for row in self.rows.values():
             table.add_row(*[str(row.get(col, "")) for col in self.columns])
-        return Panel.fit(table, title=self.title, border_style=self.border_color)
+        subtitle = f"ETA {datetime.timedelta(seconds=round(self.eta()))}" if self.eta else None
+        return Panel.fit(table, title=self.title, subtitle=subtitle, border_style=self.border_color)
 
     def _refresh_table(self, live):
         with self.lock:
@@ -1,39 +1,172 @@
 import abc
+import asyncio
+import itertools
 from numbers import Number
 from bench.benchmarks.model import Model
+from bench.logger import logger
 from bench.runtimes.runtime import Runtime
+from bench.system.accelerators.accelerator import PowerSamples, integrate_power
+from bench.system.host import summarize_host_samples
 from bench.system.system import system
+from bench.utils import HarnessTimer, calculate_device_energy, format_device_energy, stats_row
 
 class BenchmarkResult(abc.ABC):
 
-    def __init__(self, data, test_time, watts, samples):
+    # device_idle_watts and device_counter_energy are per device (index into
+    # system.accelerators), a device without an energy counter reads None
+    def __init__(self, data, start_time, end_time, watts, samples, host_samples = None,
+                 device_idle_watts = None, device_counter_energy = None):
         vars(self).update(vars(data))
-        self.time = test_time
+        self.start_time = start_time
+        self.end_time = end_time
+        self.time = end_time - start_time
         self.watts = watts
+        samples = PowerSamples.of(samples)
         self.power_samples = samples
+        # joules over the run, all times are time.perf_counter(). the hardware energy
+        # counter is used for the devices that have one, the power samples of the others
+        # are integrated. a model split across devices uses the energy of all of them
+        counters = device_counter_energy or {}
+        self.device_sampled_energy = {device: integrate_power(samples.for_device(device), start_time, end_time)
+                                      for device in sorted(set(counters) | set(samples.devices()))}
+        self.device_energy = {device: counters[device] if counters.get(device) is not None else sampled
+                              for device, sampled in self.device_sampled_energy.items()}
+        self.sampled_energy = sum(self.device_sampled_energy.values()) if samples else watts * self.time
+        counted = [energy is not None for energy in counters.values()]
+        self.energy = sum(self.device_energy.values()) if samples or any(counted) else self.sampled_energy
+        self.energy_source = "counter" if counted and all(counted) else "mixed" if any(counted) else "sampled"
+        # split at the first token: prefill is the prompt, decode is generating the rest.
+        # the counter only covers the whole run, so it is split in the same ratio as the samples
+        self.first_token_time = None
+        if getattr(data, 'ttft', None) is not None:
+            sent_time = getattr(data, 'sent_time', start_time)
+            self.first_token_time = min(max(sent_time + self.ttft / 1000, start_time), end_time)
+            sampled_prefill = integrate_power(samples, start_time, self.first_token_time) if samples else watts * (self.first_token_time - start_time)
+            self.prefill_energy = sampled_prefill * self.energy / self.sampled_energy if self.sampled_energy else 0
+            self.decode_energy = self.energy - self.prefill_energy
+        # power above what the accelerators draw sitting idle
+        self.device_idle_watts = device_idle_watts or {}
+        self.idle_watts = sum(self.device_idle_watts.values())
+        self.incremental_watts = watts - self.idle_watts
+        self.incremental_energy = self.energy - self.idle_watts * self.time
+        # cpu, memory and io of the runtime server process tree during the run
+        self.host_samples = host_samples or []
+        self.host = summarize_host_samples(self.host_samples)
+        # seconds spent in each harness phase, see HARNESS_PHASES
+        self.harness = dict(getattr(data, 'harness', {}))
+        self.set_scheduled_time(start_time)
+
+    def add_harness_time(self, phases):
+        for name, seconds in phases.items():
+            self.harness[name] = self.harness.get(name, 0) + seconds
+
+    # when the request was supposed to be sent. for open loop runs this can be
+    # earlier than start_time if the request had to wait for a free slot
+    def set_scheduled_time(self, scheduled_time):
+        self.scheduled_time = scheduled_time
+        self.queue_delay = max(self.start_time - scheduled_time, 0) * 1000
+        self.latency = (self.end_time - scheduled_time) * 1000
 
 class BenchmarkTest():
 
-    def __init__(self, model: Model, model_runtime: Runtime, variant = None):
+    # devices are indices into system.accelerators, None uses all of them
+    def __init__(self, model: Model, model_runtime: Runtime, variant = None, devices = None):
         self.model = model
         self.variant = variant
         self.runtime = model_runtime
-        self.tag = f"{model.name}-{self.runtime.name}-{self.variant.get('resolution', None) if self.variant else None}"
+        self.devices = system.resolve_devices(devices)
+        # set when the test is sharded onto a device, so its server gets its own host monitor
+        self.host_key = None
+        self.concurrency = self.variant.get('concurrency', 1) if self.variant else 1
+        # offered requests/sec for open loop runs, None for closed loop
+        self.rate = self.variant.get('rate', None) if self.variant else None
+        self.tag = "-".join([model.name, self.runtime.name] + [str(v) for v in (self.variant or {}).values()])
         self.status = "idle"
+        # results are only kept when nothing else has them, see Benchmark.result_log
+        self.keep_results = True
         self.results = []
-    
-    def test_info(self):
+        self.result_count = 0
+        # set once a saturation sweep has found the knee
+        self.sweep = None
+        self.load_stats = {}
+        self.cold_load_stats = {}
+        self.ready_time = None
+        self.first_token_time = None
+        # measured before the runtime is started, 0 if it wasn't
+        self.idle_watts = 0
+        self.device_idle_watts = {}
+        # how long it took to reach a steady state before the runs and to cool off after
+        self.warmup = None
+        self.cooldown_time = None
+        # how many results repetition mode took and the statistics of each column, see run_repetitions
+        self.repetition = None
+        # each run gets its own power monitor so runs can overlap
+        self._run_ids = itertools.count()
+
+    # `results` are the ones the row is computed from
+    def test_info(self, results):
         return {
             "status": self.status,
             "model": self.model.name,
             "quant": self.model.quant,
             "runtime": self.runtime.display_name,
-            **(self.variant or {})
+            **(self.variant or {}),
+            **({
+                "knee concurrency": self.sweep.knee_concurrency,
+                "goodput": self.sweep.goodput,
+            } if self.sweep else {}),
+            "device": ",".join(str(device) for device in self.devices),
+            **({"device energy": format_device_energy(calculate_device_energy(results))}
+               if len(self.devices) > 1 and results else {}),
+            **self.load_info(),
+            **({"idle watts": self.idle_watts} if self.idle_watts else {}),
+            **({"energy source": results[-1].energy_source} if results else {}),
+            **({"warmup requests": self.warmup.requests, "warmup cv": self.warmup.cv} if self.warmup else {}),
+            **({"cooldown time": self.cooldown_time} if self.cooldown_time is not None else {}),
+            **({
+                "repetitions": self.repetition.results,
+                "ci half width": self.repetition.half_width,
+                "converged": self.repetition.converged,
+                **stats_row(self.repetition.stats),
+            } if self.repetition else {}),
         }
 
-    def start(self):
+    def load_info(self):
+        info = {
+            "load time": self.load_stats.get("load time"),
+            "load MB/s": self.load_stats.get("load MB/s"),
+            "cold load time": self.cold_load_stats.get("load time"),
+            "cold load MB/s": self.cold_load_stats.get("load MB/s"),
+        }
+
+        if self.ready_time and self.first_token_time:
+            info["ready to first token"] = self.first_token_time - self.ready_time
+
+        return {k: v for k, v in info.items() if v is not None}
+
+    async def measure_idle(self, seconds):
+        self.device_idle_watts = await system.measure_idle_power(f"{self.tag}-idle", seconds, self.devices)
+        self.idle_watts = sum(self.device_idle_watts.values())
+        logger.info(f"{self.tag} idle power: {self.idle_watts:.2f}W")
+
+    # with cold_start the model is evicted from the page cache and loaded once
+    # from disk before the real start, which is then a warm load. runtimes that
+    # only load the model with the first request have no cold load to report
+    async def start(self, cold_start = False):
         self.status = "starting"
-        started = self.runtime.start(self.model)
+
+        if cold_start and self.runtime.supports_cold_start:
+            await self.runtime.evict_model_cache(self.model)
+            # starting blocks until the server is ready, other tests can run meanwhile
+            if await asyncio.to_thread(self.runtime.start, self.model, self.variant, system.device_env(self.devices)):
+                self.cold_load_stats = self.runtime.load_stats
+            self.runtime.stop()
+
+        started = await asyncio.to_thread(self.runtime.start, self.model, self.variant, system.device_env(self.devices))
+        # the runtime creates a new dict on every start, so this is ours to keep
+        self.load_stats = self.runtime.load_stats
+        self.ready_time = self.runtime.ready_time
+        system.host_watch(self.runtime.pid if started else None, self.host_key)
 
         if not started:
             self.status = "failed"
@@ -41,21 +174,38 @@ class BenchmarkTest():
             self.status = "running"
 
         return started
-    
+
     def stop(self):
         self.status = "success"
+        system.host_watch(None, self.host_key)
         return self.runtime.stop()
-    
-    def run(self, data):
-        start_time = system.power_start("individual_bench_run")
-        bench_result = self.runtime.benchmark(self.model, data, self.variant)
-        watts, samples, end_time = system.power_stop("individual_bench_run")
-        test_time = end_time - start_time
 
-        result = BenchmarkResult(bench_result, test_time, watts, samples)
-        self.results.append(result)
+    async def run(self, data):
+        timer = HarnessTimer()
+        monitor = f"{self.tag}-run-{next(self._run_ids)}"
+
+        with timer.phase("host"):
+            system.host_start(monitor, self.host_key)
+        with timer.phase("power"):
+            start_time = system.power_start(monitor, self.devices)
+        bench_result = await self.runtime.benchmark(self.model, data, self.variant)
+        with timer.phase("power"):
+            watts, samples, end_time, counter_energy, _ = system.power_stop(monitor)
+        with timer.phase("host"):
+            host_samples = system.host_stop(monitor, self.host_key)
+
+        with timer.phase("result"):
+            result = BenchmarkResult(bench_result, start_time, end_time, watts, samples, host_samples, self.device_idle_watts, counter_energy)
+        result.add_harness_time(timer.phases)
+        self.result_count += 1
+        if self.keep_results:
+            self.results.append(result)
+
+        first_token_time = result.first_token_time or result.end_time
+        if self.first_token_time is None or first_token_time < self.first_token_time:
+            self.first_token_time = first_token_time
 
         return result
 
     def get_results(self):
-        return self.results
\ No newline at end of file
+        return self.results
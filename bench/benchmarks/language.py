@@ -1,9 +1,11 @@
-from typing import List
+import numpy as np
 from bench.benchmarks.benchmark import Benchmark
-from bench.utils import create_percentile_columns, Column
+
+# a gap between tokens this many times the request's median gap counts as a decode stall
+STALL_FACTOR = 4
 
 class LanguageBenchmarkResult:
-    def __init__(self, prompt, json, response, ttft):
+    def __init__(self, prompt, json, response, ttft, token_times = None):
         timings = json['timings']
         self.prompt = prompt
         self.t_prompt_eval = timings['prompt_ms']
@@ -16,51 +18,16 @@ class LanguageBenchmarkResult:
         self.response = response
         self.ttft = ttft
 
-class LanguageBenchmark(Benchmark):
-
-    def _benchmark_columns(self):
-        return [
-            Column("elapsed time", True, 
-                   lambda results: sum(r.time for r in results),
-                   lambda x: f"{round(x, 2)}s"),
-            Column("avg watts", True, 
-                   lambda results: sum(r.watts for r in results) / len(results),
-                   lambda x: f"{round(x, 2)} W"),
-            Column("# prompt tokens", True, 
-                   lambda results: sum(r.n_prompt_tokens for r in results)),
-            Column("# generated tokens", True, 
-                   lambda results: sum(r.n_generated_tokens for r in results)),
-            Column("prompt tps", True, 
-                   lambda results: sum(r.prompt_tps for r in results) / len(results),
-                   lambda x: f"[cyan]{round(x, 2)}[/cyan]"),
-            Column("generate tps", True, 
-                   lambda results: sum(r.generated_tps for r in results) / len(results),
-                   lambda x: f"[magenta]{round(x, 2)}[/magenta]"),
-            Column("avg ttft", True, 
-                   lambda results: sum(r.ttft for r in results) / len(results),
-                   lambda x: f"[green]{round(x)}ms[/green]"),
-            Column("prompt tps/watt", True, 
-                   lambda results: (sum(r.prompt_tps for r in results) / len(results)) / 
-                                   (sum(r.watts for r in results) / len(results)),
-                   lambda x: f"{round(x, 2)}"),
-            Column("generate tps/watt", True, 
-                   lambda results: (sum(r.generated_tps for r in results) / len(results)) / 
-                                   (sum(r.watts for r in results) / len(results)),
-                   lambda x: f"{round(x, 2)}"),
-        ] + create_percentile_columns("ttft", lambda r: r.ttft)
-
-    def get_columns(self):
-        return [col.name for col in self._benchmark_columns()]
+        # client side arrival time (ms since the request was sent) of every streamed token
+        self.token_times = token_times or []
+        # inter token latency, itl[i] is the gap before token i + 1
+        self.itl = [b - a for a, b in zip(self.token_times, self.token_times[1:])]
+        self.tpot = (self.token_times[-1] - self.token_times[0]) / len(self.itl) if self.itl else 0
+        self.max_itl = max(self.itl, default=0)
+        stall_threshold = STALL_FACTOR * np.median(self.itl) if self.itl else 0
+        self.decode_stalls = sum(1 for gap in self.itl if gap > stall_threshold)
+        # microseconds the client spent decoding each streamed event
+        self.decode_overhead = 0
 
-    def _compute_results(self, results: List[LanguageBenchmarkResult]):
-        return {col.name: col.compute(results) for col in self._benchmark_columns()}
-
-    def _update_display(self, tag: str, data: dict):
-        self.bench_logger.update_row(tag, {
-            col.name: col.format(data[col.name])
-            for col in self._benchmark_columns()
-            if col.display
-        })
-
-    def get_display_columns(self):
-        return [col.name for col in self._benchmark_columns() if col.display]
\ No newline at end of file
+class LanguageBenchmark(Benchmark):
+    supports_open_loop = True
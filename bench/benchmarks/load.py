@@ -0,0 +1,61 @@
+import asyncio
+import itertools
+import random
+import time
+from typing import Callable, List
+
+from bench.benchmarks.benchmark_test import BenchmarkResult, BenchmarkTest
+
+# closed loop: keep `concurrency` requests in flight, a new one is only sent
+# once a previous one completes. concurrency 1 is the classic sequential run.
+async def run_closed_loop(test: BenchmarkTest, items: List, concurrency: int = 1,
+                          on_result: Callable[[BenchmarkResult], None] = None):
+    pending = iter(items)
+
+    async def worker():
+        for item in pending:
+            result = await test.run(item)
+            if on_result:
+                on_result(result)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+def arrival_times(count: int, rate: float, arrival: str = "poisson", seed: int = 0) -> List[float]:
+    if arrival == "poisson":
+        rng = random.Random(seed)
+        gaps = [rng.expovariate(rate) for _ in range(count - 1)]
+    elif arrival == "constant":
+        gaps = [1 / rate] * (count - 1)
+    else:
+        raise ValueError(f"Arrival process {arrival} not supported")
+
+    return list(itertools.accumulate(gaps, initial=0.0))
+
+# open loop: requests are sent on a fixed schedule at the offered `rate` (requests/sec)
+# regardless of whether previous requests have completed. at most `concurrency` are
+# sent to the server at once, the rest wait in a client side queue and the time spent
+# there is recorded as queue delay. latency is measured from the scheduled arrival,
+# so a slow server can't hide its backlog (coordinated omission).
+async def run_open_loop(test: BenchmarkTest, items: List, rate: float, arrival: str = "poisson",
+                        concurrency: int = 1, on_result: Callable[[BenchmarkResult], None] = None):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(item, scheduled_time):
+        async with slots:
+            result = await test.run(item)
+        result.set_scheduled_time(scheduled_time)
+        if on_result:
+            on_result(result)
+
+    tasks = []
+    start = time.perf_counter()
+
+    for item, offset in zip(items, arrival_times(len(items), rate, arrival)):
+        scheduled_time = start + offset
+        delay = scheduled_time - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        tasks.append(asyncio.create_task(run(item, scheduled_time)))
+
+    await asyncio.gather(*tasks)
@@ -0,0 +1,212 @@
+import glob
+import json
+import math
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bench import config
+from bench.benchmarks.benchmark_test import BenchmarkResult, BenchmarkTest
+from bench.logger import logger
+from bench.utils import calculate_wall_time
+
+TIMINGS_FILE = "timings.json"
+# items run to measure a test that has never been run before
+PROBE_ITEMS = 2
+MIN_ITEMS = 2
+# guesses for a test with no history, until its probe has run. the overhead is only
+# used until some test has been probed, after that the probed overheads are the guess
+DEFAULT_SECONDS_PER_ITEM = 10
+DEFAULT_OVERHEAD = 30
+DEFAULT_CV = 0.2
+
+BUDGET_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*([smh]?)$")
+BUDGET_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+
+# "90m", "2h", "3600" (seconds)
+def parse_time_budget(spec: str) -> float:
+    match = BUDGET_PATTERN.match(spec.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid time budget: {spec}, expected something like 3600, 90m or 2h")
+    return float(match.group(1)) * BUDGET_UNITS[match.group(2)]
+
+@dataclass
+class Timing:
+    suite: str
+    items: int
+    # wall clock seconds per item, concurrent requests share it
+    seconds_per_item: float
+    # coefficient of variation of the request time, how noisy one more item is
+    cv: float
+    # seconds spent on the test outside of its items: idle power, loading, warmup, cooldown
+    overhead: float
+
+# what each test of a run cost, written to TIMINGS_FILE in the run directory
+def save_timings(run_dir: str, timings: Dict[str, Timing]):
+    with open(os.path.join(run_dir, TIMINGS_FILE), "w") as f:
+        json.dump({tag: asdict(timing) for tag, timing in timings.items()}, f, indent=2)
+
+def measure_timing(suite: str, results: List[BenchmarkResult], overhead: float) -> Timing:
+    times = [r.time for r in results]
+    mean = float(np.mean(times))
+    return Timing(
+        suite=suite,
+        items=len(results),
+        seconds_per_item=calculate_wall_time(results) / len(results),
+        cv=float(np.std(times) / mean) if mean and len(times) > 1 else DEFAULT_CV,
+        overhead=overhead,
+    )
+
+# the timings of every test from the newest earlier run that has them, runs on the
+# same accelerators first
+def load_history(accelerator_info: str, exclude: str = None) -> Dict[str, Timing]:
+    runs = []
+    for path in glob.glob(os.path.join(config.RUN_STORE_DIR, "*", TIMINGS_FILE)):
+        run_dir = os.path.dirname(path)
+        if run_dir == exclude:
+            continue
+        # run directories are named <accelerator info>:<unix time>
+        info, _, started = os.path.basename(run_dir).rpartition(":")
+        runs.append((info == accelerator_info, int(started) if started.isdigit() else 0, path))
+
+    history = {}
+    for _, _, path in sorted(runs, reverse=True):
+        try:
+            with open(path) as f:
+                timings = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Can't read timings from {path}: {e}")
+            continue
+
+        for tag, timing in timings.items():
+            history.setdefault(tag, Timing(**timing))
+
+    return history
+
+# splits a time budget between the tests of a run. every test gets its overhead and
+# n_i = B * (σ_i / √c_i) / Σ σ_j √c_j items, which gives the smallest total variance
+# Σ σ_i² / n_i for the item time B, with c_i the seconds per item and σ_i how noisy
+# an item is. tests that have never run start with a short probe, and the plan is
+# redone with what is left of the budget every time a test starts. with tests sharded
+# across `workers` devices there is that many times the budget to spend.
+class TimePlanner():
+
+    def __init__(self, budget: float, run_dir: str, accelerator_info: str, workers: int = 1):
+        self.budget = budget
+        self.workers = workers
+        self.start_time = time.perf_counter()
+        self.estimates = load_history(accelerator_info, exclude=run_dir)
+        # tests that haven't finished, and how many items each can run
+        self.pending: Dict[str, int] = {}
+        self.suites: Dict[str, str] = {}
+        # the tests that are running and the items planned for them
+        self.running: Dict[str, Tuple[BenchmarkTest, int]] = {}
+        # the plan changes on the event loop while the live table's thread reads eta,
+        # pending, running and estimates are only touched with it held
+        self.lock = threading.Lock()
+
+        if self.estimates:
+            logger.info(f"Planning with the timings of {len(self.estimates)} tests from earlier runs")
+
+    # available_items is how many items a test can run
+    def add_tests(self, suite: str, tests: List[BenchmarkTest], available_items: Callable[[BenchmarkTest], int]):
+        with self.lock:
+            for test in tests:
+                self.pending[test.tag] = available_items(test)
+                self.suites[test.tag] = suite
+
+    def known(self, test: BenchmarkTest) -> bool:
+        return test.tag in self.estimates
+
+    # wall clock seconds left
+    def remaining(self) -> float:
+        return self.budget - (time.perf_counter() - self.start_time)
+
+    def _estimate(self, tag) -> Timing:
+        if tag in self.estimates:
+            return self.estimates[tag]
+
+        # tests of the same suite are the best guess for one that has never run
+        same_suite = [t for t in self.estimates.values() if t.suite == self.suites[tag]]
+        if same_suite:
+            return Timing(self.suites[tag], 0, float(np.median([t.seconds_per_item for t in same_suite])),
+                          float(np.median([t.cv for t in same_suite])), float(np.median([t.overhead for t in same_suite])))
+        # loading a model and measuring idle power cost about the same in every suite
+        overhead = float(np.median([t.overhead for t in self.estimates.values()])) if self.estimates else DEFAULT_OVERHEAD
+        return Timing(self.suites[tag], 0, DEFAULT_SECONDS_PER_ITEM, DEFAULT_CV, overhead)
+
+    # items for each of `tags` out of `budget` device seconds
+    def allocate(self, budget: float, tags: List[str]) -> Dict[str, int]:
+        estimates = {tag: self._estimate(tag) for tag in tags}
+        item_time = budget - sum(estimates[tag].overhead for tag in tags)
+        allocation = {}
+        free = list(tags)
+
+        # tests that can't use their share (not enough items) give the rest back
+        while free:
+            spent = sum(allocation[tag] * estimates[tag].seconds_per_item for tag in tags if tag not in free)
+            weight = lambda tag: max(estimates[tag].cv, 1e-3)
+            scale = max(item_time - spent, 0) / sum(weight(tag) * math.sqrt(estimates[tag].seconds_per_item) for tag in free)
+            capped = []
+            for tag in free:
+                items = scale * weight(tag) / math.sqrt(estimates[tag].seconds_per_item)
+                allocation[tag] = int(min(max(items, MIN_ITEMS), self.pending[tag]))
+                if items >= self.pending[tag]:
+                    capped.append(tag)
+            if not capped:
+                break
+            free = [tag for tag in free if tag not in capped]
+
+        return allocation
+
+    # device seconds the running tests still need
+    def _running_time(self, exclude = None) -> float:
+        return sum(max(items - test.result_count, 0) * self._estimate(tag).seconds_per_item
+                   for tag, (test, items) in self.running.items() if tag != exclude)
+
+    def test_started(self, test: BenchmarkTest):
+        with self.lock:
+            self.running[test.tag] = (test, 0)
+
+    # the probe gives a test that has never run an estimate of its own cost: what its items
+    # take and the `overhead` seconds spent before them (idle power, loading, warmup). a
+    # couple of items say nothing about how noisy it is, that stays a guess
+    def observe_probe(self, test: BenchmarkTest, results: List[BenchmarkResult], overhead: float):
+        if results:
+            with self.lock:
+                guess = self._estimate(test.tag)
+                probed = measure_timing(self.suites[test.tag], results, overhead)
+                self.estimates[test.tag] = Timing(probed.suite, probed.items, probed.seconds_per_item, guess.cv, overhead)
+
+    # items the test should run, planned once it has started (and been probed)
+    def items_for(self, test: BenchmarkTest) -> int:
+        with self.lock:
+            tags = [tag for tag in self.pending if tag == test.tag or tag not in self.running]
+            budget = self.remaining() * self.workers - self._running_time(exclude=test.tag)
+            items = self.allocate(budget, tags)[test.tag]
+            self.running[test.tag] = (test, items)
+        logger.info(f"{test.tag}: running {items} items, {self.remaining():.0f}s of the time budget left")
+        return items
+
+    def test_finished(self, test: BenchmarkTest, timing: Optional[Timing]):
+        with self.lock:
+            self.pending.pop(test.tag, None)
+            self.running.pop(test.tag, None)
+            if timing:
+                self.estimates[test.tag] = timing
+
+    # wall clock seconds the rest of the plan is expected to take
+    def eta(self) -> float:
+        with self.lock:
+            seconds = self._running_time()
+            waiting = [tag for tag in self.pending if tag not in self.running]
+            if waiting:
+                allocation = self.allocate(max(self.remaining() * self.workers - seconds, 0), waiting)
+                seconds += sum(allocation[tag] * self._estimate(tag).seconds_per_item + self._estimate(tag).overhead
+                               for tag in waiting)
+        return seconds / self.workers
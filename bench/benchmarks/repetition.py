@@ -0,0 +1,113 @@
+import asyncio
+import itertools
+import math
+import random
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+
+from bench.benchmarks.benchmark_test import BenchmarkResult, BenchmarkTest
+from bench.logger import logger
+from bench.utils import Column, ColumnStats, bootstrap_columns
+
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MAX_REPETITIONS = 10
+BOOTSTRAP_RESAMPLES = 200
+# results needed before the intervals are trusted to stop on
+MIN_RESULTS = 10
+# results between checks, at least one per concurrent request. every check bootstraps all
+# the results so far, so the checks get further apart as the results grow: the next one is
+# after CHECK_GROWTH more results, which keeps the total cost linear in the results
+CHECK_EVERY = 5
+CHECK_GROWTH = 0.1
+
+@dataclass
+class Repetition:
+    results: int = 0
+    # the widest relative confidence interval half width over the columns being watched
+    half_width: float = float("inf")
+    converged: bool = False
+    stats: Dict[str, ColumnStats] = field(default_factory=dict)
+
+# the columns to put a confidence interval on, totals only grow with more results
+def interval_columns(columns: List[Column]):
+    return [col for col in columns if not col.total]
+
+# widest relative half width over `columns` for the results so far
+def check_intervals(results: List[BenchmarkResult], columns: List[Column], confidence: float):
+    stats = bootstrap_columns(results, columns, BOOTSTRAP_RESAMPLES, confidence)
+    widths = []
+    for col in columns:
+        if col.name not in stats:
+            continue
+        try:
+            value = col.compute(results)
+        except (ZeroDivisionError, ValueError, TypeError):
+            continue
+        widths.append(stats[col.name].relative_half_width(value))
+
+    return max(widths) if widths else 0
+
+# runs the dataset items over and over (shuffled, so stopping early doesn't only cover
+# the first items) `concurrency` at a time, until the confidence interval of every
+# column in `watch` is within `tolerance` of its value, or `max_repetitions` passes
+# over the dataset are done. the bootstrap statistics of every column are computed
+# once at the end. `history` gives the results so far for a check (they don't have to
+# be kept in memory in between), test.results by default
+async def run_repetitions(test: BenchmarkTest, items: List, watch: List[Column], columns: List[Column],
+                          tolerance: float, confidence: float = DEFAULT_CONFIDENCE,
+                          max_repetitions: int = DEFAULT_MAX_REPETITIONS, concurrency: int = 1,
+                          on_result: Callable[[BenchmarkResult], None] = None,
+                          on_check: Callable[[Repetition], None] = None,
+                          history: Callable[[], List[BenchmarkResult]] = None) -> Repetition:
+    history = history or (lambda: list(test.results))
+    order = list(items)
+    random.Random(0).shuffle(order)
+    pending = iter(itertools.islice(itertools.cycle(order), len(order) * max_repetitions))
+    watch = interval_columns(watch)
+    check_every = max(CHECK_EVERY, concurrency)
+    next_check = check_every
+    repetition = Repetition()
+    stop = False
+    checking = False
+
+    async def check():
+        nonlocal stop, checking
+        checking = True
+        # reading the results back and bootstrapping is all cpu and io, keep it off the event
+        # loop so the requests in flight aren't held up
+        results = await asyncio.to_thread(history)
+        repetition.half_width = await asyncio.to_thread(check_intervals, results, watch, confidence)
+        repetition.results = len(results)
+        if len(results) >= MIN_RESULTS and repetition.half_width <= tolerance:
+            repetition.converged = True
+            stop = True
+        if on_check:
+            on_check(repetition)
+        checking = False
+
+    async def worker():
+        nonlocal next_check
+        for item in pending:
+            if stop:
+                break
+            result = await test.run(item)
+            if on_result:
+                on_result(result)
+            # concurrent workers can finish past the check, the first one there runs it
+            # and the others carry on while it does
+            if test.result_count >= next_check and not checking:
+                next_check = max(test.result_count + check_every, math.ceil(test.result_count * (1 + CHECK_GROWTH)))
+                await check()
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    repetition.results = test.result_count
+    if not repetition.converged:
+        logger.warning(f"{test.tag} stopped after {repetition.results} results with a confidence interval of "
+                       f"±{repetition.half_width:.1%}, above the {tolerance:.1%} tolerance")
+
+    if test.result_count:
+        results = await asyncio.to_thread(history)
+        repetition.stats = await asyncio.to_thread(bootstrap_columns, results, interval_columns(columns),
+                                                   BOOTSTRAP_RESAMPLES, confidence)
+    return repetition
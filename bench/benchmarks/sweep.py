@@ -0,0 +1,128 @@
+import itertools
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Tuple
+
+from bench.benchmarks.benchmark_test import BenchmarkResult, BenchmarkTest
+from bench.benchmarks.load import run_closed_loop
+from bench.logger import logger
+from bench.metrics import selector
+from bench.utils import calculate_percentile
+
+DEFAULT_SWEEP_LEVELS = [1, 2, 4, 8, 16, 32, 64]
+# requests each slot sends at a level. the items are repeated to make up the count, a
+# dataset smaller than the level would otherwise never have that many requests in flight
+SWEEP_ROUNDS = 4
+
+# the per result values an SLO can be put on (ms), lists like itl pool every value
+SLO_METRICS = ["ttft", "queued_ttft", "latency", "queue_delay", "tpot", "itl", "max_itl",
+               "t_prompt_eval", "t_generation", "t_total"]
+
+SLO_PATTERN = re.compile(r"^p(\d+(?:\.\d+)?)\s+([a-z_ ]+?)\s*<\s*(\d+(?:\.\d+)?)$")
+
+@dataclass
+class Slo:
+    percentile: float
+    metric: str
+    limit: float
+
+    def value(self, results: List[BenchmarkResult]) -> float:
+        return calculate_percentile(results, self.percentile, selector(self.metric.replace(" ", "_")))
+
+    def met(self, results: List[BenchmarkResult]) -> bool:
+        return self.value(results) < self.limit
+
+    def __str__(self):
+        return f"p{self.percentile:g} {self.metric}<{self.limit:g}"
+
+# parses a comma separated list of objectives like "p99 ttft<500,p50 latency<2000"
+# metrics are values of each result (ms), see SLO_METRICS
+def parse_slos(spec: str) -> List[Slo]:
+    slos = []
+    for entry in spec.split(','):
+        match = SLO_PATTERN.match(entry.strip().lower())
+        if not match:
+            raise ValueError(f"Invalid SLO: {entry}, expected something like 'p99 ttft<500'")
+        if match.group(2).replace(" ", "_") not in SLO_METRICS:
+            raise ValueError(f"Invalid SLO: {entry}, {match.group(2)} is not one of {', '.join(m.replace('_', ' ') for m in SLO_METRICS)}")
+
+        slos.append(Slo(float(match.group(1)), match.group(2), float(match.group(3))))
+
+    return slos
+
+# the items a level sends, every item once and repeated to SWEEP_ROUNDS per slot
+def level_items(items: List, level: int) -> List:
+    return list(itertools.islice(itertools.cycle(items), max(len(items), SWEEP_ROUNDS * level)))
+
+def sweep_size(item_count: int, levels: List[int]) -> int:
+    return sum(max(item_count, SWEEP_ROUNDS * level) for level in levels)
+
+# the items and levels of a sweep that fit in `budget` items. the levels can't be made
+# shorter than SWEEP_ROUNDS per slot, so the dataset is cut first and the highest levels
+# are dropped if even that isn't enough. the first level is always kept
+def fit_sweep(items: List, levels: List[int], budget: int) -> Tuple[List, List[int]]:
+    fitted = levels[:1]
+    for level in levels[1:]:
+        if sweep_size(1, fitted + [level]) > budget:
+            break
+        fitted.append(level)
+    count = len(items)
+    while count > 1 and sweep_size(count, fitted) > budget:
+        count -= 1
+    return items[:count], fitted
+
+class SweepResult():
+
+    # level is the concurrency the row is computed from: the knee, or the first level when
+    # nothing met the SLOs. its results are only kept if the test keeps its results
+    def __init__(self, knee_concurrency, goodput, results, level = None):
+        self.knee_concurrency = knee_concurrency
+        self.goodput = goodput
+        self.results = results
+        self.level = level
+
+# ramp the closed loop concurrency until one of the SLOs is violated. the knee is
+# the highest level that still met every SLO and goodput is the request rate
+# achieved at that level. the server has to be started with enough slots for
+# the highest level.
+async def run_sweep(test: BenchmarkTest, items: List, levels: List[int], slos: List[Slo],
+                    on_result: Callable[[BenchmarkResult], None] = None,
+                    on_level: Callable[[int, int], None] = None) -> SweepResult:
+    sweep = SweepResult(0, 0, [])
+
+    # only the level being run is held in memory
+    for level in levels:
+        sent = level_items(items, level)
+        if on_level:
+            on_level(level, len(sent))
+
+        results = []
+        # every level is logged under the same test, the level tells their results apart
+        def on_level_result(result, level=level, results=results):
+            result.concurrency = level
+            results.append(result)
+            if on_result:
+                on_result(result)
+
+        await run_closed_loop(test, sent, level, on_level_result)
+        kept = results if test.keep_results else []
+
+        wall_time = max(r.end_time for r in results) - min(r.start_time for r in results)
+        qps = len(results) / wall_time
+        violated = [slo for slo in slos if not slo.met(results)]
+
+        logger.info(f"{test.tag} concurrency {level}: {qps:.2f} req/s, " +
+                    ", ".join(f"p{slo.percentile:g} {slo.metric} {slo.value(results):.2f}" for slo in slos))
+
+        if violated:
+            logger.info(f"{test.tag} violated {', '.join(str(slo) for slo in violated)} at concurrency {level}")
+            # nothing met the SLO, keep the lowest level so the row still has data
+            if sweep.level is None:
+                sweep.results, sweep.level = kept, level
+            break
+
+        sweep = SweepResult(level, qps, kept, level)
+
+    if test.keep_results:
+        test.results = sweep.results
+    return sweep
@@ -0,0 +1,100 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bench.benchmarks.benchmark_test import BenchmarkTest
+from bench.logger import logger
+from bench.system.system import system
+
+# throughput of this many batches in a row has to be steady for the warmup to end
+WARMUP_WINDOW = 5
+DEFAULT_WARMUP_CV = 0.05
+DEFAULT_WARMUP_REQUESTS = 50
+
+# a device has cooled down once its power is within this much of the baseline...
+COOLDOWN_WATTS_TOLERANCE = 0.1
+COOLDOWN_MIN_WATTS = 5
+# ...and its temperature within this many degrees
+COOLDOWN_TEMP_TOLERANCE = 3
+DEFAULT_COOLDOWN_TIMEOUT = 300
+# seconds of samples the power is averaged over
+STATE_WINDOW = 1
+
+@dataclass
+class Warmup:
+    requests: int
+    # coefficient of variation of the throughput over the last WARMUP_WINDOW batches
+    cv: Optional[float]
+    stable: bool
+
+def coefficient_of_variation(values: List[float]) -> float:
+    mean = np.mean(values)
+    return float(np.std(values) / mean) if mean else float("inf")
+
+# sends `item` over and over, `concurrency` at a time, until the throughput of the last
+# WARMUP_WINDOW batches varies by less than `cv_threshold`, so the measured requests
+# run on a device that has reached its steady clocks and temperature. nothing sent
+# here is recorded
+async def warm_up(test: BenchmarkTest, item, cv_threshold: float = DEFAULT_WARMUP_CV,
+                  max_requests: int = DEFAULT_WARMUP_REQUESTS) -> Warmup:
+    concurrency = test.concurrency
+    throughputs = []
+    requests = 0
+    cv = None
+
+    async def request():
+        sent_time = time.perf_counter()
+        result = await test.runtime.benchmark(test.model, item, test.variant)
+        # the first token is still the first one the server produced after it was ready
+        ttft = getattr(result, 'ttft', None)
+        first_token_time = sent_time + ttft / 1000 if ttft is not None else time.perf_counter()
+        if test.first_token_time is None or first_token_time < test.first_token_time:
+            test.first_token_time = first_token_time
+
+    while requests < max_requests:
+        start = time.perf_counter()
+        await asyncio.gather(*[request() for _ in range(concurrency)])
+        throughputs.append(concurrency / (time.perf_counter() - start))
+        requests += concurrency
+
+        if len(throughputs) >= WARMUP_WINDOW:
+            cv = coefficient_of_variation(throughputs[-WARMUP_WINDOW:])
+            if cv < cv_threshold:
+                return Warmup(requests, cv, True)
+
+    logger.warning(f"{test.tag} throughput didn't settle after {requests} warmup requests (cv {cv})")
+    return Warmup(requests, cv, False)
+
+# average watts and temperature of each device while nothing is running on it
+async def measure_baseline(devices: List[int], seconds: float) -> Dict[int, Tuple[float, Optional[float]]]:
+    await asyncio.sleep(seconds)
+    return {device: system.device_state(device, seconds) for device in devices}
+
+def cooled_down(state, baseline) -> bool:
+    if state is None or baseline is None:
+        return True
+
+    watts, temperature = state
+    idle_watts, idle_temperature = baseline
+    if watts > idle_watts + max(idle_watts * COOLDOWN_WATTS_TOLERANCE, COOLDOWN_MIN_WATTS):
+        return False
+    return temperature is None or idle_temperature is None or temperature <= idle_temperature + COOLDOWN_TEMP_TOLERANCE
+
+# waits until the power and temperature of every device are back near their baseline,
+# so the next test doesn't start on a device the last one heated up. returns the seconds waited
+async def cool_down(devices: List[int], baseline: Dict[int, Tuple[float, Optional[float]]],
+                    timeout: float = DEFAULT_COOLDOWN_TIMEOUT) -> float:
+    start = time.perf_counter()
+    # let the samples from the end of the test age out of the window
+    await asyncio.sleep(STATE_WINDOW)
+
+    while not all(cooled_down(system.device_state(device, STATE_WINDOW), baseline.get(device)) for device in devices):
+        if time.perf_counter() - start > timeout:
+            logger.warning(f"Devices {devices} didn't cool down to their baseline within {timeout}s")
+            break
+        await asyncio.sleep(STATE_WINDOW)
+
+    return time.perf_counter() - start
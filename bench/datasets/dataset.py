@@ -23,7 +23,8 @@ class Dataset(abc.ABC):
         self._download()
 
         # TODO this feels like a massive hack but it does work
-        if kwargs.get("full"):
+        # repetition mode and the time budget planner decide how many items to run, they get all of them
+        if kwargs.get("full") or kwargs.get("tolerance") or kwargs.get("time_budget"):
             len = None
         elif kwargs.get("fast"):
             len = 1
@@ -0,0 +1,395 @@
+import abc
+import itertools
+import operator
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from bench import aggregates
+from bench.system.accelerators.accelerator import PowerSamples, summarize_accelerator_samples
+from bench.system.host import summarize_host_samples
+from bench.utils import HARNESS_PHASES, Column, Resample, calculate_wall_time, calculate_window_energy, incremental_results
+
+# every column of every suite, defined once. each metric is an expression over the
+# fields of a test's results, evaluated on numpy arrays of those fields (ResultArrays)
+# so a whole row comes out of one pass over the results, and the same expression gives
+# the running aggregate the live table uses
+
+# token positions to report the decode rate for, the last bucket is open ended
+POSITION_BUCKETS = [1, 64, 256, 1024]
+PERCENTILES = [1, 25, 50, 75, 99]
+
+# fields that aren't an attribute of the results
+FIELDS = {
+    "queued_ttft": lambda r: r.queue_delay + r.ttft,
+    "harness_total": lambda r: sum(r.harness.values()),
+    **{f"harness_{phase}": (lambda r, phase=phase: r.harness.get(phase, 0)) for phase in HARNESS_PHASES},
+}
+
+def selector(field: str) -> Callable:
+    return FIELDS.get(field) or operator.attrgetter(field)
+
+# the results of a test as a numpy array per field, each built the first time a metric
+# needs it and shared by every other metric of the row
+class ResultArrays():
+
+    def __init__(self, results: List):
+        self.results = results
+        self.count = len(results)
+        self._cache = {}
+
+    def cached(self, name, compute):
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+
+    def values(self, field: str) -> np.ndarray:
+        select = selector(field)
+        return self.cached(("values", field),
+                           lambda: np.fromiter((select(r) for r in self.results), dtype=np.float64, count=self.count))
+
+    def integer(self, field: str) -> bool:
+        value = selector(field)(self.results[0]) if self.count else None
+        return isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+
+    # fields holding a list per result (e.g. inter token latencies) pooled together,
+    # with the 1 based position of each value in its own list
+    def pooled(self, field: str) -> Tuple[np.ndarray, np.ndarray]:
+        def pool():
+            lists = [selector(field)(r) for r in self.results]
+            lengths = np.fromiter(map(len, lists), dtype=np.int64, count=self.count)
+            values = np.fromiter(itertools.chain.from_iterable(lists), dtype=np.float64, count=int(lengths.sum()))
+            starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+            return values, np.arange(len(values)) - starts + 1
+        return self.cached(("pooled", field), pool)
+
+    # a field's values, pooled if it holds lists like calculate_percentile does
+    def samples(self, field: str) -> np.ndarray:
+        if self.count and isinstance(selector(field)(self.results[0]), list):
+            return self.pooled(field)[0]
+        return self.values(field)
+
+    def wall_time(self) -> float:
+        # a bootstrap resample gets its share of the full window, see Resample
+        if isinstance(self.results, Resample):
+            return calculate_wall_time(self.results)
+        return self.cached("wall time", lambda: float(self.values("end_time").max() - self.values("start_time").min()))
+
+    def window_energy(self) -> float:
+        return self.cached("window energy", lambda: calculate_window_energy(self.results))
+
+    def host(self) -> dict:
+        return self.cached("host", lambda: summarize_host_samples([s for r in self.results for s in r.host_samples]))
+
+    def accelerator(self) -> dict:
+        return self.cached("accelerator", lambda: summarize_accelerator_samples(PowerSamples.concat(r.power_samples for r in self.results)))
+
+    # the same results with the idle draw taken off, for the incremental power metrics
+    def incremental(self) -> "ResultArrays":
+        return self.cached("incremental", lambda: ResultArrays(incremental_results(self.results)))
+
+class Expression(abc.ABC):
+
+    @abc.abstractmethod
+    def evaluate(self, arrays: ResultArrays) -> float:
+        pass
+
+    # a running version for the live table, None when there isn't one
+    def aggregate(self) -> Optional[aggregates.Aggregate]:
+        return None
+
+class Count(Expression):
+
+    def evaluate(self, arrays):
+        return arrays.count
+
+    def aggregate(self):
+        return aggregates.Count()
+
+class Total(Expression):
+
+    def __init__(self, field: str):
+        self.field = field
+
+    def evaluate(self, arrays):
+        total = float(arrays.values(self.field).sum())
+        # counts stay whole numbers in the csv
+        return int(total) if arrays.integer(self.field) else total
+
+    def aggregate(self):
+        return aggregates.Sum(selector(self.field))
+
+class Average(Expression):
+
+    def __init__(self, field: str):
+        self.field = field
+
+    def evaluate(self, arrays):
+        if arrays.count == 0:
+            raise ZeroDivisionError(f"average {self.field} of no results")
+        return float(arrays.values(self.field).mean())
+
+    def aggregate(self):
+        return aggregates.Mean(selector(self.field))
+
+class Maximum(Expression):
+
+    def __init__(self, field: str):
+        self.field = field
+
+    def evaluate(self, arrays):
+        return float(arrays.values(self.field).max())
+
+    def aggregate(self):
+        return aggregates.Max(selector(self.field))
+
+# python floats, so dividing by zero raises like the rest of the harness expects
+class Quotient(Expression):
+
+    def __init__(self, numerator: Expression, denominator: Expression):
+        self.numerator = numerator
+        self.denominator = denominator
+
+    def evaluate(self, arrays):
+        return self.numerator.evaluate(arrays) / self.denominator.evaluate(arrays)
+
+    def aggregate(self):
+        numerator, denominator = self.numerator.aggregate(), self.denominator.aggregate()
+        return aggregates.Ratio(numerator, denominator) if numerator and denominator else None
+
+class Scaled(Expression):
+
+    def __init__(self, expression: Expression, factor: float):
+        self.expression = expression
+        self.factor = factor
+
+    def evaluate(self, arrays):
+        return self.expression.evaluate(arrays) * self.factor
+
+    def aggregate(self):
+        aggregate = self.expression.aggregate()
+        return aggregates.Scaled(aggregate, self.factor) if aggregate else None
+
+# see calculate_wall_time. open loop runs can measure from the scheduled arrival instead
+class WallTime(Expression):
+
+    def __init__(self, start: str = "start_time"):
+        self.start = start
+
+    def evaluate(self, arrays):
+        if self.start == "start_time":
+            return arrays.wall_time()
+        return float(arrays.values("end_time").max() - arrays.values(self.start).min())
+
+    def aggregate(self):
+        return aggregates.WallTime(self.start)
+
+class WindowEnergy(Expression):
+
+    def evaluate(self, arrays):
+        return arrays.window_energy()
+
+    def aggregate(self):
+        return aggregates.WindowEnergy()
+
+# the part of the window energy that went to one phase, see calculate_phase_energy
+class PhaseEnergy(Expression):
+
+    def __init__(self, field: str):
+        self.field = field
+
+    def evaluate(self, arrays):
+        total = float(arrays.values("energy").sum())
+        if total == 0:
+            return 0
+        return arrays.window_energy() * float(arrays.values(self.field).sum()) / total
+
+    def aggregate(self):
+        return aggregates.PhaseEnergy(self.field)
+
+class Percentile(Expression):
+
+    def __init__(self, percentile: float, field: str):
+        self.percentile = percentile
+        self.field = field
+
+    def evaluate(self, arrays):
+        values = arrays.samples(self.field)
+        return float(np.percentile(values, self.percentile)) if len(values) else 0
+
+    def aggregate(self):
+        return aggregates.Quantile(self.percentile, selector(self.field))
+
+# client side decode rate for tokens in [start, end) across every result
+class PositionTps(Expression):
+
+    def __init__(self, start: int, end: Optional[int]):
+        self.start = start
+        self.end = end or float("inf")
+
+    def evaluate(self, arrays):
+        gaps, positions = arrays.pooled("itl")
+        gaps = gaps[(positions >= self.start) & (positions < self.end)]
+        if len(gaps) == 0:
+            return 0
+        return len(gaps) / (float(gaps.sum()) / 1000)
+
+# what the runtime's process tree did over the whole test, see summarize_host_samples
+class HostSummary(Expression):
+
+    def __init__(self, key: str, unit: float = 1):
+        self.key = key
+        self.unit = unit
+
+    def evaluate(self, arrays):
+        value = arrays.host().get(self.key, 0)
+        return value / self.unit if self.unit != 1 else value
+
+# what the accelerators did over the whole test, see summarize_accelerator_samples
+class AcceleratorSummary(Expression):
+
+    def __init__(self, key: str):
+        self.key = key
+
+    def evaluate(self, arrays):
+        value = arrays.accelerator().get(self.key)
+        return value if value is not None else 0
+
+class Incremental(Expression):
+
+    def __init__(self, expression: Expression):
+        self.expression = expression
+
+    def evaluate(self, arrays):
+        return self.expression.evaluate(arrays.incremental())
+
+    def aggregate(self):
+        aggregate = self.expression.aggregate()
+        return aggregates.Transformed(aggregate, lambda r: incremental_results([r])[0]) if aggregate else None
+
+@dataclass
+class Metric:
+    name: str
+    # shown in the live table, or a function of the benchmark deciding it
+    display: Union[bool, Callable]
+    value: Expression
+    format: Callable[[float], str] = lambda x: f"{round(x, 2)}"
+    # computed from watts or energy, these get an incremental (above idle) twin
+    power: bool = False
+    # a total that grows with every result, it has no confidence interval
+    total: bool = False
+    # the suites reporting it, None is every suite
+    suites: Optional[Tuple[str, ...]] = None
+
+    def column(self, benchmark) -> Column:
+        display = self.display(benchmark) if callable(self.display) else self.display
+        return Column(self.name, display, lambda results: self.value.evaluate(ResultArrays(results)), self.format,
+                      power=self.power, total=self.total,
+                      aggregate=self.value.aggregate if self.value.aggregate() else None)
+
+TEXT = ("language", "vision")
+
+def percentile_metrics(name, field, suites = None, format=lambda x: f"[green]{round(x)}ms[/green]"):
+    return [Metric(f"p{percentile} {name}", False, Percentile(percentile, field), format, suites=suites)
+            for percentile in PERCENTILES]
+
+def per_watt(field):
+    return Quotient(Average(field), Average("watts"))
+
+METRICS: List[Metric] = [
+    Metric("elapsed time", True, Total("time"), lambda x: f"{round(x, 2)}s", total=True),
+    Metric("model load time", True, Total("model_load_time"), total=True, suites=("creation",)),
+    Metric("avg watts", True, Average("watts"), lambda x: f"{round(x, 2)} W", power=True),
+
+    # language and vision
+    Metric("# prompt tokens", True, Total("n_prompt_tokens"), total=True, suites=TEXT),
+    Metric("# generated tokens", True, Total("n_generated_tokens"), total=True, suites=TEXT),
+    Metric("prompt tps", True, Average("prompt_tps"), lambda x: f"[cyan]{round(x, 2)}[/cyan]", suites=TEXT),
+    Metric("generate tps", True, Average("generated_tps"), lambda x: f"[magenta]{round(x, 2)}[/magenta]", suites=TEXT),
+    Metric("throughput", True, Quotient(Count(), WallTime()),
+           lambda x: f"[purple4]{round(x, 2)} imgs/sec[/purple4]", suites=("vision",)),
+    Metric("aggregate tps", True, Quotient(Total("n_generated_tokens"), WallTime()),
+           lambda x: f"[magenta]{round(x, 2)}[/magenta]", suites=TEXT),
+    Metric("generated tokens/joule", True, Quotient(Total("n_generated_tokens"), WindowEnergy()), power=True, suites=TEXT),
+    Metric("J/prompt token", False, Quotient(PhaseEnergy("prefill_energy"), Total("n_prompt_tokens")),
+           lambda x: f"{round(x, 4)}J", power=True, suites=TEXT),
+    Metric("J/generated token", False, Quotient(PhaseEnergy("decode_energy"), Total("n_generated_tokens")),
+           lambda x: f"{round(x, 4)}J", power=True, suites=TEXT),
+    Metric("avg ttft", True, Average("ttft"), lambda x: f"[green]{round(x)}ms[/green]", suites=TEXT),
+    Metric("prompt tps/watt", True, per_watt("prompt_tps"), power=True, suites=TEXT),
+    Metric("generate tps/watt", True, per_watt("generated_tps"), power=True, suites=TEXT),
+    *percentile_metrics("ttft", "ttft", TEXT),
+    *percentile_metrics("generate tps", "generated_tps", TEXT, format=lambda x: f"{round(x, 2)}"),
+    *percentile_metrics("queued ttft", "queued_ttft", TEXT),
+    Metric("avg tpot", False, Average("tpot"), lambda x: f"{round(x, 2)}ms", suites=TEXT),
+    Metric("max itl", False, Maximum("max_itl"), lambda x: f"{round(x)}ms", suites=TEXT),
+    Metric("decode stalls", False, Total("decode_stalls"), total=True, suites=TEXT),
+    Metric("decode us/event", False, Average("decode_overhead"), suites=TEXT),
+    *[Metric(f"decode tps @{start}-{end - 1 if end else ''}", False, PositionTps(start, end), suites=TEXT)
+      for start, end in zip(POSITION_BUCKETS, POSITION_BUCKETS[1:] + [None])],
+    *percentile_metrics("itl", "itl", TEXT, format=lambda x: f"{round(x, 2)}ms"),
+
+    # hearing
+    Metric("total input seconds", True, Total("input_seconds"), total=True, suites=("hearing",)),
+    Metric("total transcribe time", True, Total("transcribe_time"), total=True, suites=("hearing",)),
+    Metric("avg speedup", True, Average("speedup"), lambda x: f"[magenta]{round(x, 2)}x[/magenta]", suites=("hearing",)),
+    Metric("avg speedup/watt", True, per_watt("speedup"), power=True, suites=("hearing",)),
+    Metric("J/audio second", False, Quotient(WindowEnergy(), Total("input_seconds")),
+           lambda x: f"{round(x, 2)}J", power=True, suites=("hearing",)),
+
+    # creation
+    Metric("avg iter/sec", True, Average("avg_iter_sec"), lambda x: f"[cyan]{round(x, 2)}[/cyan]", suites=("creation",)),
+    Metric("avg sec/iter", True, Average("avg_sec_iter"), lambda x: f"[magenta]{round(x, 2)}[/magenta]", suites=("creation",)),
+    Metric("avg time to image", True, Average("total_time"), lambda x: f"[green]{round(x, 2)}s[/green]", suites=("creation",)),
+    Metric("compute time to image", True, Average("compute_time"), lambda x: f"[yellow]{round(x, 2)}s[/yellow]", suites=("creation",)),
+    Metric("avg iter/sec/watt", True, per_watt("avg_iter_sec"), lambda x: f"{round(x, 4)}", power=True, suites=("creation",)),
+    Metric("J/image", False, Quotient(WindowEnergy(), Count()), lambda x: f"{round(x, 2)}J", power=True, suites=("creation",)),
+    Metric("k samp percentage", False, Average("k_samp_percentage"), suites=("creation",)),
+
+    # how the suite behaved under load
+    Metric("achieved qps", lambda benchmark: bool(benchmark.rates), Quotient(Count(), WallTime("scheduled_time")),
+           suites=TEXT + ("hearing",)),
+    *percentile_metrics("latency", "latency", TEXT + ("hearing",)),
+    *percentile_metrics("queue delay", "queue_delay", TEXT + ("hearing",)),
+
+    # time spent in the harness itself rather than waiting on the server
+    *[Metric(f"harness {phase} ms", False, Scaled(Average(f"harness_{phase}"), 1000), lambda x: f"{round(x, 3)}ms")
+      for phase in HARNESS_PHASES],
+    Metric("harness overhead %", False, Scaled(Quotient(Total("harness_total"), Total("time")), 100), lambda x: f"{round(x, 2)}%"),
+
+    # resource usage of the runtime server process tree over the whole test. page faults
+    # and context switches tell whether a run was swapping or cpu bound
+    Metric("host cpu %", False, HostSummary("cpu %"), lambda x: f"{round(x, 1)}%"),
+    Metric("peak host cpu %", False, HostSummary("peak cpu %"), lambda x: f"{round(x, 1)}%"),
+    Metric("peak host RAM MB", False, HostSummary("peak rss MB"), lambda x: f"{round(x)}MB"),
+    Metric("host minor faults", False, HostSummary("minor_faults"), lambda x: f"{round(x)}", total=True),
+    Metric("host major faults", False, HostSummary("major_faults"), lambda x: f"{round(x)}", total=True),
+    Metric("host ctx switches", False, HostSummary("ctx_switches"), lambda x: f"{round(x)}", total=True),
+    Metric("host read MB", False, HostSummary("read_bytes", 1e6), lambda x: f"{round(x, 2)}MB", total=True),
+    Metric("host write MB", False, HostSummary("write_bytes", 1e6), lambda x: f"{round(x, 2)}MB", total=True),
+
+    # what the accelerator was doing over the whole test. a throttled card makes a slow
+    # result a property of the cooling rather than the model
+    Metric("peak VRAM MB", False, AcceleratorSummary("peak VRAM MB"), lambda x: f"{round(x)}MB"),
+    Metric("gpu util %", False, AcceleratorSummary("gpu util %"), lambda x: f"{round(x, 1)}%"),
+    Metric("throttled %", False, AcceleratorSummary("throttled %"), lambda x: f"{round(x, 1)}%"),
+    Metric("sm clock MHz", False, AcceleratorSummary("sm clock MHz"), lambda x: f"{round(x)}MHz"),
+    Metric("mem clock MHz", False, AcceleratorSummary("mem clock MHz"), lambda x: f"{round(x)}MHz"),
+    Metric("peak temp C", False, AcceleratorSummary("peak temp C"), lambda x: f"{round(x)}C"),
+]
+
+# the metrics of a suite, followed by every power metric again with the idle draw
+# subtracted. cards with very different idle power can only be compared on what
+# the work itself used
+def suite_metrics(suite: str) -> List[Metric]:
+    metrics = [metric for metric in METRICS if metric.suites is None or suite in metric.suites]
+    return metrics + [
+        Metric(f"incremental {metric.name}", False, Incremental(metric.value), metric.format, suites=metric.suites)
+        for metric in metrics if metric.power
+    ]
+
+# every metric of a row in one pass, the arrays of each field are built once
+def compute_metrics(results: List, metrics: List[Metric]) -> Dict[str, float]:
+    arrays = ResultArrays(results)
+    return {metric.name: metric.value.evaluate(arrays) for metric in metrics}
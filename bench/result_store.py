@@ -0,0 +1,544 @@
+import atexit
+import json
+import math
+import os
+import queue
+import re
+import threading
+from numbers import Number
+from typing import Dict, List
+
+import numpy as np
+
+from bench.logger import logger
+from bench.system.accelerators.accelerator import NO_INDEX, PowerSamples, index_runs
+from bench.system.host import HostSample
+from bench.system.telemetry import FIELDS
+
+FORMAT_VERSION = 2
+INDEX_FILE = "index.json"
+LOG_FILE = "results.jsonl"
+
+def power_columns(samples):
+    samples = PowerSamples.of(samples)
+    return {**{field: samples.field(field) for field in FIELDS}, "index": samples.index, "device": samples.device}
+
+def power_samples(fields):
+    index = fields["index"].astype(np.int64)
+    index[index < 0] = NO_INDEX
+    return PowerSamples(np.stack([fields[field] for field in FIELDS], axis=1).astype(np.float64), index,
+                        fields["device"].astype(np.int64))
+
+HOST_FIELDS = ["time", "cpu_percent", "rss", "minor_faults", "major_faults", "ctx_switches", "read_bytes", "write_bytes"]
+
+def host_columns(samples):
+    samples = samples or []
+    columns = {field: np.array([getattr(sample, field) for sample in samples], dtype=np.float64) for field in HOST_FIELDS}
+    columns["index"] = np.array([NO_INDEX if sample.index is None else sample.index for sample in samples], dtype=np.int64)
+    columns["device"] = np.zeros(len(samples), dtype=np.int64)
+    return columns
+
+def host_samples(fields):
+    return [HostSample(**{field: restore(field, fields[field][i]) for field in HOST_FIELDS + ["index"]})
+            for i in range(len(fields["time"]))]
+
+# the telemetry traces kept for every result, one array per field. time and the ring
+# index need the precision, the rest fit in float32. every sample is keyed by its device
+# and index, so the samples overlapping results share are only stored once. `columns`
+# turns a result's samples into the arrays, `samples` turns the stored arrays back and
+# `join` puts the slices of a result back together
+TRACES = {
+    "power": {
+        "attribute": "power_samples",
+        "fields": FIELDS + ["index", "device"],
+        "columns": power_columns,
+        "samples": power_samples,
+        "join": PowerSamples.concat,
+    },
+    "host": {
+        "attribute": "host_samples",
+        "fields": HOST_FIELDS + ["index", "device"],
+        "columns": host_columns,
+        "samples": host_samples,
+        "join": lambda parts: [sample for part in parts for sample in part],
+    },
+}
+WIDE_FIELDS = ["time", "index", "rss", "minor_faults", "major_faults", "ctx_switches", "read_bytes", "write_bytes"]
+
+def field_dtype(field):
+    return np.float64 if field in WIDE_FIELDS else np.float32
+
+def is_number(value):
+    return isinstance(value, (Number, np.number)) and not isinstance(value, complex)
+
+# the numbers of a result: scalars (dicts like harness are flattened to "harness.build")
+# and lists of numbers (e.g. token times), and the names of its dicts so empty ones come
+# back too. None is kept as a scalar that has no value. text and anything else is left out
+def flatten_result(result):
+    scalars = {}
+    lists = {}
+    dicts = []
+    for name, value in vars(result).items():
+        if any(name == trace["attribute"] for trace in TRACES.values()):
+            continue
+        if value is None or is_number(value):
+            scalars[name] = None if value is None else float(value)
+        elif isinstance(value, dict):
+            dicts.append(name)
+            for key, item in value.items():
+                if item is None or is_number(item):
+                    scalars[f"{name}.{key}"] = None if item is None else float(item)
+        elif isinstance(value, list) and all(is_number(item) for item in value):
+            lists[name] = value
+    return scalars, lists, dicts
+
+# the values of a result from what flatten_result made of it, dicts (even empty ones) come back as dicts
+def unflatten(scalars: Dict[str, float], dicts: List[str]):
+    values = {name: {} for name in dicts}
+    for name, value in scalars.items():
+        if "." in name:
+            parent, key = name.split(".", 1)
+            values.setdefault(parent, {})[int(key) if key.isdigit() else key] = value
+        else:
+            values[name] = value
+    return values
+
+def file_name(number, name):
+    return f"{number:03d}_{re.sub(r'[^A-Za-z0-9_.-]+', '_', name)}.npy"
+
+# the [start, end) ranges of indices written so far, touching ranges are merged so there
+# are only as many as there are gaps between the windows
+class Coverage():
+
+    def __init__(self):
+        self.ranges = []
+
+    def missing(self, start, end):
+        gaps = []
+        for a, b in self.ranges:
+            if a >= end:
+                break
+            if b <= start:
+                continue
+            if a > start:
+                gaps.append((start, a))
+            start = b
+        if start < end:
+            gaps.append((start, end))
+        return gaps
+
+    def add(self, start, end):
+        ranges = []
+        for a, b in self.ranges:
+            if b < start or a > end:
+                ranges.append((a, b))
+            else:
+                start, end = min(a, start), max(b, end)
+        self.ranges = sorted(ranges + [(start, end)])
+
+def json_values(values: np.ndarray):
+    return [None if math.isnan(value) else value for value in values.tolist()]
+
+# every result of a suite is appended to LOG_FILE as a line of json the moment it completes
+# and fsync'd, so a run that dies loses nothing that finished. the writing is done on a
+# thread, append only queues the result so the event loop never waits on the disk.
+# telemetry isn't repeated for every result: the samples no earlier result of the test
+# had are written on their own lines first and the result only has the index ranges it
+# covers. so the results of a test can be read back from where it started in the log
+class ResultLog():
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.file = open(os.path.join(path, LOG_FILE), "ab")
+        # where each test's first line is
+        self.offsets = {}
+        # the indices of each test, trace and device already in the log
+        self.written = {}
+        # samples without an index get one of their own below NO_INDEX
+        self.unindexed = 0
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+        # a run that stops with results still queued writes them on the way out
+        atexit.register(self.close)
+
+    # raises what went wrong writing an earlier result
+    def append(self, tag: str, result):
+        if self.error:
+            raise self.error
+        # the attributes as they are now, the writer shouldn't see anything set on the result later
+        self.queue.put((tag, StoredResult(dict(vars(result)))))
+
+    # waits for everything appended so far to be on disk
+    def flush(self):
+        self.queue.join()
+        if self.error:
+            raise self.error
+
+    # the results of a test read back from the log as objects, like ResultStore.results
+    def results(self, tag: str, concurrency: int = None) -> List["StoredResult"]:
+        self.flush()
+        if tag not in self.offsets:
+            return []
+
+        lines = {name: [] for name in TRACES}
+        records = []
+        for record in read_log(self.path, self.offsets[tag]):
+            if record["test"] != tag:
+                continue
+            if "trace" in record:
+                lines[record["trace"]].append(record["samples"])
+            elif concurrency is None or record["scalars"].get("concurrency") == concurrency:
+                records.append(record)
+
+        samples = {name: logged_samples(name, parts) for name, parts in lines.items()}
+        results = []
+        for record in records:
+            values = unflatten(record["scalars"], record["dicts"])
+            values.update(record["lists"])
+            for name, trace in TRACES.items():
+                keys, trace_samples = samples[name]
+                ranges = np.array(record["traces"].get(name, []), dtype=np.int64).reshape(-1, 3)
+                starts = np.searchsorted(keys, sample_keys(ranges[:, 0], ranges[:, 1]))
+                values[trace["attribute"]] = trace["join"]([trace_samples[start:start + end - first]
+                                                            for start, (_, first, end) in zip(starts.tolist(), ranges.tolist())])
+            results.append(StoredResult(values))
+        return results
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if not self.file.closed:
+            self.file.close()
+        if self.error:
+            raise self.error
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if not self.error:
+                    self._write_result(*item)
+            except Exception as e:
+                logger.error(f"Failed to write a result to {self.path}: {e}")
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _write_result(self, tag: str, result):
+        self.offsets.setdefault(tag, self.file.tell())
+        scalars, lists, dicts = flatten_result(result)
+        traces = {}
+        for name, trace in TRACES.items():
+            columns = trace["columns"](getattr(result, trace["attribute"], None))
+            unindexed = columns["index"] == NO_INDEX
+            if unindexed.any():
+                count = int(unindexed.sum())
+                columns["index"] = columns["index"].copy()
+                columns["index"][unindexed] = np.arange(count) + NO_INDEX - self.unindexed - count
+                self.unindexed += count
+
+            traces[name] = []
+            for device, start, end, position in index_runs(columns["device"], columns["index"]):
+                coverage = self.written.setdefault((tag, name), {}).setdefault(device, Coverage())
+                for a, b in coverage.missing(start, end):
+                    window = slice(position + a - start, position + b - start)
+                    samples = {field: json_values(columns[field][window].astype(np.float64)) for field in trace["fields"]}
+                    self.file.write((json.dumps({"test": tag, "trace": name, "samples": samples}) + "\n").encode())
+                coverage.add(start, end)
+                traces[name].append([device, start, end])
+
+        record = {
+            "test": tag,
+            "scalars": scalars,
+            "lists": lists,
+            "dicts": dicts,
+            "traces": traces,
+        }
+        self.file.write((json.dumps(record, default=float) + "\n").encode())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+# the records of a log from byte `offset` on: results, and the trace samples they refer
+# to. a run killed mid write leaves a partial last line, which is skipped
+def read_log(path: str, offset: int = 0):
+    with open(os.path.join(path, LOG_FILE), "rb") as f:
+        f.seek(offset)
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping a partially written result in {path}")
+
+# the device and index of a sample as one number that sorts by both, the indices
+# ResultLog gives samples without one are negative
+def sample_keys(device: np.ndarray, index: np.ndarray) -> np.ndarray:
+    return (device.astype(np.int64) << 42) + index.astype(np.int64) + (1 << 41)
+
+# the samples of a trace from its lines in a log, once each and sorted by their keys
+# (a test's first sample can also be the last of the test before it), and the keys
+def logged_samples(name: str, lines: List[dict]):
+    trace = TRACES[name]
+    fields = {field: np.array([np.nan if value is None else value for line in lines for value in line[field]], dtype=np.float64)
+              for field in trace["fields"]}
+    keys, first = np.unique(sample_keys(fields["device"], fields["index"]), return_index=True)
+    return keys, trace["samples"]({field: values[first] for field, values in fields.items()})
+
+# turns the log in `path` into columns: one .npy file per field with a row per result,
+# lists concatenated into one array per field with the offsets of each result's slice,
+# the samples of each trace once, sorted by device and index so the ranges of a result
+# are slices of them, and index.json describing the files and which rows belong to
+# which test. `info` is the csv row of each test. the log is read twice (once for the
+# shapes, once for the values) and written straight into memory mapped files, so only
+# the lengths of each result's lists and the keys of the samples are held in memory
+def compact_result_log(path: str, info: Dict[str, dict] = None):
+    info = info or {}
+    counts = {}
+    scalar_names = set()
+    list_names = set()
+    # scalars that were None in some result, and every dict field
+    null_names = set()
+    dict_names = set()
+    # the test of each record, how long its lists are and how many ranges each trace has, in log order
+    records = []
+    # the devices and indices of the samples of each trace, in log order
+    keys = {name: ([], []) for name in TRACES}
+    for record in read_log(path):
+        if "trace" in record:
+            devices, indices = keys[record["trace"]]
+            devices.append(np.array(record["samples"]["device"], dtype=np.int64))
+            indices.append(np.array(record["samples"]["index"], dtype=np.int64))
+            continue
+        counts[record["test"]] = counts.get(record["test"], 0) + 1
+        scalar_names.update(record["scalars"])
+        list_names.update(record["lists"])
+        null_names.update(name for name, value in record["scalars"].items() if value is None)
+        dict_names.update(record.get("dicts", []))
+        records.append((record["test"], {name: len(values) for name, values in record["lists"].items()},
+                        {name: len(ranges) for name, ranges in record["traces"].items()}))
+    rows = len(records)
+
+    # rows are grouped by test, sharded tests log their results interleaved
+    starts = {}
+    row = 0
+    for tag, count in counts.items():
+        starts[tag] = row
+        row += count
+
+    positions = []
+    seen = dict.fromkeys(counts, 0)
+    lengths = [None] * rows
+    for tag, list_lengths, range_counts in records:
+        position = starts[tag] + seen[tag]
+        seen[tag] += 1
+        positions.append(position)
+        lengths[position] = (list_lengths, range_counts)
+    del records
+
+    list_offsets = {name: np.cumsum([0] + [lengths[r][0].get(name, 0) for r in range(rows)], dtype=np.int64) for name in list_names}
+    range_offsets = {name: np.cumsum([0] + [lengths[r][1].get(name, 0) for r in range(rows)], dtype=np.int64) for name in TRACES}
+    del lengths
+
+    # where each sample of a trace goes (in log order), and the sorted keys to find a range's
+    # start in. every test logs its own samples, the edge of two tests is there twice
+    destinations = {}
+    sorted_keys = {}
+    for name, (devices, indices) in keys.items():
+        key = sample_keys(np.concatenate(devices), np.concatenate(indices)) if devices else np.empty(0, dtype=np.int64)
+        sorted_keys[name], destinations[name] = np.unique(key, return_inverse=True)
+    del keys
+
+    files = iter(range(10 ** 6))
+    arrays = {}
+
+    def create(name, shape, dtype, fill=None):
+        file = file_name(next(files), name)
+        array = np.lib.format.open_memmap(os.path.join(path, file), mode="w+", dtype=dtype, shape=shape)
+        if fill is not None:
+            array[:] = fill
+        return file, array
+
+    def save(name, array):
+        file = file_name(next(files), name)
+        np.save(os.path.join(path, file), array)
+        return file
+
+    index = {
+        "format": FORMAT_VERSION,
+        "rows": rows,
+        "tests": [{"tag": tag, "start": starts[tag], "end": starts[tag] + count, "info": info.get(tag, {})}
+                  for tag, count in counts.items()],
+        "scalars": {}, "lists": {}, "traces": {},
+        "nulls": sorted(null_names), "dicts": sorted(dict_names),
+    }
+
+    # a result without a field reads NaN, as does one that was None (see "nulls")
+    for name in sorted(scalar_names):
+        index["scalars"][name], arrays[("scalars", name)] = create(name, (rows,), np.float64, np.nan)
+    for name in sorted(list_names):
+        values, arrays[("lists", name)] = create(name, (int(list_offsets[name][-1]),), np.float64)
+        index["lists"][name] = {"values": values, "offsets": save(f"{name}.offsets", list_offsets[name])}
+    # the [start, end) slice of the samples of every range of every result, and where each result's ranges start
+    for name, trace in TRACES.items():
+        fields = {}
+        for field in trace["fields"]:
+            fields[field], arrays[(name, field)] = create(f"{name}.{field}", (len(sorted_keys[name]),), field_dtype(field))
+        ranges, arrays[(name, "ranges")] = create(f"{name}.ranges", (int(range_offsets[name][-1]), 2), np.int64)
+        index["traces"][name] = {"fields": fields, "ranges": ranges, "offsets": save(f"{name}.offsets", range_offsets[name])}
+
+    results = iter(positions)
+    written = dict.fromkeys(TRACES, 0)
+    for record in read_log(path):
+        if "trace" in record:
+            name = record["trace"]
+            count = len(record["samples"]["index"])
+            where = destinations[name][written[name]:written[name] + count]
+            written[name] += count
+            for field, values in record["samples"].items():
+                arrays[(name, field)][where] = [np.nan if value is None else value for value in values]
+            continue
+
+        position = next(results)
+        for name, value in record["scalars"].items():
+            arrays[("scalars", name)][position] = np.nan if value is None else value
+        for name, values in record["lists"].items():
+            arrays[("lists", name)][list_offsets[name][position]:list_offsets[name][position + 1]] = values
+        for name, ranges in record["traces"].items():
+            if ranges:
+                ranges = np.array(ranges, dtype=np.int64)
+                first = np.searchsorted(sorted_keys[name], sample_keys(ranges[:, 0], ranges[:, 1]))
+                arrays[(name, "ranges")][range_offsets[name][position]:range_offsets[name][position + 1]] = \
+                    np.stack([first, first + ranges[:, 2] - ranges[:, 1]], axis=1)
+
+    for array in arrays.values():
+        array.flush()
+
+    # numbers that don't fit json (inf, numpy types) are written as strings
+    with open(os.path.join(path, INDEX_FILE), "w") as f:
+        json.dump(index, f, indent=2, default=str)
+
+class StoredResult():
+
+    def __init__(self, values):
+        vars(self).update(values)
+
+# reads a suite written by compact_result_log. arrays are memory mapped, so only what
+# is used is read from disk
+class ResultStore():
+
+    def __init__(self, path: str):
+        self.path = path
+        # a run that didn't get to the end of the suite only left its log
+        if not os.path.exists(os.path.join(path, INDEX_FILE)):
+            compact_result_log(path)
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        if self.index["format"] != FORMAT_VERSION:
+            raise Exception(f"Result store {path} has format {self.index['format']}, expected {FORMAT_VERSION}")
+
+        self.rows = self.index["rows"]
+        self.tests = {test["tag"]: test for test in self.index["tests"]}
+        self._arrays: Dict[str, np.ndarray] = {}
+        # every sample of a trace rebuilt once, the results get slices of them
+        self._samples = {}
+
+    def _load(self, file):
+        if file not in self._arrays:
+            self._arrays[file] = np.load(os.path.join(self.path, file), mmap_mode="r")
+        return self._arrays[file]
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self.index["scalars"])
+
+    @property
+    def list_fields(self) -> List[str]:
+        return list(self.index["lists"])
+
+    # the rows of a test
+    def test_rows(self, tag: str) -> slice:
+        test = self.tests[tag]
+        return slice(test["start"], test["end"])
+
+    # one value per result
+    def column(self, name: str) -> np.ndarray:
+        return self._load(self.index["scalars"][name])
+
+    def list_values(self, name: str, row: int) -> np.ndarray:
+        entry = self.index["lists"][name]
+        offsets = self._load(entry["offsets"])
+        return self._load(entry["values"])[offsets[row]:offsets[row + 1]]
+
+    # the [start, end) slices of the trace that make up what one result saw
+    def trace_ranges(self, name: str, row: int) -> np.ndarray:
+        entry = self.index["traces"][name]
+        offsets = self._load(entry["offsets"])
+        return self._load(entry["ranges"])[offsets[row]:offsets[row + 1]]
+
+    # every field of the trace ("power" or "host") of one result, or every sample of
+    # the suite once when row is None
+    def trace(self, name: str, row: int = None) -> Dict[str, np.ndarray]:
+        fields = {field: self._load(file) for field, file in self.index["traces"][name]["fields"].items()}
+        if row is None:
+            return fields
+        ranges = self.trace_ranges(name, row)
+        return {field: np.concatenate([values[start:end] for start, end in ranges] or [values[:0]])
+                for field, values in fields.items()}
+
+    # the samples of a trace one result saw, as slices of the suite's samples so the
+    # results that overlapped share them
+    def trace_samples(self, name: str, row: int):
+        trace = TRACES[name]
+        if name not in self._samples:
+            self._samples[name] = trace["samples"](self.trace(name))
+        samples = self._samples[name]
+        return trace["join"]([samples[start:end] for start, end in self.trace_ranges(name, row).tolist()])
+
+    # the results of a test (or all of them) rebuilt as objects, so the suites' columns
+    # can be computed again without running anything. a sweep logs the results of every
+    # level it ran, `concurrency` picks one (the row in info is the knee concurrency's)
+    def results(self, tag: str = None, concurrency: int = None) -> List[StoredResult]:
+        rows = range(self.rows)[self.test_rows(tag)] if tag else range(self.rows)
+        if concurrency is not None:
+            levels = self.column("concurrency")
+            rows = [row for row in rows if levels[row] == concurrency]
+        columns = {name: self.column(name) for name in self.fields}
+        nulls = set(self.index.get("nulls", []))
+        results = []
+
+        for row in rows:
+            scalars = {}
+            for name, column in columns.items():
+                value = float(column[row])
+                if np.isnan(value):
+                    # NaN is a field the result didn't have, unless the field was None
+                    if name not in nulls:
+                        continue
+                    value = None
+                scalars[name] = value
+            values = unflatten(scalars, self.index.get("dicts", []))
+
+            for name in self.list_fields:
+                values[name] = self.list_values(name, row).tolist()
+
+            for trace_name, trace in TRACES.items():
+                values[trace["attribute"]] = self.trace_samples(trace_name, row)
+
+            results.append(StoredResult(values))
+
+        return results
+
+def restore(field, value):
+    value = float(value)
+    if np.isnan(value) or field == "index" and value < 0:
+        return None
+    if field in ("index", "device", "throttle_reasons"):
+        return int(value)
+    if field == "throttled":
+        return bool(value)
+    return value
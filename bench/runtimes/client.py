@@ -0,0 +1,48 @@
+import asyncio
+import aiohttp
+
+from bench.logger import logger
+
+# shared http client for talking to the runtime servers. a single keep-alive
+# pool is reused for every request so connection setup isn't part of the
+# measured time, and requests are plain coroutines so one process can keep
+# hundreds of streams in flight without a thread each.
+class RuntimeClient:
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._session = None
+        return cls._instance
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # the session has to be created inside the running event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                # the load drivers decide how many requests are in flight, so don't cap the pool
+                connector=aiohttp.TCPConnector(limit=0, keepalive_timeout=60),
+                # generations can take minutes on slow hardware
+                timeout=aiohttp.ClientTimeout(total=None),
+            )
+        return self._session
+
+    # open `count` pooled connections to the server ahead of the first timed request
+    async def warm(self, url: str, count: int = 1):
+        async def request():
+            try:
+                async with self.session.get(url) as response:
+                    await response.read()
+            except aiohttp.ClientError as e:
+                logger.debug(f"Failed to warm connection to {url}: {e}")
+
+        await asyncio.gather(*[request() for _ in range(count)])
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+def get_client():
+    return RuntimeClient()
@@ -1,14 +1,18 @@
 
+import copy
 import json
+import os
+import sys
 import time
 import uuid
-from bench import logger
+from bench.logger import logger
 from bench.benchmarks.creation import CreationBenchmarkResult
 from bench.benchmarks.benchmark_test import BenchmarkTest
 from bench.runtimes.runtime import Runtime
-import websocket
-import urllib.request
-import urllib.parse
+from bench.runtimes.supervisor import ProcessSupervisor
+from bench.utils import HarnessTimer
+import aiohttp
+from bench.runtimes.client import get_client
 
 BASE_REQ = {
     "3": {
@@ -101,52 +105,112 @@ class ComfyRuntime(Runtime):
 
     def __init__(self, cfg):
         super().__init__(cfg)
-        self.pid = None
+        # comfy is left running between tests unless a checkout is given to manage
+        self.path = cfg.get("path", None)
+        self.supervisor = None
+        # an unmanaged server is shared, so it can only run one test at a time
+        self.supports_sharding = self.path is not None
+        # the checkpoint is loaded with the first prompt, not on start, see _benchmark_creation
+        self.supports_cold_start = False
 
-        self.server_address = "localhost:8188"
+        self.port = cfg.get("port", 8188)
+        self.server_address = f"localhost:{self.port}"
         self.client_id = str(uuid.uuid4())
-
-        self.ws = websocket.WebSocket()
-        self.ws.connect("ws://{}/ws?clientId={}".format(self.server_address, self.client_id))
+        # connected on the first benchmark, it has to be opened inside the event loop
+        self.ws = None
 
     def _download(self):
         pass
 
-    def _start(self, model: BenchmarkTest):
+    def _start(self, model: BenchmarkTest, config = None):
+        if not self.path:
+            return True
+
+        host, port = self.server_address.split(":")
+        self.supervisor = ProcessSupervisor(
+            self.name,
+            [sys.executable, "main.py", "--listen", host, "--port", port],
+            ready_patterns=["To see the GUI go to"],
+            health_url=f"http://{self.server_address}/system_stats",
+            startup_timeout=self.cfg.get("startup_timeout", 600),
+            env=self.server_env(),
+            cwd=os.path.expanduser(self.path),
+        )
+        if not self.supervisor.start():
+            self._stop()
+            return False
+
+        self.ready_time = time.perf_counter()
         return True
 
+    @property
+    def pid(self):
+        return self.supervisor.pid if self.supervisor else None
+
     def _stop(self):
+        if self.supervisor:
+            self.supervisor.stop()
+            self.supervisor = None
+            # the old socket went away with the server
+            self.ws = None
         return True
 
-    def benchmark(self, model: BenchmarkTest, data, config):
+    # comfy keeps checkpoints in memory between prompts, ask it to drop them. a managed
+    # server that isn't running has nothing loaded, a fresh process starts cold
+    async def evict_model_cache(self, model):
+        if self.path and not self.supervisor:
+            return await super().evict_model_cache(model)
+
+        try:
+            async with get_client().session.post(f"http://{self.server_address}/free", json={"unload_models": True, "free_memory": True}) as response:
+                await response.read()
+        except aiohttp.ClientError as e:
+            logger.warning(f"Could not ask comfy at {self.server_address} to free its models: {e}")
+
+    async def warm_connections(self, count: int = 1):
+        await get_client().warm(f"http://{self.server_address}/system_stats", count)
+
+    async def benchmark(self, model: BenchmarkTest, data, config):
         if (model.type == "creation"):
-            return self._benchmark_creation(model, data, config)
+            return await self._benchmark_creation(model, data, config)
         else:
             logger.warning(f"Model type: {model.type} not supported for comfy runtime")
             return None
     
-    def _benchmark_creation(self, model: BenchmarkTest, data, config):
-        req = BASE_REQ.copy()
-
-        req['4']['inputs']['ckpt_name'] = model.filename
-        req['3']['inputs']['steps'] = model.steps
-        req['3']['inputs']['scheduler'] = model.scheduler
-        req['3']['inputs']['cfg'] = model.cfg_scale
-        req['5']['inputs']['width'] = config['resolution']
-        req['5']['inputs']['height'] = config['resolution']
-        req['6']['inputs']['text'] = data['prompt']
-        req['7']['inputs']['text'] = data['negative']
-
-        prompt_id = self._queue_prompt(req)['prompt_id']
+    async def _benchmark_creation(self, model: BenchmarkTest, data, config):
+        timer = HarnessTimer()
+
+        with timer.phase("build"):
+            # the nodes are nested dicts, a shallow copy would have every request (and every
+            # sharded worker) writing into BASE_REQ itself
+            req = copy.deepcopy(BASE_REQ)
+
+            req['4']['inputs']['ckpt_name'] = model.filename
+            req['3']['inputs']['steps'] = model.steps
+            req['3']['inputs']['scheduler'] = model.scheduler
+            req['3']['inputs']['cfg'] = model.cfg_scale
+            req['5']['inputs']['width'] = config['resolution']
+            req['5']['inputs']['height'] = config['resolution']
+            req['6']['inputs']['text'] = data['prompt']
+            req['7']['inputs']['text'] = data['negative']
+
+        if self.ws is None or self.ws.closed:
+            self.ws = await get_client().session.ws_connect(f"ws://{self.server_address}/ws?clientId={self.client_id}")
+
+        prompt_id = (await self._queue_prompt(req))['prompt_id']
         start = time.time()
         k_sampler_started = None
         model_load_started = None
         model_load_time = 0 
         k_sampler_sec_elapsed = []
         while True:
-            out = self.ws.recv()
-            if isinstance(out, str):
-                message = json.loads(out)
+            out = await self.ws.receive()
+            if out.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                logger.error(f"Comfy websocket closed while waiting for prompt {prompt_id}")
+                return None
+            if out.type == aiohttp.WSMsgType.TEXT:
+                with timer.phase("decode"):
+                    message = json.loads(out.data)
                 if message['type'] == 'executing':
                     data = message['data']
                     if data['node'] is None and data['prompt_id'] == prompt_id:
@@ -167,10 +231,17 @@ class ComfyRuntime(Runtime):
                 continue #previews are binary data
 
         total_time = time.time() - start
-        return CreationBenchmarkResult(total_time, k_sampler_sec_elapsed, model_load_time)
+        # comfy loads the checkpoint with the first prompt rather than on start
+        if model_load_time and "load time" not in self.load_stats:
+            self.load_stats["load time"] = model_load_time
+
+        with timer.phase("result"):
+            result = CreationBenchmarkResult(total_time, k_sampler_sec_elapsed, model_load_time)
+        result.harness = timer.phases
+
+        return result
 
-    def _queue_prompt(self,prompt):
+    async def _queue_prompt(self, prompt):
         p = {"prompt": prompt, "client_id": self.client_id}
-        data = json.dumps(p).encode('utf-8')
-        req =  urllib.request.Request("http://{}/prompt".format(self.server_address), data=data)
-        return json.loads(urllib.request.urlopen(req).read())
\ No newline at end of file
+        async with get_client().session.post(f"http://{self.server_address}/prompt", json=p) as response:
+            return await response.json()
\ No newline at end of file
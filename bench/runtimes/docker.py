@@ -6,10 +6,10 @@ class DockerRuntime(Runtime):
     def _download(self):
         pass
 
-    def benchmark(self, model, datasets):
+    async def benchmark(self, model, data, config = None):
         pass
 
-    def _start(self, model: BenchmarkTest) -> bool:
+    def _start(self, model: BenchmarkTest, config = None) -> bool:
         pass
     
     def _stop(self) -> bool:
@@ -2,63 +2,48 @@ import abc
 import base64
 import json
 import os
-import signal
-import subprocess
-import threading
 import time
 from jinja2 import Template
-import requests
+import aiohttp
 
 from bench.benchmarks.hearing import HearingBenchmarkResult
 from bench.benchmarks.language import LanguageBenchmarkResult
 from bench.benchmarks.model import Model
-from bench.config import HOST, PORT
+from bench.config import HOST
+from bench.runtimes.client import get_client
 from bench.runtimes.runtime import Runtime
-from bench.utils import kill, url_downloader
+from bench.runtimes.sse import SSEParser
+from bench.runtimes.supervisor import ProcessSupervisor
+from bench.utils import HarnessTimer, url_downloader
 from bench.logger import logger
 
-def read_stderr(pipe, stop_event, stderr_lines, stop_reading_event):
-    while not stop_reading_event.is_set():
-        line = pipe.readline()
-        if not line:
-            break
-        decoded_line = line.decode()
-        logger.debug(decoded_line)
-        stderr_lines.append(decoded_line)
-        if "CUDA error: no kernel image is available for execution on the device" in decoded_line:
-            # logger.info("need to recompile!", decoded_line)
-            stop_event.set()
-        if "compile_nvidia" in decoded_line:
-            pass
-            # logger.info("compiling for nvidia", decoded_line)
-        if "cudaMalloc failed: out of memory" in decoded_line:
-            # logger.info("cudaMalloc failed: out of memory", decoded_line)
-            stop_event.set()
-        if "server listening" in decoded_line:
-            stop_event.set()
-
-def read_stdout(pipe, stop_event, stderr_lines):
-    while not stop_event.is_set():
-        line = pipe.readline()
-        decoded_line = line.decode()
-        # logger.debug(decoded_line)
+JSON_HEADERS = {"Content-Type": "application/json"}
 
+KERNEL_IMAGE_ERROR = "CUDA error: no kernel image is available for execution on the device"
+OUT_OF_MEMORY_ERROR = "cudaMalloc failed: out of memory"
 
 class ExecutableGGMLRuntime(Runtime, abc.ABC):
+    # cheap endpoint used to open connections before the first request
+    warm_path = "/"
 
     def __init__(self, cfg):
         super().__init__(cfg)
-        self.pid = None
+        self.supervisor = None
+        self.supports_sharding = True
 
     def _download(self):
         self.executable = self._download_executable_ggml_runtime()
 
-    def _start(self, model: Model):
-        return self._start_server(model)
+    def _start(self, model: Model, config = None):
+        parallel = (config or {}).get("concurrency", 1)
+        return self._start_server(model, parallel=parallel)
     
     def _stop(self):
         self._stop_server()
 
+    async def warm_connections(self, count: int = 1):
+        await get_client().warm(f"{self.url}{self.warm_path}", count)
+
     def _download_executable_ggml_runtime(self):
         version = self.cfg.get("version", None)
         url = self.cfg.get('url', None)
@@ -81,78 +66,81 @@ class ExecutableGGMLRuntime(Runtime, abc.ABC):
 
         return executable
 
-    def _start_server(self, model: Model, ngl = 9999, recompile = False, attempt = 0):
+    def _start_server(self, model: Model, ngl = 9999, recompile = False, attempt = 0, parallel = 1):
         if (attempt > 3):
-            raise Exception("Failed to start llamafile server for model {model.name} after 3 attempts. Exiting.")
+            raise Exception(f"Failed to start llamafile server for model {model.name} after 3 attempts. Exiting.")
 
         if model.type == "hearing":
-            cmd_str = " ".join([
+            cmd = [
                 self.executable,
-                f"-m {model.path}",
-                f"--port {PORT}",
-                "--gpu auto",
-                f"--host {HOST}",
-                f"--convert",
-                "--recompile" if recompile else "",
-                ">&2"
-            ])
+                "-m", model.path,
+                "--port", str(self.port),
+                "--gpu", "auto",
+                "--host", HOST,
+                "--convert",
+            ]
+            if recompile:
+                cmd.append("--recompile")
+            # whisperfile has no health endpoint, it's ready once it logs that it's listening
+            health_url = None
         else:
-            cmd_str = " ".join([
-                self.executable,
-                f"-m {model.path}",
-                f"--mmproj {model.projector_path}" if model.projector_path else "",
-                "-c 4096",
-                "--nobrowser",
-                f"--host {HOST}",
-                f"--port {PORT}",
-                "--recompile" if recompile else "",
-                f"-ngl {str(ngl)}" if ngl != 0 else "",
-                ">&2"
-            ])
+            cmd = [self.executable, "-m", model.path]
+            if model.projector_path:
+                cmd += ["--mmproj", model.projector_path]
+            # the context is split evenly between the slots, so scale it up
+            cmd += ["-c", str(4096 * parallel)]
+            if parallel > 1:
+                cmd += ["--parallel", str(parallel), "--cont-batching"]
+            cmd += ["--nobrowser", "--host", HOST, "--port", str(self.port)]
+            if recompile:
+                cmd.append("--recompile")
+            if ngl != 0:
+                cmd += ["-ngl", str(ngl)]
+            health_url = f"http://{HOST}:{self.port}/health"
+
+        self.supervisor = ProcessSupervisor(
+            self.name,
+            cmd,
+            ready_patterns=["server listening"],
+            failure_patterns=[KERNEL_IMAGE_ERROR, OUT_OF_MEMORY_ERROR],
+            health_url=health_url,
+            startup_timeout=self.cfg.get("startup_timeout", 600),
+            env=self.server_env(),
+        )
 
         try:
-            stdout_lines = []
-            stderr_lines = []
-            stop_event = threading.Event()
-            stop_reading_event = threading.Event()  # Event to stop reading entirely
-            proc = subprocess.Popen(cmd_str, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=os.setsid)
-            self.pid = proc.pid
-
-            logger.info(f"Started llamafile server with pid: {self.pid}\ncommand string: {cmd_str}")
-
-            # Start threads to read both stdout and stderr
-            stderr_thread = threading.Thread(target=read_stderr, args=(proc.stderr, stop_event, stderr_lines, stop_reading_event))
-            stdout_thread = threading.Thread(target=read_stdout, args=(proc.stdout, stop_event, stdout_lines))
-            stderr_thread.start()
-            stdout_thread.start()
-
-            # Wait until the stop_event is set
-            while not stop_event.is_set():
-                pass
-
-            # Handle the situation depending on the collected stderr and stdout
-            for line in stderr_lines:
-                if "CUDA error: no kernel image is available for execution on the device" in line:
-                    self._stop_server()
-                    self._start_server(model, ngl, recompile=True, attempt=attempt + 1)
-                elif "cudaMalloc failed: out of memory" in line:
-                    kill(self.pid)
-                    return False
-
-            self.url = f"http://{HOST}:{PORT}"
+            if not self.supervisor.start():
+                failure = self.supervisor.failure
+                self._stop_server()
+
+                if failure == KERNEL_IMAGE_ERROR:
+                    return self._start_server(model, ngl, recompile=True, attempt=attempt + 1, parallel=parallel)
+                return False
+
+            load_time = self.supervisor.ready_time - self.supervisor.spawn_time
+            self.ready_time = time.perf_counter()
+            model_bytes = sum(os.path.getsize(p) for p in [model.path, model.projector_path] if p and os.path.exists(p))
+            self.load_stats = {
+                "load time": load_time,
+                "load MB/s": model_bytes / 1e6 / load_time,
+            }
+
+            self.url = f"http://{HOST}:{self.port}"
             return True
 
         except Exception as e:
             logger.error(e)
             self._stop_server()
+            return False
+
+    @property
+    def pid(self):
+        return self.supervisor.pid if self.supervisor else None
 
     def _stop_server(self):
-        if hasattr(self, 'pid') and self.pid:
-            try:
-                os.killpg(os.getpgid(self.pid), signal.SIGTERM)
-            except ProcessLookupError:
-                pass  # Process already terminated
-            self.pid = None
+        if getattr(self, 'supervisor', None):
+            self.supervisor.stop()
+            self.supervisor = None
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._stop_server()
@@ -161,51 +149,79 @@ class ExecutableGGMLRuntime(Runtime, abc.ABC):
         self._stop_server()
 
 class LlamafileRuntime(ExecutableGGMLRuntime):
-    
-        def benchmark(self, model: Model, data, config = None):
-            req_data = {}
-
-            # TODO call the same function just with image
-            if model.type == "vision":
-                req_data = self._build_llamacpp_request(model, data, data.path)
-            elif model.type == "language":
-                req_data = self._build_llamacpp_request(model, data)
-            else:
-                logger.warning(f"Benchmark type: {model.type} not supported for llamafile runtime")
-                return None
+        warm_path = "/health"
+
+        def __init__(self, cfg):
+            super().__init__(cfg)
+            self.supports_concurrency = True
+
+        async def benchmark(self, model: Model, data, config = None):
+            timer = HarnessTimer()
+
+            with timer.phase("build"):
+                # TODO call the same function just with image
+                if model.type == "vision":
+                    req_data = self._build_llamacpp_request(model, data, data.path)
+                elif model.type == "language":
+                    req_data = self._build_llamacpp_request(model, data)
+                else:
+                    logger.warning(f"Benchmark type: {model.type} not supported for llamafile runtime")
+                    return None
+
+                # serialize up front so encoding the body isn't counted as server time
+                body = json.dumps(req_data)
 
             t_start = time.perf_counter()
-            response = requests.post(f"{self.url}/completion", json=req_data, stream=True)
+            async with get_client().session.post(f"{self.url}/completion", data=body, headers=JSON_HEADERS) as response:
+                result = await self._decode_llamacpp_streaming_response(response, t_start, timer)
 
-            result = self._decode_llamacpp_streaming_response(response, t_start)
+            if result:
+                result.harness = timer.phases
+                # ttft is measured from here, not from when the harness started the run
+                result.sent_time = t_start
 
             return result
 
-        def _decode_llamacpp_streaming_response(self, response, t_start):
+        async def _decode_llamacpp_streaming_response(self, response, t_start, timer: HarnessTimer):
             ttft = None
             completed_response = None
-
-            data = b''
+            token_times = []
             message = ""
-            for chunk in response:
-                for line in chunk.splitlines(keepends=True):
-                    data += line
-                if data.endswith((b"\r\r", b"\n\n", b"\r\n\r\n")):
-                    rows = [l for l in data.decode().split("\n") if l.strip()]
-                    for row in rows:
-                        json_data = json.loads(row[6:])
-                        if not ttft:
-                            ttft = (time.perf_counter() - t_start) * 1000
-                        if json_data.get('timings'):
-                            completed_response = json_data
-                        message += json_data.get('content', "")
-                    data = b''
+            n_events = 0
+
+            parser = SSEParser()
+
+            def handle(events, now):
+                nonlocal ttft, completed_response, message, n_events
+                for event in events:
+                    json_data = json.loads(event.data)
+                    n_events += 1
+                    if not ttft:
+                        ttft = now
+                    if json_data.get('timings'):
+                        completed_response = json_data
+                    # every event before the final one carries a single token
+                    if not json_data.get('stop'):
+                        token_times.append(now)
+                    message += json_data.get('content', "")
+
+            # iter_any hands over data as soon as it arrives instead of waiting to fill a buffer
+            async for chunk in response.content.iter_any():
+                t_chunk = time.perf_counter()
+                with timer.phase("decode"):
+                    handle(parser.feed(chunk), (t_chunk - t_start) * 1000)
+
+            handle(parser.close(), (time.perf_counter() - t_start) * 1000)
 
             if not completed_response:
                 logger.error("No completion response received")
                 return None
 
-            return LanguageBenchmarkResult(data, completed_response, message, ttft)
+            with timer.phase("result"):
+                result = LanguageBenchmarkResult(completed_response.get('prompt'), completed_response, message, ttft, token_times)
+            # time spent in the client parsing and decoding each event
+            result.decode_overhead = timer.phases.get("decode", 0) / n_events * 1e6
+            return result
 
         def _build_llamacpp_request(self, model, prompt, image = None, stream = True):
             data = {}
@@ -225,30 +241,36 @@ class LlamafileRuntime(ExecutableGGMLRuntime):
 
 class WhisperfileRuntime(ExecutableGGMLRuntime):
 
-        def benchmark(self, model: Model, data, config = None):
+        async def benchmark(self, model: Model, data, config = None):
             if (model.type == "hearing"):
                 # TODO this really doesnt make sense as a wrapper, 
                 # need to return without thinking or having to program in
-                return self._benchmark_hearing(model, data)
+                return await self._benchmark_hearing(model, data)
             else:
                 logger.warning(f"Benchmark type: {model.type} not supported for whisperfile runtime")
 
-        def _benchmark_hearing(self, model: Model, data):
-            files = {
-                'file': (data.name, open(data.path, 'rb'))
-            }
-            req_data = {
-                'temperature': 0,
-                'temperature_inc': 0.2,
-                'response_format': "verbose_json"
-            }
+        async def _benchmark_hearing(self, model: Model, data):
+            timer = HarnessTimer()
+
+            with timer.phase("build"):
+                req_data = aiohttp.FormData()
+                with open(data.path, 'rb') as f:
+                    req_data.add_field('file', f.read(), filename=data.name)
+                req_data.add_field('temperature', "0")
+                req_data.add_field('temperature_inc', "0.2")
+                req_data.add_field('response_format', "verbose_json")
+
+            async with get_client().session.post(f"{self.url}/inference", data=req_data) as response:
+                body = await response.read()
 
-            response = requests.post(f"{self.url}/inference", files=files, data=req_data)
-            response_json = response.json()
+            with timer.phase("decode"):
+                response_json = json.loads(body)
             # TODO handle errors
             # if (response_json.get("error")):
             #     logger.warning(f"Error: {response_json.get('error')} on {file}")
 
-            result = HearingBenchmarkResult(response_json)
+            with timer.phase("result"):
+                result = HearingBenchmarkResult(response_json)
+            result.harness = timer.phases
 
             return result
@@ -3,6 +3,7 @@ import os
 
 from bench.benchmarks.model import Model
 from bench import config
+from bench.utils import evict_page_cache
 
 class Runtime(abc.ABC):
     def __init__(self, cfg):
@@ -12,13 +13,44 @@ class Runtime(abc.ABC):
         self.cfg = cfg
         self.dir = os.path.join(config.RUNTIME_STORE_DIR, self.name)
         self.started = False
+        # whether the runtime can serve multiple requests at once
+        self.supports_concurrency = False
+        # whether the harness runs the server itself, so copies of it can run side by
+        # side on different devices, see for_worker
+        self.supports_sharding = False
+        # whether starting the server loads the model, so --cold-start can time a cold load
+        self.supports_cold_start = True
+        self.port = cfg.get("port", config.PORT)
+        # how long the last start took to load the model, filled in by _start
+        self.load_stats = {}
+        # time.perf_counter() when the server became ready to take requests
+        self.ready_time = None
+        # extra environment for the server process, e.g. which devices it can see
+        self.env = {}
 
         self._download()
 
+    # pid of the server process if the harness started it, used to sample its resource usage
+    @property
+    def pid(self):
+        return None
+
+    # a separate instance of this runtime whose server listens on its own port, for
+    # running tests on several devices at once
+    def for_worker(self, port: int) -> 'Runtime':
+        return type(self)({**self.cfg, "port": port})
+
+    # environment to start the server process with, None to inherit ours unchanged
+    def server_env(self):
+        return {**os.environ, **self.env} if self.env else None
+
     # TODO remove model from this, instead have explicit load methods for the model to run
-    def start(self, model: Model) -> bool:
+    def start(self, model: Model, config = None, env = None) -> bool:
         if not self.started:
-            self.started = self._start(model)
+            self.env = env or {}
+            self.load_stats = {}
+            self.ready_time = None
+            self.started = self._start(model, config)
             return self.started
         
     def stop(self) -> bool:
@@ -29,15 +61,25 @@ class Runtime(abc.ABC):
     # TODO this probably should be split up a different way.
     # the handling is very ugly in Runtime.
     @abc.abstractmethod
-    def benchmark(self, model, data, config = None):
+    async def benchmark(self, model, data, config = None):
         pass
 
+    # open connections to the server before any timed requests are sent
+    async def warm_connections(self, count: int = 1):
+        pass
+
+    # make sure the next start has to load the model from disk
+    async def evict_model_cache(self, model: Model):
+        for path in [model.path, model.projector_path]:
+            if path and os.path.exists(path):
+                evict_page_cache(path)
+
     @abc.abstractmethod
     def _download(self):
         pass
 
     @abc.abstractmethod
-    def _start(self, model: Model) -> bool:
+    def _start(self, model: Model, config = None) -> bool:
         pass
 
     @abc.abstractmethod
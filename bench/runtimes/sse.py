@@ -0,0 +1,105 @@
+from typing import List
+
+CR = ord("\r")
+LF = ord("\n")
+
+class SSEEvent():
+
+    def __init__(self, data, event = "message", id = None):
+        self.data = data
+        self.event = event
+        self.id = id
+
+# incremental parser for a text/event-stream body. chunks are appended to a single
+# bytearray and lines are only decoded once they are complete, so events split across
+# chunk boundaries are handled and nothing is rescanned. feed returns every event
+# whose terminating blank line has arrived.
+class SSEParser():
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.data = []
+        self.event = None
+        self.id = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        buf = self.buffer
+        buf += chunk
+
+        events = []
+        start = 0
+        end_of_buffer = len(buf)
+        # most servers only use \n, so only look for \r again once we've passed the last one
+        next_cr = buf.find(b"\r")
+
+        with memoryview(buf) as view:
+            while start < end_of_buffer:
+                next_lf = buf.find(b"\n", start)
+                if next_cr != -1 and next_cr < start:
+                    next_cr = buf.find(b"\r", start)
+
+                if next_lf == -1 and next_cr == -1:
+                    break
+
+                end = next_lf if next_cr == -1 or (next_lf != -1 and next_lf < next_cr) else next_cr
+                next_start = end + 1
+
+                if buf[end] == CR:
+                    # a \r at the end of the chunk might be the first half of a \r\n
+                    if next_start == end_of_buffer:
+                        break
+                    if buf[next_start] == LF:
+                        next_start += 1
+
+                self._process_line(buf, view, start, end, events)
+                start = next_start
+
+        # only the incomplete last line is left, so this moves very little
+        del buf[:start]
+        return events
+
+    # flush whatever is left once the stream has ended
+    def close(self) -> List[SSEEvent]:
+        events = []
+        buf = self.buffer
+        end = len(buf)
+        if end and buf[end - 1] == CR:
+            end -= 1
+
+        with memoryview(buf) as view:
+            if end:
+                self._process_line(buf, view, 0, end, events)
+            self._process_line(buf, view, 0, 0, events)
+
+        buf.clear()
+        return events
+
+    def _process_line(self, buf, view, start, end, events):
+        # blank line, dispatch the event
+        if start == end:
+            if self.data:
+                events.append(SSEEvent("\n".join(self.data), self.event or "message", self.id))
+            self.data = []
+            self.event = None
+            return
+
+        # comment
+        if buf[start] == ord(":"):
+            return
+
+        colon = buf.find(b":", start, end)
+        if colon == -1:
+            field, value_start = view[start:end], end
+        else:
+            field, value_start = view[start:colon], colon + 1
+            if value_start < end and buf[value_start] == ord(" "):
+                value_start += 1
+
+        value = str(view[value_start:end], "utf-8")
+
+        if field == b"data":
+            self.data.append(value)
+        elif field == b"event":
+            self.event = value
+        elif field == b"id":
+            self.id = value
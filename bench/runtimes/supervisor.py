@@ -0,0 +1,145 @@
+import collections
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import Dict, List
+
+import requests
+
+from bench.logger import logger
+
+# runs a runtime server as a subprocess in its own process group. startup blocks on
+# events from the log reader (and optionally a health endpoint) instead of spinning,
+# gives up after a deadline, only keeps the last `log_lines` lines of output and
+# reaps the whole process group on stop.
+class ProcessSupervisor():
+
+    def __init__(self, name: str, cmd: List[str], ready_patterns: List[str] = [],
+                 failure_patterns: List[str] = [], health_url: str = None,
+                 startup_timeout: float = 600, log_lines: int = 1000,
+                 env: Dict[str, str] = None, cwd: str = None):
+        self.name = name
+        self.cmd = cmd
+        self.ready_patterns = ready_patterns
+        self.failure_patterns = failure_patterns
+        self.health_url = health_url
+        self.startup_timeout = startup_timeout
+        self.env = env
+        self.cwd = cwd
+
+        self.logs = collections.deque(maxlen=log_lines)
+        self.proc = None
+        self.reader = None
+        # set when a ready or failure pattern is seen or the process exits
+        self.state_changed = threading.Event()
+        self.ready = False
+        # the failure pattern that was matched, or a description of why startup failed
+        self.failure = None
+        self.spawn_time = None
+        self.ready_time = None
+
+    @property
+    def pid(self):
+        return self.proc.pid if self.proc else None
+
+    def start(self) -> bool:
+        self.logs.clear()
+        self.state_changed.clear()
+        self.ready = False
+        self.failure = None
+        self.ready_time = None
+
+        self.spawn_time = time.perf_counter()
+        self.proc = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     env=self.env, cwd=self.cwd, start_new_session=True)
+        logger.info(f"Started {self.name} with pid: {self.proc.pid}\ncommand: {' '.join(self.cmd)}")
+
+        self.reader = threading.Thread(target=self._read_output, args=(self.proc.stdout,), daemon=True)
+        self.reader.start()
+
+        return self._wait_until_ready()
+
+    def _read_output(self, pipe):
+        for line in iter(pipe.readline, b''):
+            decoded_line = line.decode(errors="replace")
+            logger.debug(decoded_line)
+            self.logs.append(decoded_line)
+
+            if self.failure is None:
+                for pattern in self.failure_patterns:
+                    if pattern in decoded_line:
+                        self.failure = pattern
+                        self.state_changed.set()
+
+            if not self.ready and any(pattern in decoded_line for pattern in self.ready_patterns):
+                self._mark_ready()
+
+        pipe.close()
+        self.state_changed.set()
+
+    def _mark_ready(self):
+        if not self.ready:
+            self.ready = True
+            self.ready_time = time.perf_counter()
+        self.state_changed.set()
+
+    def _healthy(self) -> bool:
+        try:
+            return requests.get(self.health_url, timeout=1).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def _wait_until_ready(self) -> bool:
+        deadline = self.spawn_time + self.startup_timeout
+        # wake up now and then even without a health endpoint in case the process died quietly
+        poll_interval = 0.25 if self.health_url else 1
+
+        while not self.ready and self.failure is None:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                self.failure = f"not ready after {self.startup_timeout}s"
+                break
+
+            self.state_changed.wait(timeout=min(remaining, poll_interval))
+            self.state_changed.clear()
+
+            if self.proc.poll() is not None and not self.ready:
+                self.failure = self.failure or f"exited with code {self.proc.returncode}"
+                break
+
+            if self.health_url and not self.ready and self._healthy():
+                self._mark_ready()
+
+        if self.failure is not None:
+            logger.error(f"{self.name} failed to start: {self.failure}\n{''.join(self.logs)}")
+            return False
+
+        logger.info(f"{self.name} ready after {self.ready_time - self.spawn_time:.2f}s")
+        return True
+
+    def running(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self, timeout: float = 10):
+        if self.proc is None:
+            return
+
+        try:
+            pgid = os.getpgid(self.proc.pid)
+            os.killpg(pgid, signal.SIGTERM)
+            try:
+                self.proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"{self.name} didn't exit after {timeout}s, killing it")
+                os.killpg(pgid, signal.SIGKILL)
+                self.proc.wait()
+        except ProcessLookupError:
+            self.proc.wait()  # Process already terminated
+
+        if self.reader:
+            self.reader.join(timeout=timeout)
+
+        self.proc = None
+        self.reader = None
@@ -1,60 +1,227 @@
 import abc
-import collections
+import atexit
+import math
 import threading
 import time
-from typing import List
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bench.logger import logger
+from bench.system.telemetry import FIELDS, TelemetryRing, TelemetrySampler, TelemetryThread
 
 class PowerMonitorSample():
 
-    def __init__(self, watts, time):
+    # time is time.perf_counter(), the same clock the request timestamps use
+    def __init__(self, watts, time, utilization = None, memory_used = None, sm_clock = None,
+                 mem_clock = None, temperature = None, throttle_reasons = None, throttled = None,
+                 index = None, device = 0):
         self.watts = watts
         self.time = time
+        # the rest is None when the device doesn't report it
+        # busy %
+        self.utilization = utilization
+        # bytes
+        self.memory_used = memory_used
+        # MHz
+        self.sm_clock = sm_clock
+        self.mem_clock = mem_clock
+        # degrees C
+        self.temperature = temperature
+        # raw bitmask from the driver, and whether any of the bits mean the clocks are being held back
+        self.throttle_reasons = throttle_reasons
+        self.throttled = throttled
+        # position in the telemetry ring, the same sample read by two windows has the same index
+        self.index = index
+        # which of the system's accelerators it came from, see System.accelerators
+        self.device = device
+
+    @classmethod
+    def from_record(cls, index, record, device = 0):
+        values = {field: (None if math.isnan(value) else value) for field, value in zip(FIELDS, record.tolist())}
+        if values["throttle_reasons"] is not None:
+            values["throttle_reasons"] = int(values["throttle_reasons"])
+        if values["throttled"] is not None:
+            values["throttled"] = bool(values["throttled"])
+        return cls(**values, index=index, device=device)
+
+# the index of a sample that didn't come from a ring
+NO_INDEX = -1
+
+# the samples of one or more measurement windows, kept as the ring records they were read
+# as: a row of FIELDS per sample with its ring index and device alongside. nothing is
+# allocated per sample, PowerMonitorSample objects are only made for code that iterates
+class PowerSamples():
+
+    def __init__(self, records = None, index = None, device = None):
+        self.records = records if records is not None else np.empty((0, len(FIELDS)))
+        self.index = index if index is not None else np.empty(0, dtype=np.int64)
+        self.device = device if device is not None else np.empty(0, dtype=np.int64)
+
+    @classmethod
+    def from_ring(cls, first, records, device = 0):
+        count = len(records)
+        return cls(records, np.arange(first, first + count, dtype=np.int64), np.full(count, device, dtype=np.int64))
+
+    # PowerMonitorSample objects as PowerSamples, PowerSamples are returned as they are
+    @classmethod
+    def of(cls, samples):
+        if isinstance(samples, PowerSamples):
+            return samples
+        samples = list(samples or [])
+        records = np.array([[math.nan if getattr(s, field) is None else float(getattr(s, field)) for field in FIELDS]
+                            for s in samples], dtype=np.float64).reshape(len(samples), len(FIELDS))
+        index = np.array([NO_INDEX if s.index is None else s.index for s in samples], dtype=np.int64)
+        device = np.array([s.device for s in samples], dtype=np.int64)
+        return cls(records, index, device)
+
+    @classmethod
+    def concat(cls, parts):
+        parts = [part for part in map(cls.of, parts) if len(part)]
+        if len(parts) == 1:
+            return parts[0]
+        if len(parts) == 0:
+            return cls()
+        return cls(np.concatenate([part.records for part in parts]), np.concatenate([part.index for part in parts]),
+                   np.concatenate([part.device for part in parts]))
+
+    def __len__(self):
+        return len(self.index)
 
-# TODO this power monitoring solution is not very elegant but it works.
-# it probably needs to be broken out to the system level as well.
+    # an int gives a PowerMonitorSample, a slice or mask gives PowerSamples
+    def __getitem__(self, item):
+        if not isinstance(item, (int, np.integer)):
+            return PowerSamples(self.records[item], self.index[item], self.device[item])
+        index = int(self.index[item])
+        return PowerMonitorSample.from_record(None if index == NO_INDEX else index, self.records[item], int(self.device[item]))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def field(self, name) -> np.ndarray:
+        return self.records[:, FIELDS.index(name)]
+
+    @property
+    def time(self) -> np.ndarray:
+        return self.field("time")
+
+    @property
+    def watts(self) -> np.ndarray:
+        return self.field("watts")
+
+    def devices(self) -> List[int]:
+        return np.unique(self.device).tolist()
+
+    def for_device(self, device) -> "PowerSamples":
+        return self[self.device == device]
+
+    # every ring record once, however many windows read it. a ring index is only unique
+    # together with the device (every device has its own ring), samples without one are kept
+    def unique(self) -> "PowerSamples":
+        ringed = self.index != NO_INDEX
+        _, first = np.unique((self.device[ringed] << 40) | self.index[ringed], return_index=True)
+        keep = ~ringed
+        keep[np.flatnonzero(ringed)[first]] = True
+        return self if keep.all() else self[keep]
+
+    # the same samples with the watts of each device lowered by device_watts, e.g. its idle draw
+    def shifted(self, device_watts: Dict[int, float]) -> "PowerSamples":
+        records = self.records.copy()
+        for device, watts in device_watts.items():
+            records[self.device == device, FIELDS.index("watts")] -= watts
+        return PowerSamples(records, self.index, self.device)
+
+# the runs of consecutive indices of one device in sample arrays, as (device, start, end, position)
+# with [start, end) the indices and position where the run starts in the arrays
+def index_runs(device: np.ndarray, index: np.ndarray):
+    if len(index) == 0:
+        return []
+    breaks = np.flatnonzero((np.diff(index) != 1) | (np.diff(device) != 0)) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(index)]])
+    return [(int(device[a]), int(index[a]), int(index[b - 1]) + 1, int(a)) for a, b in zip(starts, ends)]
+
+# samples are written to a ring buffer in shared memory by a sampler running in its own
+# process (or a thread for devices that can't be sampled from another process). a power
+# monitor is only the ring position it started at, so any number of them can be open
+# without the sampler doing any extra work.
 class Accelerator(abc.ABC):
+    # seconds between samples
+    sample_interval = 0.01
+    # environment variable that limits a runtime to some of the devices by their index,
+    # None if the devices can't be picked that way
+    visible_devices_variable = None
 
-    def __init__(self):
-        self.thread = None
+    # sample is False when the accelerator is created inside the sampler process
+    def __init__(self, sample = True):
+        self.sampler = None
+        # position in System.accelerators, stored with every sample
+        self.device = 0
+        # ring position and energy counter reading when each monitor started
         self.power_monitors = {}
-        self.latest_samples = collections.deque(maxlen=10)
+        self.energy_monitors = {}
+        # monitors can be started and stopped from different threads
+        self.monitor_lock = threading.Lock()
 
-        # start sampling
-        self.thread = threading.Thread(target=self._sample_power_usage)
-        self.thread.daemon = True  # set as daemon thread so it exits with the main thread
-        self.thread.start()
+        if not sample:
+            return
 
-    def start_power_monitor(self, name):
-        if name in self.power_monitors:
-            raise Exception(f"Power monitor {name} already started")
+        self.ring = TelemetryRing()
 
-        self.power_monitors[name] = []
+        args = self._sampler_args()
+        if args is not None:
+            self.sampler = TelemetrySampler(self.ring, type(self), args, self.sample_interval)
+        else:
+            self.sampler = TelemetryThread(self.ring, self, self.sample_interval)
+        atexit.register(self.close)
 
-    def end_power_monitor(self, name) -> List[PowerMonitorSample]:
-        if name in self.power_monitors:
-            samples = self.power_monitors[name]
-            del self.power_monitors[name]
+    # the sampler is stopped first, a sampling thread would write into the closed ring
+    def close(self):
+        self.sampler.stop()
+        self.ring.close()
 
-            return samples
-        else:
-            raise Exception(f"Power monitor {name} not started")
+    # arguments to create this accelerator again in the sampler process, None to sample on a thread
+    def _sampler_args(self):
+        return None
 
-    def _add_power_sample(self, sample: PowerMonitorSample):
-        self.latest_samples.append(sample)
+    # set up whatever library the accelerator needs in a fresh sampler process
+    @classmethod
+    def init_sampler_process(cls):
+        pass
+
+    def start_power_monitor(self, name):
+        with self.monitor_lock:
+            if name in self.power_monitors:
+                raise Exception(f"Power monitor {name} already started")
 
-        # add the sample to every running power monitor
-        for monitor in self.power_monitors:
-            self.power_monitors[monitor].append(sample)
+            # start from the last sample taken so the window can be integrated from its start
+            self.power_monitors[name] = max(self.ring.count - 1, 0)
+            self.energy_monitors[name] = self._get_energy_counter()
 
-    def _sample_power_usage(self):
-        while True:
-            sample_start = time.time()
-            watts = self._get_power_usage()
+    # the samples taken while the monitor was running and the joules the device's
+    # energy counter measured over it, None without a counter
+    def end_power_monitor(self, name) -> Tuple[PowerSamples, Optional[float]]:
+        with self.monitor_lock:
+            if name in self.power_monitors:
+                energy_end = self._get_energy_counter()
+                energy_start = self.energy_monitors.pop(name)
+                start = self.power_monitors.pop(name)
+            else:
+                raise Exception(f"Power monitor {name} not started")
 
-            # watts could be None if the sample couldn't be taken (or needs a first sample to start)
-            if (watts):
-                self._add_power_sample(PowerMonitorSample(watts, sample_start))
-            time.sleep(0.01)
+        if not self.sampler.running():
+            logger.warning(f"The power sampler for {self.get_basic_info_string()} isn't running")
+
+        samples = PowerSamples.from_ring(*self.ring.read(start), self.device)
+
+        energy = energy_end - energy_start if energy_start is not None and energy_end is not None else None
+        return samples, energy
+
+    # the samples taken over the last `seconds`, without opening a monitor
+    def recent_samples(self, seconds) -> PowerSamples:
+        # the sampler never runs faster than sample_interval, so this many records is enough
+        samples = PowerSamples.from_ring(*self.ring.read(max(self.ring.count - int(seconds / self.sample_interval) - 1, 0)), self.device)
+        return samples[samples.time >= time.perf_counter() - seconds]
 
     @abc.abstractmethod
     def get_basic_info_string(self):
@@ -68,6 +235,79 @@ class Accelerator(abc.ABC):
     def _get_power_usage(self):
         pass
 
+    # cumulative joules from a hardware energy counter, None if the device doesn't
+    # have one and energy has to be integrated from the power samples instead
+    def _get_energy_counter(self):
+        return None
+
+    # utilization, memory, clocks, temperature and throttling to store with each
+    # power sample, as keyword arguments for PowerMonitorSample
+    def _get_telemetry(self):
+        return {}
+
     def __del__(self):
-        if hasattr(self, 'thread') and self.thread:
-            self.thread.join()
\ No newline at end of file
+        if getattr(self, 'sampler', None):
+            self.sampler.stop()
+
+# joules used between start and end (perf_counter seconds). power is linearly
+# interpolated between samples (trapezoidal rule), so unevenly spaced samples
+# are weighted by the time they cover, and held flat past the first and last sample.
+# samples from several devices are integrated per device and added up
+def integrate_power(samples, start, end):
+    samples = PowerSamples.of(samples).unique()
+    devices = samples.devices()
+    if len(devices) > 1:
+        return sum(integrate_power(samples.for_device(device), start, end) for device in devices)
+
+    if len(samples) == 0 or end <= start:
+        return 0
+
+    order = np.argsort(samples.time, kind="stable")
+    times, watts = samples.time[order], samples.watts[order]
+    energy = watts[0] * max(min(times[0], end) - start, 0)
+    energy += watts[-1] * max(end - max(times[-1], start), 0)
+
+    # every pair of neighbouring samples, clipped to the window
+    a, b = times[:-1], times[1:]
+    t0, t1 = np.maximum(a, start), np.minimum(b, end)
+    inside = t1 > t0
+    a, b, t0, t1 = a[inside], b[inside], t0[inside], t1[inside]
+    wa, wb = watts[:-1][inside], watts[1:][inside]
+    # a pair inside the window is never at the same time, t1 > t0 needs b > a
+    slope = (wb - wa) / (b - a)
+    energy += np.sum((wa + slope * (t0 - a) + wa + slope * (t1 - a)) / 2 * (t1 - t0))
+
+    return float(energy)
+
+# time weighted average power between start and end
+def average_power(samples, start, end):
+    samples = PowerSamples.of(samples)
+    if end <= start:
+        return sum(float(np.mean(samples.for_device(device).watts)) for device in samples.devices())
+    return integrate_power(samples, start, end) / (end - start)
+
+def mean_of(values):
+    values = values[~np.isnan(values)]
+    return float(np.mean(values)) if len(values) else None
+
+def max_of(values):
+    values = values[~np.isnan(values)]
+    return float(np.max(values)) if len(values) else None
+
+# summary of the telemetry in a window of samples. values the device doesn't report are None
+def summarize_accelerator_samples(samples):
+    # the same sample can be shared by overlapping runs
+    samples = PowerSamples.of(samples).unique()
+    throttled = mean_of(samples.field("throttled"))
+    # a model split across devices uses the memory of all of them
+    peaks = [max_of(samples.for_device(device).field("memory_used")) for device in samples.devices()]
+    peak_memory = sum(peak for peak in peaks if peak is not None) if any(peak is not None for peak in peaks) else None
+
+    return {
+        "peak VRAM MB": peak_memory / 1e6 if peak_memory is not None else None,
+        "gpu util %": mean_of(samples.field("utilization")),
+        "throttled %": throttled * 100 if throttled is not None else None,
+        "sm clock MHz": mean_of(samples.field("sm_clock")),
+        "mem clock MHz": mean_of(samples.field("mem_clock")),
+        "peak temp C": max_of(samples.field("temperature")),
+    }
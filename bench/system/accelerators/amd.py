@@ -4,14 +4,40 @@ from bench.system.accelerators.accelerator import Accelerator
 from bench.system.rocml import *
 
 class AMDAccelerator(Accelerator):
+    visible_devices_variable = "HIP_VISIBLE_DEVICES"
 
-    def __init__(self, index):
+    def __init__(self, index, sample = True):
         self.index = index
         self.name = smi_get_device_name(index)
         self.revision = smi_get_device_revision(index)
         self.memory = smi_get_device_memory_total(index) * 1e-9
         self.power_limit = smi_get_device_power_cap(index)
-        super().__init__()
+
+        # rocm-smi returns -1 for anything the card or library version doesn't support,
+        # only keep the queries that work so unsupported ones aren't logged on every sample
+        self.telemetry = {}
+        for field, query in {
+            "utilization": lambda: smi_get_device_utilization(index),
+            "memory_used": lambda: smi_get_device_memory_used(index),
+            "sm_clock": lambda: smi_get_device_clock(index, 'SYS'),
+            "mem_clock": lambda: smi_get_device_clock(index, 'MEM'),
+            "temperature": lambda: smi_get_device_temperature(index),
+            "throttle_reasons": lambda: smi_get_device_throttle_status(index),
+        }.items():
+            try:
+                if query() != -1:
+                    self.telemetry[field] = query
+            except AttributeError:
+                pass  # function missing from an older librocm_smi64
+
+        super().__init__(sample)
+
+    def _sampler_args(self):
+        return [self.index]
+
+    @classmethod
+    def init_sampler_process(cls):
+        smi_initialize()
 
     def get_panel(self):
         return Panel.fit(
@@ -27,6 +53,14 @@ class AMDAccelerator(Accelerator):
     def _get_power_usage(self):
         watts = smi_get_device_average_power(self.index)
         return watts
+
+    def _get_telemetry(self):
+        telemetry = {field: query() for field, query in self.telemetry.items()}
+        telemetry = {field: value for field, value in telemetry.items() if value != -1}
+
+        if "throttle_reasons" in telemetry:
+            telemetry["throttled"] = telemetry["throttle_reasons"] != 0
+        return telemetry
     
     def get_basic_info_string(self):
         return f"{self.name.replace(' ', '-')}:{self.memory:.2f}GB:{self.power_limit}W"
\ No newline at end of file
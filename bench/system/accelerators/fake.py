@@ -0,0 +1,68 @@
+from rich.panel import Panel
+
+from bench.system.accelerators.accelerator import Accelerator
+
+# a made up device for running the harness on a machine without a supported gpu,
+# enabled with BENCH_FAKE_ACCELERATOR=<number of devices>. it is busy whenever a
+# run's power monitor is open, heats up while busy and throttles once it gets too hot.
+class FakeAccelerator(Accelerator):
+
+    def __init__(self, index, idle_watts = 30, load_watts = 250, memory_total = 24e9,
+                 idle_temp = 35, load_temp = 90, throttle_temp = 83, sample = True):
+        self.index = index
+        self.name = f"Fake Accelerator {index}"
+        self.idle_watts = idle_watts
+        self.load_watts = load_watts
+        self.memory_total = memory_total
+        self.idle_temp = idle_temp
+        self.load_temp = load_temp
+        self.throttle_temp = throttle_temp
+        self.power_limit = load_watts
+        self.temperature = idle_temp
+
+        # sampled on a thread since it needs to see which monitors are open
+        super().__init__(sample)
+
+    def get_panel(self):
+        return Panel.fit(
+            f'\n[b]Device: {self.name}[/b]\n'
+            f'[b]Memory:[/b] {self.memory_total / 1e9:.2f}GB\n'
+            f'[b]Power Limit:[/b] {self.power_limit}W',
+            title="Fake Device Info",
+            border_style="white",
+            height=9
+        )
+
+    def _busy(self):
+        # idle power is measured with a monitor open too, see System.measure_idle_power
+        return any(not name.endswith("-idle") for name in list(self.power_monitors))
+
+    def _throttled(self):
+        return self.temperature >= self.throttle_temp
+
+    def _get_power_usage(self):
+        # move a little towards the idle or load temperature on every sample
+        target = self.load_temp if self._busy() else self.idle_temp
+        self.temperature += (target - self.temperature) * 0.001
+
+        if not self._busy():
+            return self.idle_watts
+
+        # throttling holds the clocks back, which costs power as well as speed
+        return self.load_watts * (0.8 if self._throttled() else 1)
+
+    def _get_telemetry(self):
+        busy = self._busy()
+        throttled = busy and self._throttled()
+        return {
+            "utilization": 100 if busy else 0,
+            "memory_used": self.memory_total * (0.5 if busy else 0.02),
+            "sm_clock": (1600 if throttled else 2000) if busy else 210,
+            "mem_clock": 10000 if busy else 405,
+            "temperature": self.temperature,
+            "throttle_reasons": 0x20 if throttled else 0,
+            "throttled": throttled,
+        }
+
+    def get_basic_info_string(self):
+        return f"{self.name.replace(' ', '-')}:{round(self.memory_total / 1e9)}GB:{self.power_limit}W"
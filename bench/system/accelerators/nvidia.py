@@ -3,6 +3,9 @@ from rich.panel import Panel
 
 from bench.system.accelerators.accelerator import Accelerator
 
+# reasons that don't mean the card is being held back by power or heat
+NOT_THROTTLED = nvmlClocksThrottleReasonGpuIdle | nvmlClocksThrottleReasonApplicationsClocksSetting | nvmlClocksThrottleReasonDisplayClockSetting
+
 def get_nvidia_arch(arch_num):
     if arch_num == 2:
         return "Kepler"
@@ -22,8 +25,10 @@ def get_nvidia_arch(arch_num):
         return "Hopper"
     
 class NvidiaAccelerator(Accelerator):
+    visible_devices_variable = "CUDA_VISIBLE_DEVICES"
 
-    def __init__(self, index):
+    def __init__(self, index, sample = True):
+        self.index = index
         self.handle = nvmlDeviceGetHandleByIndex(index)
         self.name = nvmlDeviceGetName(self.handle)
         self.memory = nvmlDeviceGetMemoryInfo(self.handle)
@@ -37,8 +42,39 @@ class NvidiaAccelerator(Accelerator):
         self.architecture = get_nvidia_arch(self.arch)
         
         self.prev_sample = None
-        
-        super().__init__()
+
+        # not every card supports every query, only keep the ones that work
+        self.telemetry = {}
+        for field, query in {
+            "utilization": lambda: nvmlDeviceGetUtilizationRates(self.handle).gpu,
+            "memory_used": lambda: nvmlDeviceGetMemoryInfo(self.handle).used,
+            "sm_clock": lambda: nvmlDeviceGetClockInfo(self.handle, NVML_CLOCK_SM),
+            "mem_clock": lambda: nvmlDeviceGetClockInfo(self.handle, NVML_CLOCK_MEM),
+            "temperature": lambda: nvmlDeviceGetTemperature(self.handle, NVML_TEMPERATURE_GPU),
+            "throttle_reasons": lambda: nvmlDeviceGetCurrentClocksThrottleReasons(self.handle),
+        }.items():
+            try:
+                query()
+                self.telemetry[field] = query
+            except NVMLError:
+                pass
+
+        # the total energy counter is exact where polled power is often a 1 second rolling
+        # average, which is useless for requests shorter than that. volta and newer
+        try:
+            nvmlDeviceGetTotalEnergyConsumption(self.handle)
+            self.has_energy_counter = True
+        except NVMLError:
+            self.has_energy_counter = False
+
+        super().__init__(sample)
+
+    def _sampler_args(self):
+        return [self.index]
+
+    @classmethod
+    def init_sampler_process(cls):
+        nvmlInit()
 
     def get_panel(self):
         return Panel.fit(
@@ -57,6 +93,28 @@ class NvidiaAccelerator(Accelerator):
 
     def _get_power_usage(self):
         return nvmlDeviceGetPowerUsage(self.handle) / 1000
+
+    def _get_energy_counter(self):
+        if not self.has_energy_counter:
+            return None
+
+        try:
+            # millijoules since the driver was loaded
+            return nvmlDeviceGetTotalEnergyConsumption(self.handle) / 1000
+        except NVMLError:
+            return None
+
+    def _get_telemetry(self):
+        telemetry = {}
+        for field, query in self.telemetry.items():
+            try:
+                telemetry[field] = query()
+            except NVMLError:
+                pass
+
+        if "throttle_reasons" in telemetry:
+            telemetry["throttled"] = bool(telemetry["throttle_reasons"] & ~NOT_THROTTLED)
+        return telemetry
     
     def get_basic_info_string(self):
         return f"{self.name.replace(' ', '-')}:{round(self.memTotal / 1024)}GB:{self.currPwrLimit}W"
\ No newline at end of file
@@ -0,0 +1,209 @@
+import glob
+import os
+import time
+
+from rich.panel import Panel
+
+from bench.logger import logger
+from bench.system.accelerators.accelerator import Accelerator
+
+# lets the sysfs backends run against a fake tree
+def sysfs_path(*parts):
+    return os.path.join(os.environ.get("BENCH_SYSFS_ROOT", "/sys"), *parts)
+
+def read_number(path):
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def read_text(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+class RaplZone():
+
+    def __init__(self, path):
+        self.path = path
+        self.name = read_text(os.path.join(path, "name"))
+        # energy_uj wraps around to 0 after max_energy_range_uj
+        self.max_energy = read_number(os.path.join(path, "max_energy_range_uj"))
+        self.last_raw = None
+        self.total = 0
+
+    def readable(self):
+        return read_number(os.path.join(self.path, "energy_uj")) is not None
+
+    # microjoules since the first read, unwrapped. only one wraparound can be detected
+    # between reads, which takes tens of minutes even at full load
+    def read(self):
+        raw = read_number(os.path.join(self.path, "energy_uj"))
+        if raw is None:
+            return None
+
+        if self.last_raw is not None:
+            delta = raw - self.last_raw
+            if delta < 0 and self.max_energy:
+                delta += self.max_energy
+            self.total += delta
+        self.last_raw = raw
+        return self.total
+
+def find_rapl_zones():
+    zones = []
+    for path in sorted(glob.glob(sysfs_path("class", "powercap", "intel-rapl:*"))):
+        zone = RaplZone(path)
+        # the package zones already include core and uncore, psys would count everything twice
+        if zone.name and (zone.name.startswith("package") or zone.name == "dram"):
+            zones.append(zone)
+    return zones
+
+# CPU package and DRAM energy from the RAPL counters, for running models on the CPU.
+# power is the change in the counters between samples
+class RaplAccelerator(Accelerator):
+
+    def __init__(self, cpu_name = "CPU", sample = True):
+        self.cpu_name = cpu_name
+        self.name = f"{cpu_name} (RAPL)"
+        self.zones = find_rapl_zones()
+        # the window counter reads and the sampler's power reads each keep their own
+        # unwrapped totals so neither interferes with the other
+        self.sample_zones = find_rapl_zones()
+        self.prev_sample = None
+
+        super().__init__(sample)
+
+    @classmethod
+    def available(cls):
+        zones = find_rapl_zones()
+        if zones and not all(zone.readable() for zone in zones):
+            logger.info("RAPL energy counters aren't readable, run as root to measure CPU power")
+            return False
+        return len(zones) > 0
+
+    def _sampler_args(self):
+        return [self.cpu_name]
+
+    def get_panel(self):
+        return Panel.fit(
+            f'\n[b]Device: {self.cpu_name}[/b]\n'
+            f'[b]RAPL zones:[/b] {", ".join(zone.name for zone in self.zones)}',
+            title="CPU Power (RAPL)",
+            border_style="blue",
+            height=9
+        )
+
+    def _read_zones(self, zones):
+        readings = [zone.read() for zone in zones]
+        if any(reading is None for reading in readings):
+            return None
+        return sum(readings) / 1e6
+
+    def _get_power_usage(self):
+        now = time.perf_counter()
+        energy = self._read_zones(self.sample_zones)
+        prev, self.prev_sample = self.prev_sample, (now, energy)
+
+        if energy is None or prev is None or prev[1] is None or now <= prev[0]:
+            return None
+        return (energy - prev[1]) / (now - prev[0])
+
+    def _get_energy_counter(self):
+        return self._read_zones(self.zones)
+
+    def get_basic_info_string(self):
+        return f"{self.cpu_name.replace(' ', '-')}:RAPL"
+
+# GPUs whose driver reports power through hwmon (e.g. amdgpu without rocm-smi installed)
+def find_gpu_hwmons():
+    hwmons = []
+    for path in sorted(glob.glob(sysfs_path("class", "hwmon", "hwmon*"))):
+        # only display controllers (PCI class 0x03xxxx)
+        pci_class = read_text(os.path.join(path, "device", "class"))
+        if not pci_class or not pci_class.startswith("0x03"):
+            continue
+
+        if glob.glob(os.path.join(path, "power*_average")) or glob.glob(os.path.join(path, "power*_input")) \
+                or glob.glob(os.path.join(path, "energy*_input")):
+            hwmons.append(path)
+    return hwmons
+
+class HwmonAccelerator(Accelerator):
+
+    def __init__(self, path, sample = True):
+        self.path = path
+        self.driver = read_text(os.path.join(path, "name")) or "hwmon"
+        self.pci_address = os.path.basename(os.path.realpath(os.path.join(path, "device")))
+        self.name = f"{self.driver} {self.pci_address}"
+
+        # microwatts, power1_average is what amdgpu reports
+        self.power_file = next(iter(sorted(glob.glob(os.path.join(path, "power*_average")))
+                                    + sorted(glob.glob(os.path.join(path, "power*_input")))), None)
+        # microjoules
+        self.energy_file = next(iter(sorted(glob.glob(os.path.join(path, "energy*_input")))), None)
+
+        cap = read_number(os.path.join(path, "power1_cap"))
+        self.power_limit = cap / 1e6 if cap else None
+        vram = read_number(os.path.join(path, "device", "mem_info_vram_total"))
+        self.memory = vram / 1e9 if vram else None
+        self.prev_sample = None
+
+        super().__init__(sample)
+
+    def _sampler_args(self):
+        return [self.path]
+
+    def get_panel(self):
+        return Panel.fit(
+            f'\n[b]Device: {self.name}[/b]\n'
+            f'[b]Memory:[/b] {f"{self.memory:.2f}GB" if self.memory else "unknown"}\n'
+            f'[b]Power Limit:[/b] {f"{self.power_limit}W" if self.power_limit else "unknown"}',
+            title="GPU Device Info (hwmon)",
+            border_style="red",
+            height=9
+        )
+
+    def _get_power_usage(self):
+        if self.power_file:
+            microwatts = read_number(self.power_file)
+            return microwatts / 1e6 if microwatts is not None else None
+
+        # only an energy counter, use the change since the last sample
+        now = time.perf_counter()
+        energy = self._get_energy_counter()
+        prev, self.prev_sample = self.prev_sample, (now, energy)
+        if energy is None or prev is None or prev[1] is None or now <= prev[0]:
+            return None
+        return (energy - prev[1]) / (now - prev[0])
+
+    def _get_energy_counter(self):
+        if not self.energy_file:
+            return None
+
+        microjoules = read_number(self.energy_file)
+        return microjoules / 1e6 if microjoules is not None else None
+
+    def _get_telemetry(self):
+        device = os.path.join(self.path, "device")
+        telemetry = {
+            "utilization": read_number(os.path.join(device, "gpu_busy_percent")),
+            "memory_used": read_number(os.path.join(device, "mem_info_vram_used")),
+        }
+
+        # Hz and millidegrees
+        sm_clock = read_number(os.path.join(self.path, "freq1_input"))
+        mem_clock = read_number(os.path.join(self.path, "freq2_input"))
+        temperature = read_number(os.path.join(self.path, "temp1_input"))
+        telemetry["sm_clock"] = sm_clock / 1e6 if sm_clock is not None else None
+        telemetry["mem_clock"] = mem_clock / 1e6 if mem_clock is not None else None
+        telemetry["temperature"] = temperature / 1000 if temperature is not None else None
+
+        return {field: value for field, value in telemetry.items() if value is not None}
+
+    def get_basic_info_string(self):
+        memory = f"{round(self.memory)}GB" if self.memory else "?GB"
+        return f"{self.driver}:{memory}:{self.power_limit}W"
@@ -0,0 +1,166 @@
+import collections
+import itertools
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import psutil
+
+from bench.logger import logger
+
+class HostSample():
+
+    def __init__(self, time, cpu_percent, rss, minor_faults, major_faults, ctx_switches, read_bytes, write_bytes,
+                 index = None):
+        self.time = time
+        # summed over every process in the tree, so can be above 100%
+        self.cpu_percent = cpu_percent
+        self.rss = rss
+        # the rest are cumulative counters for the processes alive when the sample was taken
+        self.minor_faults = minor_faults
+        self.major_faults = major_faults
+        self.ctx_switches = ctx_switches
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+        # counts up over every monitor, the same sample seen by two runs has the same index
+        self.index = index
+
+SAMPLE_INDEX = itertools.count()
+
+COUNTERS = ["minor_faults", "major_faults", "ctx_switches", "read_bytes", "write_bytes"]
+
+# psutil doesn't expose page faults on linux, read them from /proc/<pid>/stat
+def read_page_faults(pid):
+    if not sys.platform.startswith("linux"):
+        return 0, 0
+
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return 0, 0
+
+    # the command name can contain spaces, the fields start after its closing paren
+    fields = stat[stat.rindex(")") + 2:].split()
+    return int(fields[7]), int(fields[9])
+
+# samples the cpu, memory, page faults, context switches and io of a runtime server
+# and all of its children. works the same way as the accelerator power sampler:
+# named monitors collect every sample taken while they are running.
+class ProcessTreeMonitor():
+
+    def __init__(self, interval = 0.1):
+        self.interval = interval
+        self.root = None
+        # cpu_percent is measured since the last call, so keep the same Process objects around
+        self.processes: Dict[int, psutil.Process] = {}
+        self.monitors = {}
+        self.monitor_lock = threading.Lock()
+        self.latest_samples = collections.deque(maxlen=10)
+
+        self.thread = threading.Thread(target=self._sample_process_tree)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # start sampling the process tree under pid, None stops sampling
+    def watch(self, pid):
+        with self.monitor_lock:
+            try:
+                self.root = psutil.Process(pid) if pid else None
+            except psutil.NoSuchProcess:
+                logger.warning(f"Can't monitor process {pid}, it has already exited")
+                self.root = None
+            self.processes = {}
+            self.latest_samples.clear()
+
+    def start_monitor(self, name):
+        with self.monitor_lock:
+            if name in self.monitors:
+                raise Exception(f"Host monitor {name} already started")
+
+            # short runs might not see a sample of their own, start from the last one taken
+            self.monitors[name] = list(self.latest_samples)[-1:]
+
+    def end_monitor(self, name) -> List[HostSample]:
+        with self.monitor_lock:
+            if name not in self.monitors:
+                raise Exception(f"Host monitor {name} not started")
+
+            samples = self.monitors.pop(name)
+            if self.latest_samples and (not samples or samples[-1] is not self.latest_samples[-1]):
+                samples.append(self.latest_samples[-1])
+            return samples
+
+    def _add_sample(self, sample: HostSample):
+        with self.monitor_lock:
+            self.latest_samples.append(sample)
+            for monitor in self.monitors.values():
+                monitor.append(sample)
+
+    def _sample_process_tree(self):
+        while True:
+            sample_start = time.perf_counter()
+            sample = self._take_sample()
+
+            if sample:
+                self._add_sample(sample)
+            time.sleep(max(self.interval - (time.perf_counter() - sample_start), 0))
+
+    def _take_sample(self):
+        root = self.root
+        if root is None:
+            return None
+
+        try:
+            tree = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return None
+
+        now = time.perf_counter()
+        totals = dict(cpu_percent=0, rss=0, minor_faults=0, major_faults=0, ctx_switches=0, read_bytes=0, write_bytes=0)
+        alive = {}
+
+        for proc in tree:
+            proc = self.processes.get(proc.pid, proc)
+            try:
+                with proc.oneshot():
+                    totals["cpu_percent"] += proc.cpu_percent(None)
+                    totals["rss"] += proc.memory_info().rss
+                    switches = proc.num_ctx_switches()
+                    totals["ctx_switches"] += switches.voluntary + switches.involuntary
+                    # not available on macOS and needs permissions on some systems
+                    try:
+                        io = proc.io_counters()
+                        totals["read_bytes"] += io.read_bytes
+                        totals["write_bytes"] += io.write_bytes
+                    except (AttributeError, psutil.AccessDenied):
+                        pass
+                minor, major = read_page_faults(proc.pid)
+                totals["minor_faults"] += minor
+                totals["major_faults"] += major
+                alive[proc.pid] = proc
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                continue
+
+        self.processes = alive
+        return HostSample(now, **totals, index=next(SAMPLE_INDEX))
+
+# sum of the increases of a cumulative counter. processes can exit between samples,
+# which makes the tree total drop, so only count the increases
+def counter_increase(samples: List[HostSample], counter: str):
+    values = [getattr(s, counter) for s in samples]
+    return sum(max(b - a, 0) for a, b in zip(values, values[1:]))
+
+def summarize_host_samples(samples: List[HostSample]):
+    # the same sample can be shared by overlapping runs
+    samples = sorted({id(s): s for s in samples}.values(), key=lambda s: s.time)
+    if len(samples) == 0:
+        return {}
+
+    return {
+        "cpu %": sum(s.cpu_percent for s in samples) / len(samples),
+        "peak cpu %": max(s.cpu_percent for s in samples),
+        "peak rss MB": max(s.rss for s in samples) / 1e6,
+        **{counter: counter_increase(samples, counter) for counter in COUNTERS},
+    }
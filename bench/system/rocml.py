@@ -155,6 +155,33 @@ class rsmi_frequencies_t(Structure):
                 ('frequency', c_uint64 * RSMI_MAX_NUM_FREQUENCIES)]
 
 
+class rsmi_clk_type_t(c_int):
+    RSMI_CLK_TYPE_SYS = 0x0
+    RSMI_CLK_TYPE_FIRST = RSMI_CLK_TYPE_SYS
+    RSMI_CLK_TYPE_DF = 0x1
+    RSMI_CLK_TYPE_DCEF = 0x2
+    RSMI_CLK_TYPE_SOC = 0x3
+    RSMI_CLK_TYPE_MEM = 0x4
+    RSMI_CLK_TYPE_LAST = RSMI_CLK_TYPE_MEM
+
+
+class rsmi_temperature_type_t(c_int):
+    RSMI_TEMP_TYPE_EDGE = 0
+    RSMI_TEMP_TYPE_FIRST = RSMI_TEMP_TYPE_EDGE
+    RSMI_TEMP_TYPE_JUNCTION = 1
+    RSMI_TEMP_TYPE_MEMORY = 2
+
+
+class rsmi_temperature_metric_t(c_int):
+    RSMI_TEMP_CURRENT = 0x0
+    RSMI_TEMP_FIRST = RSMI_TEMP_CURRENT
+    RSMI_TEMP_MAX = 0x1
+    RSMI_TEMP_MIN = 0x2
+
+# clock names for smi_get_device_clock
+clock_type_l = ['SYS', 'DF', 'DCEF', 'SOC', 'MEM']
+
+
 class rsmi_pcie_bandwidth_t(Structure):
     _fields_ = [('transfer_rate', rsmi_frequencies_t),
                 ('lanes', c_uint32 * RSMI_MAX_NUM_FREQUENCIES)]
@@ -409,6 +436,28 @@ def smi_get_device_memory_reserved_pages(dev):
     return (num_pages.value, records) if rsmi_ret_ok(ret) else -1
 
 
+def smi_get_device_clock(dev, type='SYS'):
+    """returns the current clock of device_id dev in MHz"""
+    type_idx = clock_type_l.index(type)
+    freqs = rsmi_frequencies_t()
+    ret = rocm_lib.rsmi_dev_gpu_clk_freq_get(dev, type_idx, byref(freqs))
+    return freqs.frequency[freqs.current] * 1e-6 if rsmi_ret_ok(ret) else -1
+
+
+def smi_get_device_temperature(dev, sensor=rsmi_temperature_type_t.RSMI_TEMP_TYPE_EDGE):
+    """returns the current temperature of device_id dev in degrees C"""
+    temp = c_int64()
+    ret = rocm_lib.rsmi_dev_temp_metric_get(dev, sensor, rsmi_temperature_metric_t.RSMI_TEMP_CURRENT, byref(temp))
+    return temp.value * 1e-3 if rsmi_ret_ok(ret) else -1
+
+
+def smi_get_device_throttle_status(dev):
+    """returns the throttle status bitmask of device_id dev from its gpu metrics, 0 if not throttled"""
+    status = c_uint32()
+    ret = rocm_lib.rsmi_dev_metrics_throttle_status_get(dev, byref(status))
+    return status.value if rsmi_ret_ok(ret) else -1
+
+
 # PCIE functions
 def smi_get_device_pcie_bandwidth(dev):
     """returns list of possible pcie bandwidths for the device in bytes/sec"""
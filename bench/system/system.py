@@ -1,9 +1,12 @@
+import os
+import asyncio
 import shutil
-from typing import List
+from typing import Dict, List, Optional, Tuple
 import cpuinfo
 import psutil
 import platform
 import time
+import numpy as np
 from pynvml import *
 from bench.system.rocml import *
 
@@ -11,10 +14,14 @@ from bench.system.rocml import *
 from rich.console import Console
 from rich.table import Table
 
+from bench.system.accelerators.accelerator import PowerSamples, average_power
 from bench.system.accelerators.amd import AMDAccelerator
+from bench.system.accelerators.fake import FakeAccelerator
 from bench.system.accelerators.apple import *
 from bench.logger import logger
 from bench.system.accelerators.nvidia import NvidiaAccelerator
+from bench.system.accelerators.sysfs import HwmonAccelerator, RaplAccelerator, find_gpu_hwmons
+from bench.system.host import ProcessTreeMonitor
     
 class System():
 
@@ -28,13 +35,25 @@ class System():
         self.cpu_total_cores = psutil.cpu_count(logical=True)
         self.ram = psutil.virtual_memory().total / 1024 / 1024 / 1024
         self.accelerators = []
-
-        self._init_nvidia()
-        self._init_amd()
-        self._init_apple()
-
-        if len(self.accelerators) > 1:
-            raise SystemExit("Error: Only a single accelerator device is currently supported")
+        # cpu/memory/io of the runtime servers, sampled alongside the accelerator power
+        self.host_monitors = {None: ProcessTreeMonitor()}
+
+        # fake devices stand in for the real ones, for running without a gpu
+        if os.environ.get("BENCH_FAKE_ACCELERATOR"):
+            self._init_fake(int(os.environ["BENCH_FAKE_ACCELERATOR"]))
+        else:
+            self._init_nvidia()
+            self._init_amd()
+            self._init_hwmon()
+            self._init_apple()
+
+            # nothing to run on but the CPU, measure that instead
+            if len(self.accelerators) == 0:
+                self._init_rapl()
+
+        # samples are tagged with the device they came from
+        for device, accelerator in enumerate(self.accelerators):
+            accelerator.device = device
 
     def get_sys_info(self):
         return {
@@ -45,6 +64,29 @@ class System():
             "RAM": f"{self.ram:.2f}GB"
         }
         
+    # GPUs that only report power through the kernel, e.g. AMD cards without rocm-smi.
+    # only used when nothing better was found, it would also pick up the ones rocm-smi found
+    def _init_hwmon(self):
+        if len(self.accelerators) > 0:
+            return
+
+        try:
+            for path in find_gpu_hwmons():
+                self.accelerators.append(HwmonAccelerator(path))
+        except Exception as e:
+            logger.info(f"Error initializing hwmon devices: {e}")
+
+    def _init_rapl(self):
+        try:
+            if RaplAccelerator.available():
+                self.accelerators.append(RaplAccelerator(self.cpu_name))
+        except Exception as e:
+            logger.info(f"Error initializing RAPL: {e}")
+
+    def _init_fake(self, device_count):
+        for device in range(device_count):
+            self.accelerators.append(FakeAccelerator(device))
+
     def _init_apple(self):
         if self.uname.system == "Darwin" and 'arm' in self.architecture.lower():
             self.accelerators.append(AppleAccelerator())
@@ -98,30 +140,113 @@ class System():
     def get_accelerator_info_string(self):
         if len(self.accelerators) == 0:
             return "No accelerators found"
-        
-        return self.accelerators[0].get_basic_info_string()
-    
-    def power_start(self, name):
+
+        infos = [accelerator.get_basic_info_string() for accelerator in self.accelerators]
+        if len(set(infos)) == 1 and len(infos) > 1:
+            return f"{len(infos)}x{infos[0]}"
+        return "+".join(infos)
+
+    # indices into self.accelerators for a test, None is all of them
+    def resolve_devices(self, devices = None) -> List[int]:
+        if devices is None:
+            return list(range(len(self.accelerators)))
+
+        devices = sorted(set(int(d) for d in devices))
+        missing = [d for d in devices if d < 0 or d >= len(self.accelerators)]
+        if missing:
+            raise Exception(f"Devices {missing} not found, there are {len(self.accelerators)} accelerators")
+        return devices
+
+    # environment that keeps a runtime server on the given devices, e.g. CUDA_VISIBLE_DEVICES.
+    # empty if the devices can't be picked (or all of them are used anyway)
+    def device_env(self, devices) -> Dict[str, str]:
+        devices = self.resolve_devices(devices)
+        if devices == self.resolve_devices():
+            return {}
+
+        env = {}
+        for device in devices:
+            accelerator = self.accelerators[device]
+            variable = accelerator.visible_devices_variable
+            if variable is None:
+                logger.warning(f"Can't limit a runtime to {accelerator.get_basic_info_string()}, it will see every device")
+                return {}
+            env[variable] = ",".join(filter(None, [env.get(variable), str(accelerator.index)]))
+
+        # cuda numbers devices fastest first by default, nvml numbers them by bus id
+        if "CUDA_VISIBLE_DEVICES" in env:
+            env["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
+        return env
+
+    def power_start(self, name, devices = None):
         if (len(self.accelerators) == 0):
             # TODO we should have a more robust way of handling this
             raise Exception("No accelerators found")
 
-        # TODO support multiple devices
-        self.accelerators[0].start_power_monitor(name)
-        return time.time()
-
+        devices = self.resolve_devices(devices)
+        start_time = time.perf_counter()
+        self.power_monitor[name] = (start_time, devices)
+        for device in devices:
+            self.accelerators[device].start_power_monitor(name)
+        return start_time
+
+    # average draw of each device while nothing is running, the monitor just has to
+    # be open for a while. name should end in -idle
+    async def measure_idle_power(self, name, seconds, devices = None) -> Dict[int, float]:
+        self.power_start(name, devices)
+        await asyncio.sleep(seconds)
+        _, _, _, _, device_watts = self.power_stop(name)
+        return device_watts
+
+    # average watts and the latest temperature (None if it isn't reported) of a device
+    # over the last `seconds`, None if it wasn't sampled in that time
+    def device_state(self, device, seconds = 1) -> Optional[Tuple[float, Optional[float]]]:
+        samples = self.accelerators[device].recent_samples(seconds)
+        if len(samples) == 0:
+            return None
+
+        temperatures = samples.field("temperature")
+        temperatures = temperatures[~np.isnan(temperatures)]
+        return float(np.mean(samples.watts)), float(temperatures[-1]) if len(temperatures) else None
+
+    # the total watts, the samples of every device, the end time, the joules the energy
+    # counter of each device measured (None for devices without one) and the watts of each device
     def power_stop(self, name):
         if (len(self.accelerators) == 0):
             # TODO we should have a more robust way of handling this (just use cpu)
             # should imply # GPU layers is 0 for sure.
             raise Exception("No accelerators found") 
 
-        # TODO instead of always picking index 0, we should have a way to specify the device
-        # probably by prompting the user which GPU's to use, and how to use them. 
-        samples = self.accelerators[0].end_power_monitor(name)
-        avg_watts = sum([sample.watts for sample in samples]) / len(samples)
+        start_time, devices = self.power_monitor.pop(name)
+        readings = {device: self.accelerators[device].end_power_monitor(name) for device in devices}
+        end_time = time.perf_counter()
+
+        device_energy = {}
+        device_watts = {}
+        for device, (device_samples, energy) in readings.items():
+            device_energy[device] = energy
+            # prefer the hardware counter when the device has one
+            if energy is not None and end_time > start_time:
+                device_watts[device] = energy / (end_time - start_time)
+            else:
+                device_watts[device] = average_power(device_samples, start_time, end_time)
+
+        samples = PowerSamples.concat(device_samples for device_samples, _ in readings.values())
+        return (sum(device_watts.values()), samples, end_time, device_energy, device_watts)
+
+
+    # sample the process tree of a runtime server, None stops sampling. tests running
+    # side by side on different devices each watch their own server under their own key
+    def host_watch(self, pid, key = None):
+        if key not in self.host_monitors:
+            self.host_monitors[key] = ProcessTreeMonitor()
+        self.host_monitors[key].watch(pid)
+
+    def host_start(self, name, key = None):
+        self.host_monitors[key].start_monitor(name)
 
-        return (avg_watts, samples, time.time())
+    def host_stop(self, name, key = None):
+        return self.host_monitors[key].end_monitor(name)
 
 
 system = System()
\ No newline at end of file
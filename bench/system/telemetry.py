@@ -0,0 +1,166 @@
+import argparse
+import atexit
+import importlib
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# fields of every record in the ring, in order. anything a device doesn't report is NaN
+FIELDS = ["time", "watts", "utilization", "memory_used", "sm_clock", "mem_clock",
+          "temperature", "throttle_reasons", "throttled"]
+# about 45 minutes of samples at 100/s, 20MB. measurement windows are much shorter
+DEFAULT_CAPACITY = 1 << 18
+HEADER_BYTES = 8
+
+# a fixed size ring of telemetry records in shared memory, with a single writer (the
+# sampler) and any number of readers. the header holds the total number of records
+# ever written, so a position in the ring is just that count and a measurement
+# window is a pair of positions.
+class TelemetryRing():
+
+    def __init__(self, capacity = DEFAULT_CAPACITY, name = None):
+        size = HEADER_BYTES + capacity * len(FIELDS) * 8
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        if not self.owner:
+            # the process that created it is the one that unlinks it
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        self.name = self.shm.name
+        self.capacity = capacity
+        self.header = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self.records = np.ndarray((capacity, len(FIELDS)), dtype=np.float64, buffer=self.shm.buf, offset=HEADER_BYTES)
+        if self.owner:
+            self.header[0] = 0
+
+    @property
+    def count(self):
+        return int(self.header[0])
+
+    def write(self, record):
+        count = self.count
+        self.records[count % self.capacity] = record
+        # publish the record only once it's fully written
+        self.header[0] = count + 1
+
+    # records written in [start, end), oldest first, and the position of the first one.
+    # positions that have already been overwritten are skipped
+    def read(self, start, end = None):
+        end = self.count if end is None else end
+        start = max(start, end - self.capacity, 0)
+        if end <= start:
+            return start, np.empty((0, len(FIELDS)))
+
+        first, last = start % self.capacity, end % self.capacity
+        if first < last:
+            return start, self.records[first:last].copy()
+        return start, np.concatenate([self.records[first:], self.records[:last]])
+
+    def close(self):
+        # numpy views have to go before the buffer can be released
+        self.header = None
+        self.records = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def to_record(now, watts, telemetry):
+    return [now, watts] + [float(telemetry[field]) if telemetry.get(field) is not None else math.nan
+                           for field in FIELDS[2:]]
+
+# samples `accelerator` into `ring` every `interval` seconds until `running` returns False
+def sample_into(ring: TelemetryRing, accelerator, interval, running = lambda: True):
+    while running():
+        sample_start = time.perf_counter()
+        watts = accelerator._get_power_usage()
+
+        # watts could be None if the sample couldn't be taken (or needs a first sample to start)
+        if (watts):
+            ring.write(to_record(sample_start, watts, accelerator._get_telemetry()))
+        time.sleep(interval)
+
+# runs the sampling loop for an accelerator in its own process so it doesn't compete
+# with the benchmark for the GIL. the child gets the accelerator class and its
+# arguments and creates its own instance. time.perf_counter is the system wide
+# monotonic clock, so timestamps from the child line up with the parent's
+class TelemetrySampler():
+
+    def __init__(self, ring: TelemetryRing, accelerator_class, args, interval):
+        self.ring = ring
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join([root, os.environ.get("PYTHONPATH", "")])}
+        # its own session so ctrl-c goes to the benchmark, it exits once the benchmark does
+        self.proc = subprocess.Popen([
+            sys.executable, "-m", "bench.system.telemetry",
+            "--accelerator", f"{accelerator_class.__module__}:{accelerator_class.__qualname__}",
+            "--args", json.dumps(args),
+            "--ring", ring.name,
+            "--capacity", str(ring.capacity),
+            "--interval", str(interval),
+            "--parent", str(os.getpid()),
+        ], env=env, start_new_session=True)
+        atexit.register(self.stop)
+
+    def running(self):
+        return self.proc.poll() is None
+
+    def stop(self):
+        if self.running():
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+# same as TelemetrySampler but on a thread, for accelerators that can't be sampled
+# from another process. it has to be stopped before the ring is closed under it
+class TelemetryThread():
+
+    def __init__(self, ring: TelemetryRing, accelerator, interval):
+        self.ring = ring
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=sample_into, args=(ring, accelerator, interval, lambda: not self.stopped.is_set()))
+        self.thread.daemon = True  # set as daemon thread so it exits with the main thread
+        self.thread.start()
+
+    def running(self):
+        return self.thread.is_alive()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description='Telemetry sampler')
+    parser.add_argument('--accelerator', type=str, required=True)
+    parser.add_argument('--args', type=str, default='[]')
+    parser.add_argument('--ring', type=str, required=True)
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY)
+    parser.add_argument('--interval', type=float, default=0.01)
+    parser.add_argument('--parent', type=int, required=True)
+    args = parser.parse_args()
+
+    module, name = args.accelerator.split(":")
+    accelerator_class = getattr(importlib.import_module(module), name)
+    accelerator_class.init_sampler_process()
+    accelerator = accelerator_class(*json.loads(args.args), sample=False)
+
+    ring = TelemetryRing(args.capacity, args.ring)
+    try:
+        # stop once the benchmark is gone
+        sample_into(ring, accelerator, args.interval, lambda: os.getppid() == args.parent)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+if __name__ == "__main__":
+    main()
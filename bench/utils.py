@@ -1,7 +1,10 @@
+from contextlib import contextmanager
 from dataclasses import dataclass
+import time
 import numpy as np
 import psutil
 import requests
+import socket
 from rich.console import Console
 from rich.layout import Layout
 from threading import Event
@@ -9,7 +12,11 @@ from threading import Event
 import os.path
 from concurrent.futures import ThreadPoolExecutor
 
-from typing import Callable, List, TypedDict
+from typing import Callable, Dict, List, TypedDict
+
+from bench.aggregates import Aggregate
+from bench.logger import logger
+from bench.system.accelerators.accelerator import PowerSamples, integrate_power
 
 console = Console()
 layout = Layout()
@@ -46,6 +53,27 @@ def kill(proc_pid):
         proc.kill()
     process.kill()
 
+# drop a file's pages from the OS page cache so the next read comes from disk.
+# works without root since only our own clean pages are dropped
+def evict_page_cache(path):
+    if not hasattr(os, "posix_fadvise"):
+        logger.warning(f"Can't evict {path} from the page cache on this platform")
+        return False
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+    return True
+
+# a port nothing is listening on right now, for runtime servers started side by side
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
 def handle_sigint(signum, frame):
     done_event.set()
 
@@ -68,34 +96,205 @@ class Column:
     display: bool
     compute: Callable[[List], float]
     format: Callable[[float], str] = lambda x: f"{round(x, 2)}"
+    # computed from watts or energy, these get an incremental (above idle) twin
+    power: bool = False
+    # a total that grows with every result (counts, elapsed time), it has no confidence interval
+    total: bool = False
+    # creates a running version of compute for the live table, see bench.aggregates
+    aggregate: Callable[[], Aggregate] = None
+
+
+# where the harness itself spends time during a request, as opposed to waiting on the server
+HARNESS_PHASES = ["build", "decode", "result", "power", "host"]
+
+class HarnessTimer():
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
 
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+# selectors can return a single value or a list of values per result
+# (e.g. per token latencies), lists are pooled together
+def select_values(results, selector):
+    values = []
+    for r in results:
+        value = selector(r)
+        if isinstance(value, list):
+            values.extend(value)
+        else:
+            values.append(value)
+
+    return values
 
 def calculate_percentile(results, percentile, selector):
-    values = [selector(r) for r in results]
+    values = select_values(results, selector)
+    if len(values) == 0:
+        return 0
+
     return np.percentile(values, percentile)
 
-def create_percentile_columns(attribute_name, selector, display=False):
-    return [
-        Column(f"p1 {attribute_name}", display, 
-               lambda results: calculate_percentile(results, 1, selector),
-               lambda x: f"[green]{round(x)}ms[/green]"),
-        
-        Column(f"p25 {attribute_name}", display, 
-               lambda results: calculate_percentile(results, 25, selector),
-               lambda x: f"[green]{round(x)}ms[/green]"),
-        
-        Column(f"p50 {attribute_name}", display, 
-               lambda results: calculate_percentile(results, 50, selector),
-               lambda x: f"[green]{round(x)}ms[/green]"),
-        
-        Column(f"p75 {attribute_name}", display, 
-               lambda results: calculate_percentile(results, 75, selector),
-               lambda x: f"[green]{round(x)}ms[/green]"),
-        
-        Column(f"p99 {attribute_name}", display, 
-               lambda results: calculate_percentile(results, 99, selector),
-               lambda x: f"[green]{round(x)}ms[/green]"),
-    ]
+# a bootstrap resample of `full`. what was measured over the whole window (energy, wall
+# time) can't be measured again for a resample, which has gaps and repeats, so the
+# full window is split between the results in proportion to their own share instead
+class Resample(list):
+
+    def __init__(self, items, full, cache):
+        super().__init__(items)
+        self.full = full
+        # shared by every resample of `full`, the full window is only computed once
+        self.cache = cache
+
+    def window(self, name, compute):
+        if name not in self.cache:
+            self.cache[name] = compute(self.full)
+        return self.cache[name]
+
+    def share(self, name, compute, weight):
+        total = sum(weight(r) for r in self.full)
+        return self.window(name, compute) * sum(weight(r) for r in self) / total if total else 0
+
+# wall clock time from the first request starting to the last one finishing.
+# with concurrent requests this is less than the sum of the request times
+def calculate_wall_time(results):
+    if isinstance(results, Resample):
+        return results.share("wall time", calculate_wall_time, lambda r: r.time)
+    return max(r.end_time for r in results) - min(r.start_time for r in results)
+
+# joules used over the whole window the results were running in. concurrent
+# requests share power samples, so each sample is only counted once
+def calculate_window_energy(results):
+    if isinstance(results, Resample):
+        return results.share("energy", calculate_window_energy, lambda r: r.energy)
+
+    samples = PowerSamples.concat(r.power_samples for r in results)
+    if len(samples) == 0:
+        return sum(r.energy for r in results)
+
+    energy = integrate_power(samples, min(r.start_time for r in results), max(r.end_time for r in results))
+
+    # with an energy counter the runs measured exactly what the samples only estimate,
+    # so scale the window by how far off the samples were for the runs
+    sampled = sum(r.sampled_energy for r in results)
+    if sampled:
+        energy *= sum(r.energy for r in results) / sampled
+
+    return energy
+
+# window energy of each device the results ran on, for models split across devices
+def calculate_device_energy(results):
+    devices = {}
+    samples = PowerSamples.concat(r.power_samples for r in results)
+    for device in sorted({device for r in results for device in r.device_energy}):
+        energy = integrate_power(samples.for_device(device), min(r.start_time for r in results), max(r.end_time for r in results))
+        sampled = sum(r.device_sampled_energy.get(device, 0) for r in results)
+        if sampled:
+            energy *= sum(r.device_energy.get(device, 0) for r in results) / sampled
+        devices[device] = energy
+    return devices
+
+def format_device_energy(device_energy):
+    return " ".join(f"{device}:{round(energy, 2)}J" for device, energy in device_energy.items())
+
+# average power over the whole window the results were running in
+def calculate_window_watts(results):
+    return calculate_window_energy(results) / calculate_wall_time(results)
+
+# the part of the window energy that went to one phase of the requests (e.g. prefill_energy).
+# overlapping requests each count the shared power, so their phases are scaled down
+# to add up to the energy actually used over the window
+def calculate_phase_energy(results, attribute):
+    total = sum(r.energy for r in results)
+    if total == 0:
+        return 0
+
+    return calculate_window_energy(results) * sum(getattr(r, attribute) for r in results) / total
+
+@dataclass
+class ColumnStats:
+    mean: float
+    std: float
+    ci_low: float
+    ci_high: float
+
+    # half the width of the confidence interval relative to `value`
+    def relative_half_width(self, value):
+        half_width = (self.ci_high - self.ci_low) / 2
+        if value == 0:
+            return 0 if half_width == 0 else float("inf")
+        return abs(half_width / value)
+
+# the suffixes of the statistics reported for each column in repetition mode
+STAT_SUFFIXES = ["mean", "std", "ci low", "ci high"]
+
+def stats_row(stats: Dict[str, ColumnStats]):
+    row = {}
+    for name, column_stats in stats.items():
+        row[f"{name} mean"] = column_stats.mean
+        row[f"{name} std"] = column_stats.std
+        row[f"{name} ci low"] = column_stats.ci_low
+        row[f"{name} ci high"] = column_stats.ci_high
+    return row
+
+# mean, standard deviation and percentile confidence interval of each column over
+# `resamples` bootstrap resamples of the results. every column sees the same resamples.
+# columns that can't be computed on a resample (e.g. nothing to divide by) are left out
+def bootstrap_columns(results, columns: List[Column], resamples = 200, confidence = 0.95, seed = 0):
+    rng = np.random.default_rng(seed)
+    cache = {}
+    draws = [Resample([results[i] for i in rng.integers(0, len(results), len(results))], results, cache)
+             for _ in range(resamples)]
+    tail = (1 - confidence) / 2 * 100
+
+    stats = {}
+    for column in columns:
+        values = []
+        for draw in draws:
+            try:
+                value = column.compute(draw)
+            except (ZeroDivisionError, ValueError, TypeError):
+                continue
+            if value is not None and np.isfinite(value):
+                values.append(float(value))
+
+        if len(values) > 1:
+            low, high = np.percentile(values, [tail, 100 - tail])
+            stats[column.name] = ColumnStats(float(np.mean(values)), float(np.std(values, ddof=1)), float(low), float(high))
+
+    return stats
+
+class IncrementalResult():
+
+    def __init__(self, result, samples):
+        vars(self).update(vars(result))
+        self.watts = result.incremental_watts
+        self.energy = result.incremental_energy
+        self.sampled_energy = result.sampled_energy - result.idle_watts * result.time
+        self.power_samples = samples
+        if result.first_token_time is not None:
+            self.prefill_energy = result.prefill_energy - result.idle_watts * (result.first_token_time - result.start_time)
+            self.decode_energy = result.decode_energy - result.idle_watts * (result.end_time - result.first_token_time)
+
+# the results with the idle draw of its device taken off every power sample, so the power columns
+# can be computed again for only what the work itself used. shifted samples keep their ring
+# index, so the ones shared between results are still only counted once
+def incremental_results(results):
+    if isinstance(results, Resample):
+        # the same incremental results for every resample, so their window is computed once
+        full = results.window("incremental", incremental_results)
+        incremental = results.window("incremental by id", lambda full_results: dict(zip(map(id, full_results), full)))
+        return Resample([incremental[id(r)] for r in results], full, results.window("incremental cache", lambda _: {}))
+
+    return [IncrementalResult(r, PowerSamples.of(r.power_samples).shifted(r.device_idle_watts)) for r in results]
 
 class FileSpec(TypedDict):
     url: str
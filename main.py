@@ -1,4 +1,5 @@
 from bench.benchmarker import Benchmarker
+from bench.benchmarks.sweep import parse_slos
 from bench.config import update_store_dirs
 from bench.system.system import system
 from bench.logger import logger
@@ -16,12 +17,34 @@ async def main():
     parser.add_argument('--info', action='store_true', default=False, help='Display system information without running the benchmark')
     parser.add_argument('--download', action='store_true', default=False, help='Download the models and datasets without running the benchmark')
     parser.add_argument('--benchmark', type=str, default='all', help='Specify the benchmark to run. Comma separated list of language, hearing, vision, creation. Default is all.')
+    parser.add_argument('--concurrency', type=str, default='1', help='Comma separated list of concurrency levels (e.g. 1,4,8). Runtimes that support it keep this many requests in flight. Default is 1.')
+    parser.add_argument('--rate', type=str, default=None, help='Comma separated list of offered request rates (requests/sec). Runs language, vision and hearing open loop at each rate instead of one request after another.')
+    parser.add_argument('--arrival', type=str, default='poisson', choices=['poisson', 'constant'], help='Arrival process used with --rate. Default is poisson.')
+    parser.add_argument('--sweep', action='store_true', default=False, help='Ramp the concurrency of each llamafile test (the --concurrency levels, or powers of 2 up to 64) until an SLO is violated and report the knee as goodput.')
+    parser.add_argument('--slo', type=str, default='p99 ttft<500', help='Comma separated latency objectives for --sweep, e.g. "p99 ttft<500,p99 latency<5000" (ms). Default is "p99 ttft<500".')
+    parser.add_argument('--cold-start', action='store_true', default=False, help='Drop each model from the page cache and time a cold load before the (warm) load used for the test. Comfy loads the checkpoint with the first prompt, so it has no cold load columns.')
+    parser.add_argument('--idle-window', type=float, default=None, help='Seconds to measure the idle power draw for before each test, it is subtracted for the incremental power columns. Adds this much time to every test. 0 to skip. Default is 5, or 0 with --fast.')
+    parser.add_argument('--warmup-cv', type=float, default=0, help='Before each test, repeat a request until the coefficient of variation of the throughput over the last 5 batches is below this, e.g. 0.05. The warmup requests are not recorded and can add up to --warmup-requests requests to every test (minutes for creation). Default is 0, no warmup.')
+    parser.add_argument('--warmup-requests', type=int, default=50, help='Most requests to send while warming up with --warmup-cv. Default is 50.')
+    parser.add_argument('--cooldown-timeout', type=float, default=0, help='After each test, wait up to this many seconds for the power and temperature to get back near the baseline measured before the first test, e.g. 300. Can add up to this much time to every test. Default is 0, no cooldown.')
+    parser.add_argument('--tolerance', type=float, default=None, help='Repetition mode: run the dataset items (shuffled, repeating them once they run out) until the confidence interval of every displayed column is within this fraction of its value, e.g. 0.02, and report the mean, std and bootstrap confidence interval of every column. Replaces the default dataset sizes.')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Confidence level of the intervals in repetition mode. Default is 0.95.')
+    parser.add_argument('--max-repetitions', type=int, default=10, help='Most passes over the dataset in repetition mode before giving up on the tolerance. Default is 10.')
+    parser.add_argument('--time-budget', type=str, default=None, help='Fit the whole run into this much time, e.g. 3600, 90m or 2h. The items each test runs are picked from the timings of earlier runs (or a short probe) to get the most confidence out of the time. Replaces the default dataset sizes.')
+    parser.add_argument('--devices', type=str, default=None, help='Comma separated accelerator indices (as listed by --info) to run on, e.g. 0,1. Models that set devices in config.yaml use those instead. Default is all of them, energy is summed across them.')
+    parser.add_argument('--shard', action='store_true', default=False, help='Run tests on each of the --devices at the same time, one test per device, each runtime server on its own port. Models that set devices in config.yaml run alone afterwards.')
     parser.add_argument('--store', type=str, default='.store', help='Specify the base directory for storing models, datasets, runtimes, etc.')
     # parser.add_argument('--recompile', action='store_true', default=False, help='Recompile the runtime cod')
     # parser.add_argument('--cpu', type=int, help='Specify the number of CPU cores to use')
     # parser.add_argument('--download_path', type=str, help='Specify the download path')
 
     args = parser.parse_args()
+    # a bad SLO would otherwise only fail once the first sweep level has run
+    if args.sweep:
+        try:
+            parse_slos(args.slo)
+        except ValueError as e:
+            parser.error(str(e))
     update_store_dirs(args.store)
 
     if args.verbose:
@@ -37,7 +60,7 @@ async def main():
     await benchmarker.download()
 
     if not args.download:
-        benchmarker.benchmark(args.benchmark)
+        await benchmarker.benchmark(args.benchmark)
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from bench.benchmarks.benchmark_test import BenchmarkResult
+from bench.metrics import PERCENTILES, Incremental, Percentile, ResultArrays, WindowEnergy
+from bench.system.accelerators.accelerator import PowerMonitorSample
+
+# the running aggregate of an expression against the expression itself, on the same results
+def both(expression, results):
+    aggregate = expression.aggregate()
+    for result in results:
+        aggregate.add(result)
+    return aggregate.value(), expression.evaluate(ResultArrays(results))
+
+def latency_results(rng, count):
+    return [SimpleNamespace(ttft=float(rng.lognormal(4, 0.5)), itl=rng.gamma(2, 10, size=rng.integers(1, 20)).tolist())
+            for _ in range(count)]
+
+# up to five values are kept as they are
+@pytest.mark.parametrize("count", range(1, 6))
+def test_quantile_is_exact_for_few_values(count):
+    results = latency_results(np.random.default_rng(count), count)
+    for percentile in PERCENTILES:
+        estimate, exact = both(Percentile(percentile, "ttft"), results)
+        assert estimate == pytest.approx(exact)
+
+# P² is an estimate, it has to land within a percentile or so of the exact rank
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("field", ["ttft", "itl"])
+def test_quantile_estimates_the_percentile(seed, field):
+    results = latency_results(np.random.default_rng(seed), 1000)
+    values = ResultArrays(results).samples(field)
+    for percentile in PERCENTILES:
+        estimate, exact = both(Percentile(percentile, field), results)
+        assert np.mean(values <= estimate) == pytest.approx(percentile / 100, abs=0.015)
+        assert estimate == pytest.approx(exact, rel=0.1)
+
+class Data:
+    ttft = None
+
+# a ring of samples per device read by windows that overlap or touch, in random order
+# like concurrent requests finish. every window starts and ends on a sample, so
+# clipping to the window doesn't change the energy and the aggregate has to be exact
+def window_results(rng, count, counter):
+    times = np.cumsum(rng.uniform(0.005, 0.015, size=count * 20))
+    watts = {device: rng.uniform(100, 300, size=len(times)) for device in (0, 1)}
+    results = []
+    start = 0
+    for _ in range(count):
+        end = start + int(rng.integers(1, 25))
+        samples = [PowerMonitorSample(float(watts[device][i]), float(times[i]), index=i, device=device)
+                   for device in (0, 1) for i in range(start, end + 1)]
+        energy = {device: float(rng.uniform(1, 5)) for device in (0, 1)} if counter else None
+        results.append(BenchmarkResult(Data(), float(times[start]), float(times[end]), 400.0, samples,
+                                       device_idle_watts={0: 30.0, 1: 32.5}, device_counter_energy=energy))
+        start = max(end - int(rng.integers(0, 10)), 0)
+    rng.shuffle(results)
+    return results
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("counter", [False, True])
+@pytest.mark.parametrize("expression", [WindowEnergy(), Incremental(WindowEnergy())], ids=["window", "incremental"])
+def test_window_energy_matches_the_metric(seed, counter, expression):
+    running, exact = both(expression, window_results(np.random.default_rng(seed), 30, counter))
+    assert running == pytest.approx(exact, rel=1e-9)
+
+# samples outside of the window are counted by the aggregate, so it can only be close
+def test_window_energy_past_the_window():
+    results = window_results(np.random.default_rng(0), 30, False)
+    for result in results:
+        result.start_time += 0.002
+        result.end_time -= 0.002
+    running, exact = both(WindowEnergy(), results)
+    assert running == pytest.approx(exact, rel=0.01)
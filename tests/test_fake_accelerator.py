@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+import pytest
+
+from bench.benchmarks.benchmark_test import BenchmarkResult
+from bench.system.accelerators.accelerator import PowerSamples, integrate_power
+from bench.system.accelerators.fake import FakeAccelerator
+from bench.system.system import System
+
+@pytest.fixture
+def fake_system(monkeypatch):
+    monkeypatch.setenv("BENCH_FAKE_ACCELERATOR", "2")
+    return System()
+
+class Data:
+    ttft = None
+
+def test_sampler_records_telemetry():
+    accelerator = FakeAccelerator(0)
+    accelerator.start_power_monitor("run")
+    start = time.perf_counter()
+    time.sleep(0.3)
+    samples, energy = accelerator.end_power_monitor("run")
+
+    assert energy is None
+    assert len(samples) > 5
+    # consecutive ring positions, in time order
+    assert [s.index for s in samples] == list(range(samples[0].index, samples[0].index + len(samples)))
+    assert all(a.time < b.time for a, b in zip(samples, samples[1:]))
+    # the window starts with the last sample from before the monitor opened, still idle
+    busy = [s for s in samples if s.time > start]
+    assert len(busy) >= len(samples) - 2
+    assert all(s.watts == 250 and s.utilization == 100 and s.sm_clock == 2000 for s in busy)
+    assert all(s.throttled is False and s.throttle_reasons == 0 for s in busy)
+
+def test_idle_monitor_reads_idle_power(fake_system):
+    device_watts = asyncio.run(fake_system.measure_idle_power("test-idle", 0.2))
+
+    assert device_watts == pytest.approx({0: 30, 1: 30})
+
+def test_power_integrates_across_devices(fake_system):
+    start_time = fake_system.power_start("run")
+    time.sleep(0.3)
+    watts, samples, end_time, device_energy, device_watts = fake_system.power_stop("run")
+
+    assert {s.device for s in samples} == {0, 1}
+    assert device_energy == {0: None, 1: None}
+    assert device_watts == pytest.approx({0: 250, 1: 250}, rel=0.1)
+    assert integrate_power(samples, start_time, end_time) == pytest.approx(500 * (end_time - start_time), rel=0.1)
+
+    result = BenchmarkResult(Data(), start_time, end_time, watts, samples, device_idle_watts={0: 30, 1: 30})
+    assert result.energy_source == "sampled"
+    assert result.device_energy[0] == pytest.approx(250 * result.time, rel=0.1)
+    assert result.energy == pytest.approx(sum(result.device_energy.values()))
+    assert result.incremental_energy == pytest.approx(result.energy - 60 * result.time)
+
+# overlapping windows read the same ring records, they are only counted once
+def test_overlapping_windows_share_samples():
+    accelerator = FakeAccelerator(0)
+    accelerator.start_power_monitor("a")
+    time.sleep(0.1)
+    accelerator.start_power_monitor("b")
+    time.sleep(0.1)
+    a, _ = accelerator.end_power_monitor("a")
+    b, _ = accelerator.end_power_monitor("b")
+
+    both = PowerSamples.concat([a, b])
+    assert len(both.unique()) == len(set(a.index.tolist()) | set(b.index.tolist())) < len(both)
+    assert integrate_power(both, a.time[0], b.time[-1]) == pytest.approx(integrate_power(list(a) + list(b), a.time[0], b.time[-1]))
@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+from bench import config
+from bench.benchmarks.planner import MIN_ITEMS, TimePlanner
+from bench.benchmarks.sweep import SWEEP_ROUNDS, fit_sweep, sweep_size
+
+LEVELS = [1, 2, 4, 8, 16, 32, 64]
+
+def test_sweep_that_fits_is_left_alone():
+    items = list(range(10))
+    assert fit_sweep(items, LEVELS, sweep_size(10, LEVELS)) == (items, LEVELS)
+
+# the dataset is cut before any level is dropped, a level is never shorter than SWEEP_ROUNDS per slot
+def test_sweep_is_bounded_by_the_budget():
+    items = list(range(100))
+    fitted, levels = fit_sweep(items, LEVELS, 400)
+    assert levels == LEVELS[:6]
+    assert sweep_size(len(fitted), levels) <= 400
+    assert len(fitted) < 100
+
+    fitted, levels = fit_sweep(items, LEVELS, 1)
+    assert (len(fitted), levels) == (1, [1])
+    assert sweep_size(1, [1]) == SWEEP_ROUNDS
+
+def make_test(tag):
+    return SimpleNamespace(tag=tag, results=[], result_count=0)
+
+# a flat guess of the overhead of the tests that haven't run would eat the budget
+def test_probed_overhead_is_the_guess_for_the_others(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "RUN_STORE_DIR", str(tmp_path))
+    planner = TimePlanner(600, str(tmp_path / "run"), "gpu")
+    tests = [make_test(f"test-{i}") for i in range(20)]
+    planner.add_tests("language", tests, lambda test: 1000)
+
+    planner.test_started(tests[0])
+    probe = [SimpleNamespace(time=1.0, start_time=i, end_time=i + 1.0) for i in range(2)]
+    planner.observe_probe(tests[0], probe, overhead=2.0)
+
+    assert planner.items_for(tests[0]) > 10 * MIN_ITEMS
+    assert planner.eta() <= planner.remaining()
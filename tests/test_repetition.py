@@ -0,0 +1,35 @@
+import asyncio
+
+from bench.benchmarks import repetition
+from bench.benchmarks.repetition import run_repetitions
+
+class FakeTest:
+    tag = "model-runtime"
+
+    def __init__(self):
+        self.results = []
+        self.result_count = 0
+
+    async def run(self, item):
+        await asyncio.sleep(0)
+        self.results.append(item)
+        self.result_count += 1
+        return item
+
+# every check bootstraps all the results so far, they have to get further apart
+def test_checks_get_further_apart(monkeypatch):
+    checks = []
+    def check_intervals(results, columns, confidence):
+        checks.append(len(results))
+        return float("inf")
+    monkeypatch.setattr(repetition, "check_intervals", check_intervals)
+    monkeypatch.setattr(repetition, "bootstrap_columns", lambda *args: {})
+
+    test = FakeTest()
+    result = asyncio.run(run_repetitions(test, range(100), [], [], 0.01, max_repetitions=20, concurrency=4))
+
+    assert len(test.results) == 2000 and not result.converged
+    # the results are read on a thread, the workers can get a few past the check meanwhile
+    assert 5 <= checks[0] < 10
+    assert all(a < b for a, b in zip(checks, checks[1:])) and checks[-1] - checks[-2] > 150
+    assert len(checks) < 60
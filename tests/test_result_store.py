@@ -0,0 +1,180 @@
+import asyncio
+import json
+import math
+
+import pytest
+
+from bench.benchmarks.benchmark_test import BenchmarkResult
+from bench.benchmarks.creation import CreationBenchmarkResult
+from bench.benchmarks.hearing import HearingBenchmarkResult
+from bench.benchmarks.language import LanguageBenchmarkResult
+from bench.benchmarks.sweep import SWEEP_ROUNDS, parse_slos, run_sweep
+from bench.metrics import compute_metrics, suite_metrics
+from bench.result_store import ResultLog, ResultStore, compact_result_log
+from bench.system.accelerators.accelerator import PowerMonitorSample
+from bench.system.host import HostSample
+
+def language_data(i):
+    token_times = [20.0 + 10 * t + (i % 3) for t in range(8)]
+    timings = {"prompt_ms": 15.0 + i, "predicted_ms": 80.0, "prompt_n": 32 + i, "predicted_n": 8,
+               "prompt_per_second": 2000.0, "predicted_per_second": 100.0 - i}
+    return LanguageBenchmarkResult("prompt", {"timings": timings}, "response", 20.0 + i, token_times)
+
+def hearing_data(i):
+    return HearingBenchmarkResult({"text": "words", "duration": 30.0 + i, "transcribe_time": 1500.0 + 100 * i})
+
+def creation_data(i):
+    return CreationBenchmarkResult(4.0 + i / 10, [0.1 + i / 100] * 20, 1.0 if i == 0 else 0)
+
+# llamafile answers vision prompts with a LanguageBenchmarkResult too
+SUITES = {"language": language_data, "vision": language_data, "hearing": hearing_data, "creation": creation_data}
+
+# results one after another on two devices, the ring samples at the edges of each run
+# are shared with the run next to it like they are in a real window
+def make_results(data, device_idle_watts, count=6):
+    results = []
+    for i in range(count):
+        start, end = 10.0 + i, 10.75 + i
+        power = [PowerMonitorSample(200.0 + 10 * device + (k % 4) * 2.5, start + k * 0.25, 90.0, 8e9, 1800.0, 9000.0,
+                                    60.5, 0, False, index=i * 4 + k, device=device)
+                 for device in (0, 1) for k in range(5)]
+        host = [HostSample(start + k * 0.25, 105.5, 3e9, 100 * k, 0, 50 * k, 0, 4096 * k) for k in range(4)]
+        result = BenchmarkResult(data(i), start, end, 420.0, power, host, device_idle_watts)
+        result.add_harness_time({"build": 0.001, "decode": 0.002})
+        results.append(result)
+    return results
+
+def assert_same_row(stored, expected):
+    assert stored.keys() == expected.keys()
+    for name, value in expected.items():
+        if isinstance(value, float) and math.isnan(value):
+            assert math.isnan(stored[name]), name
+        else:
+            assert stored[name] == pytest.approx(value, rel=1e-6), name
+
+# an idle window of 0 leaves device_idle_watts empty, and suites without a ttft have no
+# first_token_time. both have to come back for the incremental columns
+@pytest.mark.parametrize("suite", SUITES)
+@pytest.mark.parametrize("device_idle_watts", [None, {0: 30.0, 1: 32.5}])
+def test_columns_recomputed_from_the_store(tmp_path, suite, device_idle_watts):
+    metrics = suite_metrics(suite)
+    results = make_results(SUITES[suite], device_idle_watts)
+    expected = compute_metrics(results, metrics)
+
+    log = ResultLog(str(tmp_path))
+    for result in results:
+        log.append("model-runtime", result)
+    log.close()
+    compact_result_log(str(tmp_path), {"model-runtime": expected})
+
+    stored = ResultStore(str(tmp_path)).results("model-runtime")
+    assert len(stored) == len(results)
+    assert stored[0].device_idle_watts == (device_idle_watts or {})
+    assert stored[0].first_token_time == results[0].first_token_time
+    assert_same_row(compute_metrics(stored, metrics), expected)
+
+def test_partial_log_is_compacted_when_opened(tmp_path):
+    results = make_results(language_data, None)
+    log = ResultLog(str(tmp_path))
+    for result in results:
+        log.append("model-runtime", result)
+    log.close()
+    # a run killed mid write
+    with open(tmp_path / "results.jsonl", "a") as f:
+        f.write('{"test": "model-runtime", "scal')
+
+    store = ResultStore(str(tmp_path))
+    assert store.rows == len(results)
+    assert list(store.column("ttft")) == [r.ttft for r in results]
+
+# a sweep logs every level under the same tag, the row is only the knee's
+def test_sweep_levels_are_told_apart(tmp_path):
+    class Test:
+        tag = "model-runtime"
+        keep_results = True
+        results = []
+        pending = iter(make_results(language_data, None, count=SWEEP_ROUNDS * (1 + 2)))
+
+        async def run(self, item):
+            self.results.append(next(self.pending))
+            return self.results[-1]
+
+    log = ResultLog(str(tmp_path))
+    test = Test()
+    sweep = asyncio.run(run_sweep(test, ["item"], [1, 2], parse_slos("p99 ttft<500"),
+                                  lambda result: log.append(test.tag, result)))
+    log.close()
+    expected = compute_metrics(sweep.results, suite_metrics("language"))
+    compact_result_log(str(tmp_path), {test.tag: expected})
+
+    store = ResultStore(str(tmp_path))
+    assert sweep.knee_concurrency == 2
+    assert store.rows == SWEEP_ROUNDS * 3
+    assert_same_row(compute_metrics(store.results(test.tag, concurrency=2), suite_metrics("language")), expected)
+
+# neighbouring results share their edge samples, the log and the store only have them once
+def test_shared_samples_are_stored_once(tmp_path):
+    results = make_results(language_data, None)
+    log = ResultLog(str(tmp_path))
+    for result in results:
+        log.append("model-runtime", result)
+    log.flush()
+    with open(tmp_path / "results.jsonl") as f:
+        lines = [json.loads(line) for line in f]
+    log.close()
+
+    logged = [key for line in lines if line.get("trace") == "power"
+              for key in zip(line["samples"]["device"], line["samples"]["index"])]
+    assert len(set(logged)) == len(logged) == 2 * (len(results) * 4 + 1)
+    assert sum(len(r.power_samples) for r in results) > len(logged)
+
+    store = ResultStore(str(tmp_path))
+    assert len(store.trace("power")["index"]) == len(logged)
+    for result, stored in zip(results, store.results("model-runtime")):
+        assert stored.power_samples.index.tolist() == result.power_samples.index.tolist()
+        assert stored.power_samples.records.tolist() == result.power_samples.records.tolist()
+        assert [s.time for s in stored.host_samples] == [s.time for s in result.host_samples]
+
+# the row of a test is computed from its results read back from the log. sharded tests
+# log interleaved, and a test's first sample can be the last one of the test before it
+@pytest.mark.parametrize("suite", SUITES)
+def test_results_read_back_from_the_log(tmp_path, suite):
+    metrics = suite_metrics(suite)
+    results = make_results(SUITES[suite], {0: 30.0, 1: 32.5}, count=12)
+    first, second = results[:6], results[6:]
+    expected = {"first": compute_metrics(first, metrics), "second": compute_metrics(second, metrics)}
+
+    log = ResultLog(str(tmp_path))
+    for a, b in zip(first, second):
+        log.append("first", a)
+        log.append("second", b)
+    for tag, row in expected.items():
+        assert_same_row(compute_metrics(log.results(tag), metrics), row)
+    log.close()
+
+    compact_result_log(str(tmp_path), expected)
+    store = ResultStore(str(tmp_path))
+    for tag, row in expected.items():
+        assert_same_row(compute_metrics(store.results(tag), metrics), row)
+
+# without keeping its results a sweep only holds the level it is running
+def test_sweep_row_from_the_log(tmp_path):
+    class Test:
+        tag = "model-runtime"
+        keep_results = False
+        results = []
+        pending = iter(make_results(language_data, None, count=SWEEP_ROUNDS * (1 + 2)))
+
+        async def run(self, item):
+            return next(self.pending)
+
+    log = ResultLog(str(tmp_path))
+    test = Test()
+    sweep = asyncio.run(run_sweep(test, ["item"], [1, 2], parse_slos("p99 ttft<500"),
+                                  lambda result: log.append(test.tag, result)))
+
+    assert sweep.results == [] and test.results == []
+    assert sweep.level == sweep.knee_concurrency == 2
+    knee = log.results(test.tag, sweep.level)
+    assert [r.concurrency for r in knee] == [2] * SWEEP_ROUNDS * 2
+    log.close()
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from bench.runtimes.sse import SSEParser
+
+STREAM = (
+    b": keep-alive comment\r\n"
+    b"data: {\"content\": \"Hello\"}\r\n"
+    b"\r\n"
+    b"event: token\n"
+    b"id: 7\n"
+    b"data: first line\n"
+    b"data: second line\n"
+    b"\n"
+    b"data:no space\r"
+    b"\r"
+    b"data: caf\xc3\xa9 \xe2\x9c\x93\r\n"
+    b": a comment between fields\r\n"
+    b"data\r\n"
+    b"\r\n"
+    b"event: stop\n"
+    b"data: {\"stop\": true}"
+)
+
+EXPECTED = [
+    ("message", None, "{\"content\": \"Hello\"}"),
+    ("token", "7", "first line\nsecond line"),
+    ("message", "7", "no space"),
+    ("message", "7", "café ✓\n"),
+    # the stream ends without a blank line, close() dispatches it
+    ("stop", "7", "{\"stop\": true}"),
+]
+
+def parse(chunks):
+    parser = SSEParser()
+    events = [event for chunk in chunks for event in parser.feed(chunk)]
+    events += parser.close()
+    return [(event.event, event.id, event.data) for event in events]
+
+def random_chunks(data, rng):
+    chunks = []
+    start = 0
+    while start < len(data):
+        end = start + rng.randint(1, 12)
+        chunks.append(data[start:end])
+        start = end
+    return chunks
+
+def test_whole_stream():
+    assert parse([STREAM]) == EXPECTED
+
+def test_one_byte_at_a_time():
+    assert parse([STREAM[i:i + 1] for i in range(len(STREAM))]) == EXPECTED
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_chunks(seed):
+    assert parse(random_chunks(STREAM, random.Random(seed))) == EXPECTED
+
+# a \r ending a chunk may be half of a \r\n, the \n in the next chunk must not end another line
+def test_crlf_split_across_chunks():
+    parser = SSEParser()
+    assert parser.feed(b"data: a\r") == []
+    assert parser.feed(b"\n\r") == []
+    events = parser.feed(b"\ndata: b\r\n\r\n")
+    assert [event.data for event in events] == ["a", "b"]
+    assert parser.close() == []
+
+def test_trailing_cr_at_the_end_of_the_stream():
+    parser = SSEParser()
+    assert parser.feed(b"data: a\r") == []
+    assert [event.data for event in parser.close()] == ["a"]
@@ -0,0 +1,111 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from bench.system.accelerators import sysfs
+from bench.system.accelerators.sysfs import HwmonAccelerator, RaplAccelerator, find_gpu_hwmons, find_rapl_zones
+
+def write(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(f"{value}\n")
+
+# perf_counter as seen by the backends, stepped by the test
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(sysfs, "time", SimpleNamespace(perf_counter=lambda: clock.now))
+    return clock
+
+@pytest.fixture
+def rapl(tmp_path, monkeypatch):
+    monkeypatch.setenv("BENCH_SYSFS_ROOT", str(tmp_path))
+    powercap = tmp_path / "class" / "powercap"
+    for zone, name, energy in [("intel-rapl:0", "package-0", 900_000), ("intel-rapl:0:0", "core", 0),
+                               ("intel-rapl:1", "dram", 0), ("intel-rapl:2", "psys", 0)]:
+        write(powercap / zone / "name", name)
+        write(powercap / zone / "max_energy_range_uj", 1_000_000)
+        write(powercap / zone / "energy_uj", energy)
+    return powercap
+
+def test_rapl_counts_package_and_dram(rapl):
+    assert [zone.name for zone in find_rapl_zones()] == ["package-0", "dram"]
+    assert RaplAccelerator.available()
+
+def test_rapl_unwraps_the_counter(rapl):
+    zone = find_rapl_zones()[0]
+    assert zone.read() == 0
+
+    # 900000 -> 100000 went past max_energy_range_uj once
+    write(rapl / "intel-rapl:0" / "energy_uj", 100_000)
+    assert zone.read() == 200_000
+    write(rapl / "intel-rapl:0" / "energy_uj", 300_000)
+    assert zone.read() == 400_000
+
+def test_rapl_power_across_a_wraparound(rapl, clock):
+    accelerator = RaplAccelerator(sample=False)
+    start = accelerator._get_energy_counter()
+    # the first sample has nothing to compare to
+    assert accelerator._get_power_usage() is None
+
+    clock.now += 0.5
+    write(rapl / "intel-rapl:0" / "energy_uj", 950_000)
+    write(rapl / "intel-rapl:1" / "energy_uj", 25_000)
+    assert accelerator._get_power_usage() == pytest.approx(0.15)
+
+    clock.now += 0.5
+    write(rapl / "intel-rapl:0" / "energy_uj", 50_000)
+    assert accelerator._get_power_usage() == pytest.approx(0.2)
+    assert accelerator._get_energy_counter() - start == pytest.approx(0.175)
+
+@pytest.fixture
+def hwmon(tmp_path, monkeypatch):
+    monkeypatch.setenv("BENCH_SYSFS_ROOT", str(tmp_path))
+    hwmons = tmp_path / "class" / "hwmon"
+
+    gpu = tmp_path / "devices" / "0000:03:00.0"
+    write(gpu / "class", "0x030000")
+    write(gpu / "gpu_busy_percent", 97)
+    write(gpu / "mem_info_vram_total", 16_000_000_000)
+    write(gpu / "mem_info_vram_used", 4_000_000_000)
+    write(hwmons / "hwmon0" / "name", "amdgpu")
+    os.symlink(gpu, hwmons / "hwmon0" / "device")
+    write(hwmons / "hwmon0" / "power1_average", 150_000_000)
+    write(hwmons / "hwmon0" / "power1_cap", 300_000_000)
+    write(hwmons / "hwmon0" / "temp1_input", 65_000)
+    write(hwmons / "hwmon0" / "freq1_input", 2_000_000_000)
+
+    # a network card reporting power is not an accelerator
+    write(tmp_path / "devices" / "0000:05:00.0" / "class", "0x020000")
+    write(hwmons / "hwmon1" / "power1_input", 5_000_000)
+    os.symlink(tmp_path / "devices" / "0000:05:00.0", hwmons / "hwmon1" / "device")
+    return hwmons
+
+def test_hwmon_finds_display_controllers(hwmon):
+    assert find_gpu_hwmons() == [str(hwmon / "hwmon0")]
+
+def test_hwmon_reads_power_and_telemetry(hwmon):
+    accelerator = HwmonAccelerator(str(hwmon / "hwmon0"), sample=False)
+
+    assert accelerator.name == "amdgpu 0000:03:00.0"
+    assert accelerator.power_limit == 300
+    assert accelerator._get_power_usage() == 150
+    assert accelerator._get_energy_counter() is None
+    assert accelerator._get_telemetry() == {
+        "utilization": 97,
+        "memory_used": 4_000_000_000,
+        "sm_clock": 2000,
+        "temperature": 65,
+    }
+
+def test_hwmon_power_from_the_energy_counter(hwmon, clock):
+    os.remove(hwmon / "hwmon0" / "power1_average")
+    write(hwmon / "hwmon0" / "energy1_input", 1_000_000)
+    accelerator = HwmonAccelerator(str(hwmon / "hwmon0"), sample=False)
+    assert accelerator._get_power_usage() is None
+
+    clock.now += 0.25
+    write(hwmon / "hwmon0" / "energy1_input", 51_000_000)
+    assert accelerator._get_power_usage() == pytest.approx(200)
+    assert accelerator._get_energy_counter() == pytest.approx(51)